@@ -0,0 +1,233 @@
+# Разбиение длинных аудиозаписей на фрагменты по паузам и склейка расшифровок
+
+import io
+import re
+import os
+import subprocess
+import tempfile
+import wave
+from dataclasses import dataclass
+from typing import List, Optional, Union
+
+import numpy as np
+
+# Всё, что не WAV, декодируется ffmpeg в этот формат: 16 кГц, моно, 16 бит
+SAMPLE_RATE = 16000
+FRAME_SECONDS = 0.03
+
+
+class AudioDecodeError(Exception):
+    """Аудио не удалось декодировать."""
+
+
+@dataclass
+class AudioSegment:
+    """Фрагмент записи в формате WAV; `start`/`end` — секунды от начала записи, с учётом перекрытия."""
+
+    index: int
+    start: float
+    end: float
+    data: bytes
+    content_type: str = "audio/wav"
+
+
+def _read_wav(source: Union[bytes, str]):
+    with wave.open(io.BytesIO(source) if isinstance(source, bytes) else source, "rb") as wav:
+        if wav.getsampwidth() != 2 or wav.getcomptype() != "NONE":
+            return None
+        channels = wav.getnchannels()
+        rate = wav.getframerate()
+        samples = np.frombuffer(wav.readframes(wav.getnframes()), dtype="<i2")
+    if channels > 1:
+        samples = samples.reshape(-1, channels).mean(axis=1).astype(np.int16)
+    return samples, rate
+
+
+def decode_audio(source: Union[bytes, str], content_type: str):
+    """
+    Возвращает (отсчёты int16 моно, частота дискретизации).
+
+    16-битный PCM WAV читается напрямую, остальные форматы (ogg, m4a)
+    декодируются ffmpeg.
+    """
+    if content_type == "audio/wav":
+        try:
+            decoded = _read_wav(source)
+        except (wave.Error, EOFError) as e:
+            raise AudioDecodeError(f"Некорректный WAV: {e}")
+        if decoded is not None:
+            return decoded
+
+    command = ["ffmpeg", "-nostdin", "-hide_banner", "-loglevel", "error"]
+    command += ["-i", "pipe:0" if isinstance(source, bytes) else source]
+    command += ["-f", "s16le", "-ac", "1", "-ar", str(SAMPLE_RATE), "pipe:1"]
+    try:
+        result = subprocess.run(
+            command,
+            input=source if isinstance(source, bytes) else None,
+            capture_output=True,
+            check=True,
+        )
+    except FileNotFoundError:
+        raise AudioDecodeError("ffmpeg не установлен")
+    except subprocess.CalledProcessError as e:
+        raise AudioDecodeError(f"ffmpeg: {e.stderr.decode(errors='replace').strip()}")
+    return np.frombuffer(result.stdout, dtype="<i2"), SAMPLE_RATE
+
+
+def probe_duration(source: Union[bytes, str], content_type: str) -> Optional[float]:
+    """
+    Длительность записи в секундах без декодирования; None, если её не удалось узнать.
+
+    Для WAV она читается из заголовка, для остальных форматов — из
+    метаданных контейнера через ffprobe. ffprobe нужен файл с произвольным
+    доступом (длительность ogg известна только по последней странице),
+    поэтому содержимое в памяти записывается во временный файл.
+    """
+    if content_type == "audio/wav":
+        try:
+            with wave.open(io.BytesIO(source) if isinstance(source, bytes) else source, "rb") as wav:
+                return wav.getnframes() / wav.getframerate()
+        except (wave.Error, EOFError, ZeroDivisionError):
+            return None
+
+    path = source
+    if isinstance(source, bytes):
+        with tempfile.NamedTemporaryFile(prefix="ingria-probe-", delete=False) as f:
+            f.write(source)
+            path = f.name
+    command = ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "default=noprint_wrappers=1:nokey=1", path]
+    try:
+        result = subprocess.run(command, capture_output=True, check=True)
+        return float(result.stdout.decode().strip())
+    except (FileNotFoundError, subprocess.CalledProcessError, ValueError):
+        return None
+    finally:
+        if path is not source:
+            os.unlink(path)
+
+
+def encode_wav(samples: np.ndarray, rate: int) -> bytes:
+    output = io.BytesIO()
+    with wave.open(output, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(samples.astype("<i2").tobytes())
+    return output.getvalue()
+
+
+def frame_levels(samples: np.ndarray, rate: int, frame_seconds: float = FRAME_SECONDS) -> np.ndarray:
+    """Уровень громкости (дБ относительно полной шкалы) для каждого кадра длиной `frame_seconds`."""
+    frame = max(1, int(rate * frame_seconds))
+    count = len(samples) // frame
+    frames = samples[: count * frame].reshape(count, frame).astype(np.float32)
+    rms = np.sqrt(np.mean(frames * frames, axis=1))
+    return 20 * np.log10(rms / 32768 + 1e-10)
+
+
+def find_cut_points(
+    levels: np.ndarray,
+    segment_frames: int,
+    max_segment_frames: int,
+    silence_frames: int,
+) -> List[int]:
+    """
+    Выбирает кадры для разрезов так, чтобы фрагменты были не длиннее `max_segment_frames`.
+
+    Каждый разрез ищется между половиной и максимумом длины фрагмента в
+    самом тихом месте (уровень усреднён по `silence_frames` кадрам — пауза
+    должна быть не короче этого). Из почти одинаково тихих мест выбирается
+    ближайшее к желаемой длине `segment_frames`.
+    """
+    window = max(1, silence_frames)
+    smoothed = np.convolve(levels, np.ones(window) / window, mode="same")
+    cuts = []
+    start = 0
+    while len(levels) - start > max_segment_frames:
+        low = start + max(1, segment_frames // 2)
+        high = start + max_segment_frames
+        candidates = smoothed[low:high]
+        quiet = np.flatnonzero(candidates <= candidates.min() + 1.0) + low
+        cut = int(quiet[np.argmin(np.abs(quiet - (start + segment_frames)))])
+        cuts.append(cut)
+        start = cut
+    return cuts
+
+
+def split_audio(
+    samples: np.ndarray,
+    rate: int,
+    segment_seconds: float = 60.0,
+    max_segment_seconds: float = 90.0,
+    overlap_seconds: float = 1.0,
+    min_silence_seconds: float = 0.3,
+) -> List[AudioSegment]:
+    """
+    Делит запись на фрагменты по паузам.
+
+    Каждый фрагмент, кроме первого, начинается на `overlap_seconds` раньше
+    разреза: слово, попавшее на границу, целиком окажется хотя бы в одном
+    фрагменте, а повтор убирает `stitch_transcripts`.
+    """
+    frame = max(1, int(rate * FRAME_SECONDS))
+    cuts = find_cut_points(
+        frame_levels(samples, rate),
+        segment_frames=int(segment_seconds / FRAME_SECONDS),
+        max_segment_frames=int(max_segment_seconds / FRAME_SECONDS),
+        silence_frames=int(min_silence_seconds / FRAME_SECONDS),
+    )
+    bounds = [0] + [cut * frame for cut in cuts] + [len(samples)]
+    overlap = int(overlap_seconds * rate)
+    segments = []
+    for index, (begin, end) in enumerate(zip(bounds, bounds[1:])):
+        begin = max(0, begin - overlap) if index else begin
+        segments.append(AudioSegment(index, begin / rate, end / rate, encode_wav(samples[begin:end], rate)))
+    return segments
+
+
+def segment_audio(
+    source: Union[bytes, str],
+    content_type: str,
+    min_duration: float,
+    segment_seconds: float = 60.0,
+    max_segment_seconds: float = 90.0,
+    overlap_seconds: float = 1.0,
+) -> Optional[List[AudioSegment]]:
+    """
+    Декодирует запись и делит её на фрагменты; None, если запись не длиннее `min_duration` секунд.
+
+    Сначала длительность проверяется по заголовку или метаданным: короткие
+    записи (большинство голосовых сообщений) не декодируются вовсе.
+    """
+    duration = probe_duration(source, content_type)
+    if duration is not None and duration <= min_duration:
+        return None
+    samples, rate = decode_audio(source, content_type)
+    if len(samples) / rate <= min_duration:
+        return None
+    return split_audio(samples, rate, segment_seconds, max_segment_seconds, overlap_seconds)
+
+
+def _normalize(word: str) -> str:
+    return re.sub(r"\W", "", word.lower())
+
+
+def stitch_transcripts(texts: List[str], max_overlap_words: int = 30) -> str:
+    """
+    Склеивает расшифровки соседних фрагментов.
+
+    Из-за перекрытия фрагментов конец одной расшифровки может повторяться в
+    начале следующей. Самый длинный такой повтор (не меньше двух слов,
+    без учёта регистра и пунктуации) удаляется.
+    """
+    words: List[str] = []
+    for text in texts:
+        next_words = text.split()
+        limit = min(max_overlap_words, len(words), len(next_words))
+        tail = [_normalize(word) for word in words[-limit:]] if limit else []
+        head = [_normalize(word) for word in next_words[:limit]]
+        overlap = next((size for size in range(limit, 1, -1) if tail[-size:] == head[:size]), 0)
+        # Повтор берётся из следующего фрагмента: там у него есть продолжение, и пунктуация точнее
+        words[len(words) - overlap:] = next_words
+    return " ".join(words)
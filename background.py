@@ -0,0 +1,19 @@
+# Остановка фоновых задач asyncio
+
+import asyncio
+from typing import Iterable
+
+
+async def cancel_until_done(tasks: Iterable[asyncio.Task], recheck: float = 1.0) -> None:
+    """
+    Отменяет задачи и ждёт их завершения.
+
+    asyncio.wait_for в Python 3.11 теряет отмену, если ожидание завершилось
+    одновременно с ней, и задача-обработчик продолжает цикл. Поэтому задачи,
+    не завершившиеся за `recheck` секунд, отменяются повторно.
+    """
+    pending = set(tasks)
+    while pending:
+        for task in pending:
+            task.cancel()
+        _, pending = await asyncio.wait(pending, timeout=recheck)
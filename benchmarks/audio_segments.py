@@ -0,0 +1,105 @@
+"""
+Бенчмарк длинных аудиозаписей: время ответа в зависимости от длительности
+записи при отправке целиком и при разбиении на фрагменты.
+
+Gemini заменён моделью задержки: `--base` секунд на запрос плюс
+`--per-audio-second` секунд на каждую секунду аудио и `--per-char` секунд на
+каждый символ ответа. Разбиение записи (декодирование WAV, поиск пауз,
+кодирование фрагментов) выполняется по-настоящему и входит в замер.
+
+    python benchmarks/audio_segments.py --minutes 1 3 5 10 20 --concurrency 4
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from audio import encode_wav, segment_audio, stitch_transcripts  # noqa: E402
+
+RATE = 16000
+# Примерно столько символов в минуте расшифровки
+CHARS_PER_SECOND = 15
+
+
+def make_recording(seconds: float) -> bytes:
+    """Фразы по 2–6 секунд с паузами 0,3–1 секунда."""
+    rng = np.random.default_rng(0)
+    parts, total = [], 0.0
+    while total < seconds:
+        phrase = rng.uniform(2, 6)
+        pause = rng.uniform(0.3, 1.0)
+        t = np.arange(int(phrase * RATE)) / RATE
+        parts.append((np.sin(2 * np.pi * 220 * t) * 8000).astype(np.int16))
+        parts.append(np.zeros(int(pause * RATE), dtype=np.int16))
+        total += phrase + pause
+    return encode_wav(np.concatenate(parts)[: int(seconds * RATE)], RATE)
+
+
+class LatencyModel:
+    def __init__(self, base: float, per_audio_second: float, per_char: float):
+        self.base = base
+        self.per_audio_second = per_audio_second
+        self.per_char = per_char
+
+    async def call(self, audio_seconds: float, output_chars: int) -> str:
+        await asyncio.sleep(self.base + self.per_audio_second * audio_seconds + self.per_char * output_chars)
+        return "слово " * (output_chars // 6)
+
+
+async def single_shot(model: LatencyModel, seconds: float) -> None:
+    # Один запрос: расшифровка всей записи и ответ Ингрии
+    await model.call(seconds, int(seconds * CHARS_PER_SECOND) + 1500)
+
+
+async def segmented(model: LatencyModel, recording: bytes, concurrency: int, segment_seconds: float, max_segment_seconds: float) -> int:
+    segments = await asyncio.to_thread(segment_audio, recording, "audio/wav", 0, segment_seconds, max_segment_seconds, 1.0)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def transcribe(segment):
+        async with semaphore:
+            duration = segment.end - segment.start
+            return await model.call(duration, int(duration * CHARS_PER_SECOND))
+
+    transcripts = await asyncio.gather(*(transcribe(segment) for segment in segments))
+    stitch_transcripts(transcripts)
+    # Анализ в роли Ингрии по тексту: аудио в запросе нет
+    await model.call(0, 1500)
+    return len(segments)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--minutes", type=float, nargs="+", default=[1, 3, 5, 10, 20])
+    parser.add_argument("--concurrency", type=int, default=4, help="AUDIO_SEGMENT_CONCURRENCY")
+    parser.add_argument("--segment-seconds", type=float, default=60)
+    parser.add_argument("--max-segment-seconds", type=float, default=90)
+    parser.add_argument("--base", type=float, default=0.8)
+    parser.add_argument("--per-audio-second", type=float, default=0.01)
+    parser.add_argument("--per-char", type=float, default=0.0004)
+    args = parser.parse_args()
+
+    model = LatencyModel(args.base, args.per_audio_second, args.per_char)
+    print(f"{'минут':>6} {'целиком, с':>11} {'фрагментов':>11} {'по фрагментам, с':>17} {'ускорение':>10}")
+    for minutes in args.minutes:
+        seconds = minutes * 60
+        recording = make_recording(seconds)
+
+        started = time.perf_counter()
+        asyncio.run(single_shot(model, seconds))
+        whole = time.perf_counter() - started
+
+        started = time.perf_counter()
+        count = asyncio.run(segmented(model, recording, args.concurrency, args.segment_seconds, args.max_segment_seconds))
+        split = time.perf_counter() - started
+
+        print(f"{minutes:>6g} {whole:>11.2f} {count:>11} {split:>17.2f} {whole / split:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
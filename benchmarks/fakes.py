@@ -0,0 +1,273 @@
+"""
+Локальные заменители Gemini и Supabase для бенчмарков.
+
+Заменители подставляются вместо `main.model` и `main.supabase` и повторяют
+ту часть API, которой пользуется main.py: generate_content_async, таблицы
+users и analysis_results, Storage. Задержка и доля ошибок настраиваются
+для каждого сервиса отдельно.
+"""
+
+import asyncio
+import random
+import re
+import threading
+from dataclasses import dataclass
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+
+class FakeServiceError(Exception):
+    """Искусственная ошибка внешнего сервиса."""
+
+
+@dataclass
+class Latency:
+    """Задержка вызова: `mean` ± `jitter` секунд (равномерно) и доля вызовов с ошибкой."""
+
+    mean: float = 0.0
+    jitter: float = 0.0
+    error_rate: float = 0.0
+
+    def sample(self) -> float:
+        return max(0.0, self.mean + random.uniform(-self.jitter, self.jitter))
+
+    def fails(self) -> bool:
+        return random.random() < self.error_rate
+
+
+class FakeGemini:
+    """Gemini: ответ фиксированной длины через заданную задержку, с usage_metadata."""
+
+    def __init__(self, latency: Latency, text: str = "Описание от Ингрии. " * 40, chunks: int = 8):
+        self.latency = latency
+        self.text = text
+        self.chunks = chunks
+        self.calls = 0
+
+    def _usage(self):
+        return SimpleNamespace(prompt_token_count=1290, candidates_token_count=len(self.text) // 4, cached_content_token_count=0)
+
+    async def generate_content_async(self, contents, stream=False, **kwargs):
+        self.calls += 1
+        delay = self.latency.sample()
+        if self.latency.fails():
+            await asyncio.sleep(delay / 2)
+            raise FakeServiceError("Gemini: 503 Service Unavailable")
+        if stream:
+            return FakeGeminiStream(self.text, self.chunks, delay, self._usage())
+        await asyncio.sleep(delay)
+        return SimpleNamespace(text=self.text, usage_metadata=self._usage())
+
+
+class FakeGeminiStream:
+    def __init__(self, text: str, chunks: int, delay: float, usage):
+        size = max(1, len(text) // chunks)
+        self.parts = [text[i:i + size] for i in range(0, len(text), size)]
+        self.delay = delay
+        self.usage_metadata = usage
+
+    async def __aiter__(self):
+        for part in self.parts:
+            await asyncio.sleep(self.delay / len(self.parts))
+            yield SimpleNamespace(text=part)
+
+
+class FakeSupabase:
+    """
+    Supabase: таблицы в памяти и Storage.
+
+    Повторяет форму supabase AsyncClient: запрос строится синхронно, а
+    execute() и методы Storage — корутины, задержка имитируется asyncio.sleep.
+    """
+
+    def __init__(self, db_latency: Latency, storage_latency: Latency):
+        self.db_latency = db_latency
+        self.storage_latency = storage_latency
+        self.tables: Dict[str, List[dict]] = {"users": [], "analysis_results": []}
+        self.lock = threading.Lock()
+        self.storage = FakeStorage(storage_latency)
+
+    def table(self, name: str) -> "FakeQuery":
+        return FakeQuery(self, name)
+
+    def seed_analysis_results(self, count: int, users: int = 10) -> None:
+        """Заполняет analysis_results записями с разными временами и пользователями."""
+        start = datetime(2025, 1, 1).timestamp()
+        rows = self.tables["analysis_results"]
+        for index in range(count):
+            rows.append({
+                "id": len(rows) + 1,
+                "timestamp": datetime.fromtimestamp(start + index * 60).isoformat(),
+                "user_id": f"user-{index % users}",
+                "ai_response": f"Описание записи {index}. " * 20,
+                "file_name": f"photo_{index}.jpg",
+                "file_path": f"https://storage.local/files/photo_{index}.jpg",
+                "content_hash": None,
+                "content_type": "image/jpeg",
+            })
+            add_generated_columns(rows[-1])
+
+    async def _wait(self) -> None:
+        await asyncio.sleep(self.db_latency.sample())
+        if self.db_latency.fails():
+            raise FakeServiceError("Supabase: 500 Internal Server Error")
+
+
+def add_generated_columns(row: dict) -> None:
+    # Как в migrations/003_analysis_list_pagination.sql: summary = left(ai_response, 200)
+    row["summary"] = (row.get("ai_response") or "")[:200]
+
+
+# Разбор фильтра из SupabaseStore.select_analysis_page: timestamp.lt."T",and(timestamp.eq."T",id.lt.N)
+KEYSET_FILTER = re.compile(r'timestamp\.lt\."(?P<ts>[^"]+)",and\(timestamp\.eq\."[^"]+",id\.lt\.(?P<id>\d+)\)')
+
+
+class FakeQuery:
+    def __init__(self, client: FakeSupabase, table: str):
+        self.client = client
+        self.table = table
+        self.operation = "select"
+        self.columns: Optional[List[str]] = None
+        self.filters = []
+        self.orders = []
+        self.limit_count: Optional[int] = None
+        self.single_row = False
+        self.payload: List[dict] = []
+        self.on_conflict: Optional[str] = None
+
+    def select(self, columns: str = "*"):
+        self.columns = None if columns.strip() == "*" else [column.strip() for column in columns.split(",")]
+        return self
+
+    def insert(self, rows):
+        self.operation = "insert"
+        self.payload = rows if isinstance(rows, list) else [rows]
+        return self
+
+    def upsert(self, rows, on_conflict: Optional[str] = None):
+        self.operation = "upsert"
+        self.payload = rows if isinstance(rows, list) else [rows]
+        self.on_conflict = on_conflict
+        return self
+
+    def eq(self, column: str, value):
+        self.filters.append(lambda row: str(row.get(column)) == str(value))
+        return self
+
+    def gt(self, column: str, value):
+        self.filters.append(lambda row: row.get(column) > value)
+        return self
+
+    def in_(self, column: str, values):
+        values = set(values)
+        self.filters.append(lambda row: row.get(column) in values)
+        return self
+
+    def or_(self, expression: str):
+        match = KEYSET_FILTER.fullmatch(expression)
+        if match is None:
+            raise ValueError(f"Неподдерживаемый фильтр: {expression}")
+        timestamp, record_id = match["ts"], int(match["id"])
+        self.filters.append(lambda row: (row["timestamp"], row["id"]) < (timestamp, record_id))
+        return self
+
+    def order(self, column: str, desc: bool = False):
+        self.orders.append((column, desc))
+        return self
+
+    def limit(self, count: int):
+        self.limit_count = count
+        return self
+
+    def single(self):
+        self.single_row = True
+        return self
+
+    async def execute(self):
+        await self.client._wait()
+        with self.client.lock:
+            rows = self.client.tables[self.table]
+            if self.operation == "insert":
+                data = self._insert(rows)
+            elif self.operation == "upsert":
+                data = self._upsert(rows)
+            else:
+                data = self._select(rows)
+        return SimpleNamespace(data=data)
+
+    def _insert(self, rows: List[dict]) -> List[dict]:
+        inserted = []
+        for row in self.payload:
+            row = {"id": len(rows) + 1, **row}
+            if self.table == "analysis_results":
+                add_generated_columns(row)
+            rows.append(row)
+            inserted.append(dict(row))
+        return inserted
+
+    def _upsert(self, rows: List[dict]) -> List[dict]:
+        key = self.on_conflict or "id"
+        existing = {row[key]: row for row in rows}
+        result = []
+        for row in self.payload:
+            if row[key] not in existing:
+                existing[row[key]] = {"id": f"user-{len(rows) + 1}", **row}
+                rows.append(existing[row[key]])
+            result.append(dict(existing[row[key]]))
+        return result
+
+    def _select(self, rows: List[dict]):
+        selected = [row for row in rows if all(check(row) for check in self.filters)]
+        for column, desc in reversed(self.orders):
+            selected.sort(key=lambda row: row[column], reverse=desc)
+        if self.limit_count is not None:
+            selected = selected[:self.limit_count]
+        if self.columns is not None:
+            selected = [{column: row.get(column) for column in self.columns} for row in selected]
+        else:
+            selected = [dict(row) for row in selected]
+        if self.single_row:
+            return selected[0] if selected else None
+        return selected
+
+
+class FakeStorage:
+    def __init__(self, latency: Latency):
+        self.latency = latency
+        self.objects: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    async def _wait(self) -> None:
+        await asyncio.sleep(self.latency.sample())
+        if self.latency.fails():
+            raise FakeServiceError("Storage: 500 Internal Server Error")
+
+    async def list_buckets(self) -> list:
+        return [SimpleNamespace(name="files")]
+
+    async def create_bucket(self, name: str) -> dict:
+        return {"name": name}
+
+    def from_(self, bucket: str) -> "FakeBucket":
+        return FakeBucket(self, bucket)
+
+
+class FakeBucket:
+    def __init__(self, storage: FakeStorage, name: str):
+        self.storage = storage
+        self.name = name
+
+    async def exists(self, path: str) -> bool:
+        await self.storage._wait()
+        return path in self.storage.objects
+
+    async def upload(self, path: str, file, file_options: Optional[dict] = None):
+        await self.storage._wait()
+        size = len(file) if isinstance(file, bytes) else len(file.read())
+        with self.storage.lock:
+            self.storage.objects[path] = size
+        return SimpleNamespace(path=path)
+
+    async def get_public_url(self, path: str) -> str:
+        return f"https://storage.local/{self.name}/{path}"
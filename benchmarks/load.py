@@ -0,0 +1,204 @@
+"""
+Нагрузочный бенчмарк без внешних сервисов.
+
+Приложение запускается в этом же процессе через ASGI-транспорт httpx, а
+Gemini и Supabase заменяются заменителями из benchmarks/fakes.py с
+настраиваемой задержкой и долей ошибок. Для каждого сценария выводятся
+пропускная способность, доля ошибок и p50/p95/p99 задержки.
+
+    python benchmarks/load.py --scenarios analyze list details --requests 500 --concurrency 32 \\
+        --gemini-latency 1.2 --gemini-jitter 0.4 --gemini-error-rate 0.01 --db-latency 0.03
+
+С `--json` результат дополнительно записывается в файл для сравнения между сборками.
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import math
+import os
+import random
+import sys
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Awaitable, Callable, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# main.py читает настройки при импорте
+os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+os.environ.setdefault("SUPABASE_URL", "http://127.0.0.1:54321")
+os.environ.setdefault("SUPABASE_KEY", "benchmark")
+os.environ.setdefault("STARTUP_WARMUP", "0")
+os.environ.setdefault("RATE_LIMIT_ENABLED", "0")
+os.environ.setdefault("PROMPT_SYSTEM_INSTRUCTION", "0")
+
+import httpx  # noqa: E402
+
+from benchmarks.fakes import FakeGemini, FakeSupabase, Latency  # noqa: E402
+
+SCENARIOS = ("analyze", "list", "details")
+
+
+@dataclass
+class ScenarioResult:
+    scenario: str
+    requests: int
+    errors: int
+    seconds: float
+    throughput: float
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    status_codes: dict = field(default_factory=dict)
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Перцентиль по ближайшему рангу."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def make_jpeg(size=(1024, 768)) -> bytes:
+    from PIL import Image
+
+    image = Image.effect_noise(size, 40).convert("RGB")
+    output = io.BytesIO()
+    image.save(output, format="JPEG", quality=85)
+    return output.getvalue()
+
+
+async def run_scenario(name: str, send: Callable[[int], Awaitable[httpx.Response]], requests: int, concurrency: int) -> ScenarioResult:
+    latencies: List[float] = []
+    status_codes: dict = {}
+    counter = iter(range(requests))
+
+    async def worker():
+        for index in counter:
+            started = time.perf_counter()
+            try:
+                status = (await send(index)).status_code
+            except Exception:
+                status = "exception"
+            latencies.append((time.perf_counter() - started) * 1000)
+            status_codes[status] = status_codes.get(status, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    seconds = time.perf_counter() - started
+    errors = sum(count for status, count in status_codes.items() if status == "exception" or status >= 400)
+    return ScenarioResult(
+        scenario=name,
+        requests=requests,
+        errors=errors,
+        seconds=seconds,
+        throughput=requests / seconds if seconds else 0.0,
+        p50_ms=percentile(latencies, 50),
+        p95_ms=percentile(latencies, 95),
+        p99_ms=percentile(latencies, 99),
+        status_codes={str(status): count for status, count in sorted(status_codes.items(), key=str)},
+    )
+
+
+async def run_benchmark(
+    scenarios=SCENARIOS,
+    requests: int = 200,
+    concurrency: int = 16,
+    gemini: Latency = Latency(),
+    db: Latency = Latency(),
+    storage: Latency = Latency(),
+    seed_records: int = 1000,
+    repeat_ratio: float = 0.0,
+    list_limit: int = 50,
+) -> List[ScenarioResult]:
+    """
+    Прогоняет сценарии по очереди на одном экземпляре приложения.
+
+    `repeat_ratio` — доля запросов /analyze с уже отправленным файлом
+    (попадание в кэш анализа).
+    """
+    import main
+
+    fake_gemini = FakeGemini(gemini)
+    fake_supabase = FakeSupabase(db, storage)
+    fake_supabase.seed_analysis_results(seed_records)
+    main.model = fake_gemini
+    main.supabase = fake_supabase
+
+    image = make_jpeg()
+    record_ids = [row["id"] for row in fake_supabase.tables["analysis_results"]]
+    transport = httpx.ASGITransport(app=main.app)
+    results = []
+    async with main.lifespan(main.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+
+            async def analyze(index: int) -> httpx.Response:
+                # Данные после маркера конца JPEG не мешают декодированию, но меняют хэш файла
+                unique = index if random.random() >= repeat_ratio else 0
+                content = image + unique.to_bytes(8, "big")
+                return await client.post("/analyze", files={"file": (f"photo_{index}.jpg", content, "image/jpeg")})
+
+            async def analysis_list(index: int) -> httpx.Response:
+                return await client.get("/analysis", params={"limit": list_limit})
+
+            async def details(index: int) -> httpx.Response:
+                return await client.get(f"/analysis/{random.choice(record_ids)}")
+
+            senders = {"analyze": analyze, "list": analysis_list, "details": details}
+            for scenario in scenarios:
+                results.append(await run_scenario(scenario, senders[scenario], requests, concurrency))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=200, help="запросов на сценарий")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--gemini-latency", type=float, default=1.0)
+    parser.add_argument("--gemini-jitter", type=float, default=0.3)
+    parser.add_argument("--gemini-error-rate", type=float, default=0.0)
+    parser.add_argument("--db-latency", type=float, default=0.03)
+    parser.add_argument("--db-jitter", type=float, default=0.01)
+    parser.add_argument("--db-error-rate", type=float, default=0.0)
+    parser.add_argument("--storage-latency", type=float, default=0.08)
+    parser.add_argument("--storage-jitter", type=float, default=0.03)
+    parser.add_argument("--storage-error-rate", type=float, default=0.0)
+    parser.add_argument("--seed-records", type=int, default=1000)
+    parser.add_argument("--repeat-ratio", type=float, default=0.0, help="доля повторных файлов в /analyze")
+    parser.add_argument("--json", help="записать результаты в файл")
+    args = parser.parse_args()
+
+    import logging
+
+    # Журнал каждого запроса искажает замер
+    logging.disable(logging.ERROR)
+
+    results = asyncio.run(run_benchmark(
+        scenarios=args.scenarios,
+        requests=args.requests,
+        concurrency=args.concurrency,
+        gemini=Latency(args.gemini_latency, args.gemini_jitter, args.gemini_error_rate),
+        db=Latency(args.db_latency, args.db_jitter, args.db_error_rate),
+        storage=Latency(args.storage_latency, args.storage_jitter, args.storage_error_rate),
+        seed_records=args.seed_records,
+        repeat_ratio=args.repeat_ratio,
+    ))
+
+    print(f"{'сценарий':<10} {'запросов':>9} {'ошибок':>7} {'запр/с':>8} {'p50, мс':>9} {'p95, мс':>9} {'p99, мс':>9}  коды")
+    for result in results:
+        print(
+            f"{result.scenario:<10} {result.requests:>9} {result.errors:>7} {result.throughput:>8.1f} "
+            f"{result.p50_ms:>9.1f} {result.p95_ms:>9.1f} {result.p99_ms:>9.1f}  {result.status_codes}"
+        )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump([asdict(result) for result in results], f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Бенчмарк холодного старта: время импорта main.py, запуска приложения
+(lifespan), первого запроса и создания клиентов Gemini и Supabase.
+
+Каждый замер выполняется в новом процессе — как при холодном старте
+serverless-функции или нового контейнера. Сетевые запросы не выполняются:
+первый запрос идёт к GET /jobs/{job_id}, которому внешние сервисы не нужны,
+а создание клиентов не обращается к сети.
+
+    python benchmarks/startup.py --runs 5
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = """
+import asyncio, json, sys, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+from fastapi.testclient import TestClient
+with TestClient(main.app) as client:
+    ready = time.perf_counter()
+    client.get("/jobs/unknown")
+    first_request = time.perf_counter()
+main.get_model()
+asyncio.run(main.get_supabase())
+clients = time.perf_counter()
+print(json.dumps({
+    "import": imported - started,
+    "startup": ready - imported,
+    "first_request": first_request - ready,
+    "clients": clients - first_request,
+    "modules": len(sys.modules),
+}))
+"""
+
+
+def measure() -> dict:
+    env = dict(os.environ)
+    env.setdefault("GOOGLE_API_KEY", "benchmark")
+    env.setdefault("SUPABASE_URL", "http://127.0.0.1:54321")
+    env.setdefault("SUPABASE_KEY", "benchmark")
+    # Фоновое создание клиентов не должно смешиваться с замером первого запроса
+    env["STARTUP_WARMUP"] = "0"
+    output = subprocess.check_output([sys.executable, "-c", CHILD], cwd=ROOT, env=env, text=True, stderr=subprocess.DEVNULL)
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    runs = [measure() for _ in range(args.runs)]
+    print(f"{'этап':<15} {'медиана, мс':>12} {'максимум, мс':>13}")
+    for stage in ("import", "startup", "first_request", "clients"):
+        values = [run[stage] * 1000 for run in runs]
+        print(f"{stage:<15} {statistics.median(values):>12.1f} {max(values):>13.1f}")
+    print(f"модулей после запуска: {runs[-1]['modules']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Бенчмарк памяти при приёме загрузок: пиковый RSS на одну одновременную загрузку.
+
+Сравнивает прежний путь (`await file.read()` целиком + копия в payload Gemini)
+с потоковым приёмом из uploads.py. Каждый режим запускается в отдельном
+процессе, чтобы пиковый RSS одного режима не влиял на другой.
+
+    python benchmarks/upload_memory.py --size-mb 40 --concurrency 1 4 8
+"""
+
+import argparse
+import asyncio
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+STARLETTE_SPOOL_MAX_SIZE = 1024 * 1024
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss в Linux — в килобайтах
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def make_upload_file(size: int):
+    """UploadFile так, как его создаёт starlette: SpooledTemporaryFile с порогом 1 МБ."""
+    from fastapi import UploadFile
+
+    spooled = tempfile.SpooledTemporaryFile(max_size=STARLETTE_SPOOL_MAX_SIZE)
+    block = os.urandom(1024 * 1024)
+    written = 0
+    while written < size:
+        part = block[: min(len(block), size - written)]
+        spooled.write(part)
+        written += len(part)
+    spooled.seek(0)
+    return UploadFile(file=spooled, filename="voice.wav", headers={"content-type": "audio/wav"})
+
+
+def consume_storage_payload(payload):
+    """Имитирует отправку в Storage: httpx читает файловый объект блоками."""
+    if isinstance(payload, bytes):
+        return len(payload)
+    total = 0
+    while True:
+        chunk = payload.read(64 * 1024)
+        if not chunk:
+            return total
+        total += len(chunk)
+
+
+class Barrier:
+    """Держит все загрузки с их буферами, пока каждая не будет подготовлена."""
+
+    def __init__(self, parties: int):
+        self.parties = parties
+        self.arrived = 0
+        self.all_ready = asyncio.Event()
+        self.release = asyncio.Event()
+
+    async def wait(self):
+        self.arrived += 1
+        if self.arrived == self.parties:
+            self.all_ready.set()
+        await self.release.wait()
+
+
+async def buffered_upload(file, barrier: Barrier):
+    file_data = await file.read()
+    contents = ["prompt", {"mime_type": file.content_type, "data": file_data}]
+    consume_storage_payload(file_data)
+    await barrier.wait()
+    return len(contents)
+
+
+async def streaming_upload(file, barrier: Barrier, inline_max: int):
+    from uploads import ingest_upload
+
+    upload = await ingest_upload(file, max_bytes=1 << 40, spool_threshold=STARLETTE_SPOOL_MAX_SIZE)
+    with upload:
+        payload = upload.storage_payload()
+        try:
+            consume_storage_payload(payload)
+        finally:
+            if not isinstance(payload, bytes):
+                payload.close()
+        if upload.spooled and upload.size > inline_max:
+            part = upload.path  # File API читает файл с диска
+        else:
+            part = {"mime_type": upload.content_type, "data": upload.model_payload()}
+        contents = ["prompt", part]
+        await barrier.wait()
+        return len(contents)
+
+
+async def run_mode(mode: str, size: int, concurrency: int, inline_max: int):
+    files = [make_upload_file(size) for _ in range(concurrency)]
+    barrier = Barrier(concurrency)
+    if mode == "buffered":
+        tasks = [asyncio.create_task(buffered_upload(f, barrier)) for f in files]
+    else:
+        tasks = [asyncio.create_task(streaming_upload(f, barrier, inline_max)) for f in files]
+    # Все загрузки одновременно держат свои буферы — как при параллельных запросах
+    await barrier.all_ready.wait()
+    barrier.release.set()
+    await asyncio.gather(*tasks)
+
+
+def child(mode: str, size: int, concurrency: int, inline_max: int):
+    import fastapi  # noqa: F401 — базовый RSS должен включать импорты
+    import uploads  # noqa: F401
+
+    baseline = peak_rss_mb()
+    asyncio.run(run_mode(mode, size, concurrency, inline_max))
+    peak = peak_rss_mb()
+    print(f"{baseline:.1f} {peak:.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=float, default=40)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--inline-max-mb", type=float, default=16, help="GEMINI_INLINE_MAX_BYTES в МБ")
+    parser.add_argument("--child", nargs=4, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        mode, size, concurrency, inline_max = args.child
+        child(mode, int(size), int(concurrency), int(inline_max))
+        return
+
+    size = int(args.size_mb * 1024 * 1024)
+    inline_max = int(args.inline_max_mb * 1024 * 1024)
+    print(f"Файл: {args.size_mb} МБ, inline-порог Gemini: {args.inline_max_mb} МБ")
+    print(f"{'режим':<10} {'параллельно':>11} {'пик RSS, МБ':>12} {'на загрузку, МБ':>16}")
+    for concurrency in args.concurrency:
+        for mode in ("buffered", "streaming"):
+            output = subprocess.check_output(
+                [sys.executable, __file__, "--child", mode, str(size), str(concurrency), str(inline_max)],
+                text=True,
+            )
+            baseline, peak = map(float, output.split()[-2:])
+            per_upload = (peak - baseline) / concurrency
+            print(f"{mode:<10} {concurrency:>11} {peak:>12.1f} {per_upload:>16.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+# Кэш результатов анализа по хэшу содержимого (ADIOM-HASH)
+
+import asyncio
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def analysis_cache_key(file_hash: str, prompt_key: str, model_name: str) -> str:
+    """
+    Ключ результата анализа: хэш файла + промпт + модель.
+
+    `prompt_key` — Prompt.key (имя, версия и хэш текста промпта): один и тот
+    же файл, проанализированный с другой версией промпта или другой
+    моделью, получает другой ключ.
+    """
+    digest = hashlib.sha256()
+    for part in (file_hash, prompt_key, model_name):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class TTLCache:
+    """LRU-кэш в памяти процесса с ограничением по размеру и времени жизни записей."""
+
+    def __init__(self, max_size: int = 1024, ttl: float = 3600.0, clock: Callable[[], float] = time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        self._items: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key: str) -> Optional[Any]:
+        item = self._items.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at < self._clock():
+            del self._items[key]
+            return None
+        self._items.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        self._items[key] = (self._clock() + self.ttl, value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        self._items.pop(key, None)
+
+
+class ByteLRUCache:
+    """
+    LRU-кэш в памяти процесса с ограничением по суммарному размеру значений в байтах.
+
+    Размер значения передаётся в `set`; значение больше `max_bytes` не кэшируется.
+    """
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._items: "OrderedDict[Any, tuple]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key: Any) -> Optional[Any]:
+        item = self._items.get(key)
+        if item is None:
+            return None
+        self._items.move_to_end(key)
+        return item[0]
+
+    def set(self, key: Any, value: Any, size: int) -> None:
+        self.delete(key)
+        if size > self.max_bytes:
+            return
+        self._items[key] = (value, size)
+        self.total_bytes += size
+        while self.total_bytes > self.max_bytes:
+            _, (_, evicted_size) = self._items.popitem(last=False)
+            self.total_bytes -= evicted_size
+
+    def delete(self, key: Any) -> None:
+        item = self._items.pop(key, None)
+        if item is not None:
+            self.total_bytes -= item[1]
+
+
+class MemoryAnalysisCache:
+    """Уровень кэша анализов в памяти процесса."""
+
+    def __init__(self, max_size: int = 1024, ttl: float = 3600.0):
+        self._cache = TTLCache(max_size=max_size, ttl=ttl)
+
+    async def get(self, key: str) -> Optional[dict]:
+        return self._cache.get(key)
+
+    async def set(self, key: str, value: dict) -> None:
+        self._cache.set(key, value)
+
+
+class SupabaseAnalysisCache:
+    """
+    Уровень кэша анализов поверх таблицы analysis_results.
+
+    Ищет ранее сохранённую запись с тем же content_hash. Запись в этот уровень
+    не нужна: строку добавляет save_analysis_to_db.
+    """
+
+    def __init__(self, lookup: Callable[[str], Awaitable[Optional[dict]]]):
+        # lookup(content_hash) -> строка с ai_response и file_path или None
+        self._lookup = lookup
+
+    async def get(self, key: str) -> Optional[dict]:
+        record = await self._lookup(key)
+        if record is None:
+            return None
+        return {"description": record["ai_response"], "file_path": record["file_path"]}
+
+    async def set(self, key: str, value: dict) -> None:
+        return None
+
+
+class TieredCache:
+    """
+    Многоуровневый кэш: уровни опрашиваются по порядку, попадание
+    в нижнем уровне копируется в верхние.
+    """
+
+    def __init__(self, *tiers):
+        self.tiers = list(tiers)
+
+    async def get(self, key: str) -> Optional[dict]:
+        for index, tier in enumerate(self.tiers):
+            try:
+                value = await tier.get(key)
+            except Exception as e:
+                # Недоступный уровень кэша не должен ломать анализ — считаем это промахом
+                logger.warning(f"Ошибка чтения из кэша {type(tier).__name__}: {e}")
+                continue
+            if value is not None:
+                for upper in self.tiers[:index]:
+                    await upper.set(key, value)
+                return value
+        return None
+
+    async def set(self, key: str, value: dict) -> None:
+        for tier in self.tiers:
+            await tier.set(key, value)
+
+
+class SessionUserCache:
+    """
+    Кэш соответствия session_id → id пользователя.
+
+    Промахи загружаются одним вызовом `resolve_many` на все недостающие
+    сессии. Одновременные промахи по одной и той же сессии не порождают
+    повторных запросов: все ожидающие получают результат одной загрузки.
+    """
+
+    def __init__(self, resolve_many: Callable[[List[str]], Awaitable[Dict[str, Any]]], max_size: int = 10000, ttl: float = 3600.0):
+        self._resolve_many = resolve_many
+        self._cache = TTLCache(max_size=max_size, ttl=ttl)
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    async def get_user_id(self, session_id: str) -> Any:
+        return (await self.get_user_ids([session_id]))[session_id]
+
+    async def get_user_ids(self, session_ids: List[str]) -> Dict[str, Any]:
+        result: Dict[str, Any] = {}
+        waiting: Dict[str, asyncio.Future] = {}
+        missing: List[str] = []
+        for session_id in dict.fromkeys(session_ids):
+            user_id = self._cache.get(session_id)
+            if user_id is not None:
+                result[session_id] = user_id
+            elif session_id in self._inflight:
+                waiting[session_id] = self._inflight[session_id]
+            else:
+                missing.append(session_id)
+
+        if missing:
+            load = asyncio.ensure_future(self._load(missing))
+            for session_id in missing:
+                self._inflight[session_id] = load
+                waiting[session_id] = load
+
+        for session_id, load in waiting.items():
+            user_ids = await asyncio.shield(load)
+            result[session_id] = user_ids[session_id]
+        return result
+
+    async def _load(self, session_ids: List[str]) -> Dict[str, Any]:
+        try:
+            user_ids = await self._resolve_many(session_ids)
+            for session_id, user_id in user_ids.items():
+                self._cache.set(session_id, user_id)
+            return user_ids
+        finally:
+            for session_id in session_ids:
+                self._inflight.pop(session_id, None)
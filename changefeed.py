@@ -0,0 +1,103 @@
+# Лента новых записей analysis_results для подписчиков (GET /analysis/changes)
+
+import asyncio
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import List, Optional
+
+
+class ChangeFeed:
+    """
+    Кольцевой буфер последних `capacity` записанных строк с ожиданием новых.
+
+    Строки публикуются после вставки в таблицу; курсор подписчика — id
+    последней полученной строки. `since` отдаёт строки после курсора из
+    буфера, а если курсор старше буфера — None, и строки нужно дочитать из
+    таблицы. Видны только записи этого процесса.
+
+    id назначает база, поэтому одновременные вставки могут завершиться не в
+    порядке id. Вставка выполняется внутри `writing()`: строки, опубликованные
+    пока идёт хотя бы одна вставка, придерживаются и появляются в буфере
+    вместе, по возрастанию id, когда завершится последняя из них. Так
+    подписчик не продвигает курсор дальше строки, которая ещё не опубликована.
+    """
+
+    def __init__(self, capacity: int = 1000):
+        self._rows = deque(maxlen=capacity)
+        # Строки с id не больше floor в буфере не гарантированы: вытеснены или записаны до запуска
+        self.floor: Optional[int] = None
+        self.last_id = 0
+        self._waiters = set()
+        self._writing = 0
+        self._held: List[dict] = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def writing(self):
+        """Отмечает вставку строк в таблицу; строки публикуются внутри блока."""
+        with self._lock:
+            self._writing += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._writing -= 1
+                waiters = self._release() if self._writing == 0 else set()
+            _wake_all(waiters)
+
+    def publish(self, rows: List[dict]) -> None:
+        if not rows:
+            return
+        with self._lock:
+            self._held.extend(rows)
+            waiters = self._release() if self._writing == 0 else set()
+        _wake_all(waiters)
+
+    def _release(self) -> set:
+        """Переносит придержанные строки в буфер; вызывается под блокировкой."""
+        if not self._held:
+            return set()
+        for row in sorted(self._held, key=lambda row: row['id']):
+            if self.floor is None:
+                self.floor = row['id'] - 1
+            if len(self._rows) == self._rows.maxlen:
+                self.floor = max(self.floor, self._rows[0]['id'])
+            self._rows.append(row)
+            self.last_id = max(self.last_id, row['id'])
+        self._held = []
+        waiters, self._waiters = self._waiters, set()
+        return waiters
+
+    def since(self, cursor: int) -> Optional[List[dict]]:
+        """Строки с id больше `cursor` из буфера; None, если буфер их не покрывает."""
+        with self._lock:
+            if self.floor is None or cursor < self.floor:
+                return None
+            return [row for row in self._rows if row['id'] > cursor]
+
+    async def wait(self, cursor: int, timeout: float) -> bool:
+        """Ждёт до `timeout` секунд строк новее `cursor`; False — за это время их не появилось."""
+        waiter = asyncio.get_running_loop().create_future()
+        with self._lock:
+            if self.last_id > cursor:
+                return True
+            self._waiters.add(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            with self._lock:
+                self._waiters.discard(waiter)
+
+
+def _wake_all(waiters: set) -> None:
+    for waiter in waiters:
+        waiter.get_loop().call_soon_threadsafe(_wake, waiter)
+
+
+def _wake(waiter: asyncio.Future) -> None:
+    if not waiter.done():
+        waiter.set_result(None)
@@ -0,0 +1,158 @@
+# Асинхронный доступ к Supabase: таблицы users и analysis_results, Storage
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def create_http_client(
+    max_connections: int = 100,
+    max_keepalive_connections: int = 20,
+    keepalive_expiry: float = 30.0,
+    http2: bool = True,
+    connect_timeout: float = 5.0,
+    pool_timeout: float = 5.0,
+) -> "httpx.AsyncClient":
+    """
+    Общий HTTP-клиент для PostgREST и Storage.
+
+    Соединения переиспользуются (keep-alive, при `http2` — мультиплексирование
+    запросов в одном соединении). Здесь ограничены только установка
+    соединения и ожидание свободного соединения из пула; общее время вызова
+    ограничивает SupabaseStore.
+    """
+    import httpx
+
+    return httpx.AsyncClient(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        ),
+        timeout=httpx.Timeout(None, connect=connect_timeout, pool=pool_timeout),
+    )
+
+
+class SupabaseStore:
+    """
+    Операции приложения над Supabase поверх асинхронного клиента.
+
+    `client_getter` — корутина, возвращающая supabase AsyncClient. Запросы к
+    таблицам ограничены `query_timeout` секундами, операции Storage —
+    `storage_timeout`; при превышении выбрасывается asyncio.TimeoutError.
+    """
+
+    def __init__(
+        self,
+        client_getter: Callable[[], Awaitable[Any]],
+        bucket: str,
+        query_timeout: float = 10.0,
+        storage_timeout: float = 60.0,
+    ):
+        self._client_getter = client_getter
+        self.bucket = bucket
+        self.query_timeout = query_timeout
+        self.storage_timeout = storage_timeout
+
+    async def _execute(self, build: Callable[[Any], Any]):
+        client = await self._client_getter()
+        return await asyncio.wait_for(build(client).execute(), self.query_timeout)
+
+    async def _storage(self, call: Callable[[Any], Awaitable[Any]]):
+        client = await self._client_getter()
+        return await asyncio.wait_for(call(client.storage), self.storage_timeout)
+
+    async def upsert_users(self, session_ids: List[str]) -> dict:
+        """
+        Находит или создаёт пользователей для сессий одним UPSERT.
+
+        Требует уникального индекса users.session_id: одновременные первые
+        запросы одной сессии не создают дубликатов.
+        """
+        response = await self._execute(lambda client: client.table('users').upsert(
+            [{'session_id': session_id} for session_id in session_ids],
+            on_conflict='session_id',
+        ))
+        return {user['session_id']: user['id'] for user in response.data}
+
+    async def insert_analysis_results(self, records: List[dict]) -> List[dict]:
+        """Записывает пакет результатов анализа одним INSERT и возвращает вставленные строки."""
+        response = await self._execute(lambda client: client.table('analysis_results').insert(records))
+        return response.data
+
+    async def select_analysis_page(
+        self,
+        columns: str,
+        limit: int,
+        user_id: Optional[str] = None,
+        before: Optional[tuple] = None,
+    ) -> List[dict]:
+        """
+        Записи анализа от новых к старым, строго раньше ключа `before`
+        (timestamp, id), если он задан.
+        """
+        def build(client):
+            query = client.table('analysis_results').select(columns)
+            if user_id:
+                query = query.eq('user_id', user_id)
+            if before:
+                timestamp, record_id = before
+                query = query.or_(f'timestamp.lt."{timestamp}",and(timestamp.eq."{timestamp}",id.lt.{record_id})')
+            return query.order('timestamp', desc=True).order('id', desc=True).limit(limit)
+
+        return (await self._execute(build)).data
+
+    async def get_analysis_result(self, record_id: int) -> Optional[dict]:
+        # limit(1) вместо single(): single() при отсутствии записи выбрасывает ошибку PostgREST
+        records = (await self._execute(
+            lambda client: client.table('analysis_results').select('*').eq('id', record_id).limit(1)
+        )).data
+        return records[0] if records else None
+
+    async def get_analysis_results(self, record_ids: List[int], columns: str) -> List[dict]:
+        """Записи с указанными id одним запросом (порядок не гарантирован)."""
+        if not record_ids:
+            return []
+        return (await self._execute(
+            lambda client: client.table('analysis_results').select(columns).in_('id', record_ids)
+        )).data
+
+    async def scan_analysis_results(self, columns: str, after_id: int, limit: int) -> List[dict]:
+        """Следующая порция записей в порядке возрастания id, начиная после `after_id`."""
+        return (await self._execute(
+            lambda client: client.table('analysis_results').select(columns).gt('id', after_id).order('id').limit(limit)
+        )).data
+
+    async def find_analysis_by_content_hash(self, content_hash: str) -> Optional[dict]:
+        """Ранее сохранённый результат анализа с тем же ключом кэша (content_hash)."""
+        records = (await self._execute(
+            lambda client: client.table('analysis_results').select('ai_response, file_path').eq('content_hash', content_hash).limit(1)
+        )).data
+        return records[0] if records else None
+
+    async def object_exists(self, path: str) -> bool:
+        return await self._storage(lambda storage: storage.from_(self.bucket).exists(path))
+
+    async def upload_object(self, path: str, data, content_type: str, cache_control: Optional[int] = None, upsert: bool = False) -> None:
+        """Загружает объект; `cache_control` — срок кэширования в секундах для заголовка Cache-Control."""
+        file_options = {"content-type": content_type}
+        if cache_control is not None:
+            file_options["cache-control"] = str(cache_control)
+        if upsert:
+            file_options["upsert"] = "true"
+        await self._storage(lambda storage: storage.from_(self.bucket).upload(path, data, file_options=file_options))
+
+    async def public_url(self, path: str) -> str:
+        return await self._storage(lambda storage: storage.from_(self.bucket).get_public_url(path))
+
+    async def ensure_bucket(self) -> None:
+        """Создаёт bucket, если его ещё нет."""
+        buckets = await self._storage(lambda storage: storage.list_buckets())
+        if any(bucket.name == self.bucket for bucket in buckets):
+            logger.info(f"Bucket '{self.bucket}' уже существует.")
+            return
+        await self._storage(lambda storage: storage.create_bucket(self.bucket))
+        logger.info(f"Bucket '{self.bucket}' успешно создан.")
@@ -0,0 +1,230 @@
+# Производные файлы для интерфейса: миниатюры WebP и короткие превью аудио
+
+import asyncio
+import io
+import logging
+import multiprocessing
+import os
+import re
+import subprocess
+from concurrent.futures import Executor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple, Union
+
+from PIL import Image, ImageOps
+
+from background import cancel_until_done
+
+logger = logging.getLogger(__name__)
+
+DERIVATIVE_PREFIX = "derivatives"
+# Имя объекта оригинала: "<sha256>_<имя>" (см. save_file)
+ORIGINAL_NAME = re.compile(r"(?:^|/)(?P<hash>[0-9a-f]{64})_[^/?]*(?:\?.*)?$")
+
+
+def thumbnail_path(file_hash: str, width: int, quality: int) -> str:
+    """
+    Путь миниатюры в bucket.
+
+    Путь определяется содержимым оригинала и параметрами преобразования,
+    поэтому объект по нему никогда не меняется: изменённые параметры дают
+    новый путь, и его можно кэшировать без срока.
+    """
+    return f"{DERIVATIVE_PREFIX}/{file_hash[:2]}/{file_hash}/w{width}-q{quality}.webp"
+
+
+def audio_preview_path(file_hash: str, seconds: int, bitrate: int) -> str:
+    return f"{DERIVATIVE_PREFIX}/{file_hash[:2]}/{file_hash}/preview-{seconds}s-{bitrate}k.mp3"
+
+
+def original_hash(file_path: str) -> Optional[str]:
+    """Хэш содержимого из URL или имени объекта оригинала; None, если имя другого вида."""
+    match = ORIGINAL_NAME.search(file_path or "")
+    return match["hash"] if match else None
+
+
+def render_thumbnails(source: Union[bytes, str], widths: List[int], quality: int) -> List[Tuple[int, bytes]]:
+    """
+    Миниатюры WebP указанных ширин: [(ширина, байты)].
+
+    Изображение не увеличивается: если оно уже ширины, миниатюра
+    получает его исходный размер. Каждая следующая (меньшая) миниатюра
+    уменьшается из предыдущей. Выполняется в отдельном процессе.
+    """
+    with Image.open(source if isinstance(source, str) else io.BytesIO(source)) as image:
+        # Для JPEG декодер сразу масштабирует, но не меньше нужной ширины
+        image.draft("RGB", (max(widths), max(widths)))
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if image.has_transparency_data else "RGB")
+        original_width, original_height = image.size
+        thumbnails = []
+        for width in sorted(widths, reverse=True):
+            if image.width > width:
+                height = max(1, round(original_height * width / original_width))
+                image = image.resize((width, height), Image.Resampling.LANCZOS)
+            output = io.BytesIO()
+            image.save(output, format="WEBP", quality=quality, method=4)
+            thumbnails.append((width, output.getvalue()))
+    return thumbnails
+
+
+def render_audio_preview(source: Union[bytes, str], seconds: int, bitrate: int) -> bytes:
+    """Первые `seconds` секунд записи в MP3 моно с битрейтом `bitrate` кбит/с (через ffmpeg)."""
+    command = ["ffmpeg", "-nostdin", "-hide_banner", "-loglevel", "error"]
+    command += ["-i", "pipe:0" if isinstance(source, bytes) else source]
+    command += ["-t", str(seconds), "-vn", "-ac", "1", "-ar", "22050", "-c:a", "libmp3lame", "-b:a", f"{bitrate}k", "-f", "mp3", "pipe:1"]
+    result = subprocess.run(
+        command,
+        input=source if isinstance(source, bytes) else None,
+        capture_output=True,
+        check=True,
+    )
+    return result.stdout
+
+
+@dataclass
+class DerivativeJob:
+    """Оригинал, для которого нужно построить производные; `source` — байты или путь к временному файлу."""
+
+    file_hash: str
+    content_type: str
+    source: Union[bytes, str]
+
+
+class DerivativeBuilder:
+    """
+    Построение производных файлов вне обработки запроса.
+
+    Задания ждут в ограниченной очереди (`max_pending`); их выполняют
+    `concurrency` обработчиков. Миниатюры строятся в пуле из `workers`
+    процессов (0 — пул потоков), превью аудио — ffmpeg в пуле потоков.
+    Готовые объекты загружаются корутиной `upload(path, data, content_type)`.
+    Если первый объект задания уже есть (`exists(path)`), задание
+    пропускается: пути зависят только от содержимого и параметров.
+    Временный файл задания удаляется после обработки.
+    """
+
+    def __init__(
+        self,
+        upload: Callable[[str, bytes, str], Awaitable[None]],
+        exists: Callable[[str], Awaitable[bool]],
+        widths: List[int],
+        quality: int = 75,
+        preview_seconds: int = 30,
+        preview_bitrate: int = 32,
+        workers: int = 1,
+        concurrency: int = 2,
+        max_pending: int = 100,
+    ):
+        self.upload = upload
+        self.exists = exists
+        self.widths = sorted(set(widths))
+        self.quality = quality
+        self.preview_seconds = preview_seconds
+        self.preview_bitrate = preview_bitrate
+        self.workers = workers
+        self.concurrency = concurrency
+        self.max_pending = max_pending
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._executor: Optional[Executor] = None
+        self._scheduled = set()
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def paths(self, file_hash: str, content_type: str) -> Dict[str, str]:
+        """Пути производных оригинала по их именам ("w320", "preview"); пустой словарь — производных нет."""
+        if content_type.startswith("image/"):
+            return {f"w{width}": thumbnail_path(file_hash, width, self.quality) for width in self.widths}
+        if content_type.startswith("audio/"):
+            return {"preview": audio_preview_path(file_hash, self.preview_seconds, self.preview_bitrate)}
+        return {}
+
+    def submit(self, job: DerivativeJob) -> bool:
+        """
+        Ставит задание в очередь; False — очередь заполнена, не запущена или
+        оригинал уже в работе (временный файл задания тогда сразу удаляется).
+        """
+        if not self._tasks or job.file_hash in self._scheduled:
+            self._cleanup(job)
+            return False
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self._cleanup(job)
+            return False
+        self._scheduled.add(job.file_hash)
+        return True
+
+    async def start(self) -> None:
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_pending)
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.concurrency)]
+
+    async def stop(self) -> None:
+        """Останавливает обработчики; задания, которые ещё не выполнены, отбрасываются."""
+        tasks, self._tasks = self._tasks, []
+        await cancel_until_done(tasks)
+        self._scheduled.clear()
+        while self._queue is not None and not self._queue.empty():
+            self._cleanup(self._queue.get_nowait())
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+    async def _work(self) -> None:
+        while True:
+            job = await self._queue.get()
+            try:
+                await self.build(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Не удалось построить производные для {job.file_hash[:12]}: {e}")
+            finally:
+                self._scheduled.discard(job.file_hash)
+                self._cleanup(job)
+
+    async def build(self, job: DerivativeJob) -> int:
+        """Строит и загружает производные одного оригинала; возвращает число загруженных объектов."""
+        paths = self.paths(job.file_hash, job.content_type)
+        if not paths or await self.exists(next(iter(paths.values()))):
+            return 0
+        loop = asyncio.get_running_loop()
+        if job.content_type.startswith("image/"):
+            if self.workers > 0 and self._executor is None:
+                # Как и в ImagePreprocessor, без fork процесса с event loop
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("forkserver"))
+            executor = self._executor
+            try:
+                rendered = await loop.run_in_executor(executor, render_thumbnails, job.source, self.widths, self.quality)
+            except BrokenProcessPool:
+                # Рабочий процесс погиб (например, при нехватке памяти): следующее задание получит новый пул
+                if self._executor is executor:
+                    self._executor = None
+                    executor.shutdown(wait=False, cancel_futures=True)
+                raise
+            objects = [(paths[f"w{width}"], data, "image/webp") for width, data in rendered]
+        else:
+            data = await loop.run_in_executor(None, render_audio_preview, job.source, self.preview_seconds, self.preview_bitrate)
+            objects = [(paths["preview"], data, "audio/mpeg")]
+        # Первый путь загружается последним: по нему проверяется, что задание уже выполнено
+        first = next(iter(paths.values()))
+        objects.sort(key=lambda item: item[0] == first)
+        for path, data, content_type in objects:
+            await self.upload(path, data, content_type)
+        logger.info(f"Производные для {job.file_hash[:12]} построены: {len(objects)}")
+        return len(objects)
+
+    @staticmethod
+    def _cleanup(job: DerivativeJob) -> None:
+        if isinstance(job.source, str):
+            try:
+                os.unlink(job.source)
+            except FileNotFoundError:
+                pass
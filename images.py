@@ -0,0 +1,150 @@
+# Подготовка изображений перед отправкой в Gemini: уменьшение, перекодирование, GPS из EXIF
+
+import asyncio
+import io
+import logging
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from typing import Optional, Union
+
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+GPS_IFD = 0x8825
+GPS_LATITUDE_REF = 1
+GPS_LATITUDE = 2
+GPS_LONGITUDE_REF = 3
+GPS_LONGITUDE = 4
+
+
+@dataclass
+class PreparedImage:
+    """Изображение для модели: перекодированные байты и координаты съёмки, если они были в EXIF."""
+
+    data: bytes
+    content_type: str
+    width: int
+    height: int
+    original_size: int
+    gps: Optional[str] = None
+
+
+def _to_degrees(value) -> float:
+    degrees, minutes, seconds = (float(part) for part in value)
+    return degrees + minutes / 60 + seconds / 3600
+
+
+def extract_gps(exif: Image.Exif) -> Optional[str]:
+    """Возвращает координаты из EXIF в виде "широта, долгота" или None."""
+    try:
+        gps = exif.get_ifd(GPS_IFD)
+        if GPS_LATITUDE not in gps or GPS_LONGITUDE not in gps:
+            return None
+        latitude = _to_degrees(gps[GPS_LATITUDE])
+        longitude = _to_degrees(gps[GPS_LONGITUDE])
+    except (KeyError, TypeError, ValueError, ZeroDivisionError):
+        return None
+    if gps.get(GPS_LATITUDE_REF) == "S":
+        latitude = -latitude
+    if gps.get(GPS_LONGITUDE_REF) == "W":
+        longitude = -longitude
+    return f"{latitude:.6f}, {longitude:.6f}"
+
+
+def preprocess_image(source: Union[bytes, str], max_dimension: int, quality: int) -> PreparedImage:
+    """
+    Уменьшает изображение до `max_dimension` по большей стороне и перекодирует в JPEG.
+
+    `source` — содержимое файла или путь к нему. EXIF читается один раз:
+    ориентация применяется к пикселям, координаты возвращаются текстом,
+    остальные метаданные в результат не попадают. Если перекодирование не
+    уменьшило файл, возвращаются исходные байты.
+
+    Функция выполняется в отдельном процессе, поэтому принимает и
+    возвращает только сериализуемые значения.
+    """
+    if isinstance(source, str):
+        with open(source, "rb") as f:
+            original = f.read()
+    else:
+        original = source
+
+    with Image.open(io.BytesIO(original)) as image:
+        source_format = image.format
+        gps = extract_gps(image.getexif())
+        # Для JPEG декодер сразу масштабирует в 2–8 раз — это намного быстрее полного декодирования
+        image.draft("RGB", (max_dimension, max_dimension))
+        image = ImageOps.exif_transpose(image)
+        if image.mode in ("RGBA", "LA", "P"):
+            image = image.convert("RGBA")
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel("A"))
+            image = background
+        elif image.mode != "RGB":
+            image = image.convert("RGB")
+        resized = max(image.size) > max_dimension
+        image.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+
+        output = io.BytesIO()
+        image.save(output, format="JPEG", quality=quality, optimize=True)
+        width, height = image.size
+
+    data = output.getvalue()
+    if not resized and len(data) >= len(original) and source_format in ("JPEG", "PNG", "WEBP"):
+        return PreparedImage(original, Image.MIME[source_format], width, height, len(original), gps)
+    return PreparedImage(data, "image/jpeg", width, height, len(original), gps)
+
+
+class ImagePreprocessor:
+    """
+    Подготовка изображений в пуле процессов.
+
+    Декодирование и сжатие занимают процессор на сотни миллисекунд, поэтому
+    выполняются вне event loop: в пуле из `workers` процессов, а при
+    `workers=0` — в пуле потоков по умолчанию. Пул создаётся при первом
+    использовании и пересоздаётся, если рабочий процесс погиб (например,
+    убит при нехватке памяти).
+    """
+
+    def __init__(self, max_dimension: int = 1536, quality: int = 85, workers: int = 2):
+        self.max_dimension = max_dimension
+        self.quality = quality
+        self.workers = workers
+        self._executor: Optional[Executor] = None
+
+    def _get_executor(self) -> Optional[Executor]:
+        if self.workers > 0 and self._executor is None:
+            # fork копировал бы процесс с запущенным event loop и потоками клиентов;
+            # forkserver запускает рабочие процессы из чистого интерпретатора
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("forkserver"))
+        return self._executor
+
+    async def prepare(self, source: Union[bytes, str]) -> Optional[PreparedImage]:
+        """Готовит изображение; None, если файл не удалось разобрать как изображение."""
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        try:
+            return await loop.run_in_executor(
+                executor, preprocess_image, source, self.max_dimension, self.quality
+            )
+        except (OSError, ValueError, Image.DecompressionBombError) as e:
+            logger.warning(f"Не удалось подготовить изображение, будет отправлен оригинал: {e}")
+            return None
+        except BrokenProcessPool as e:
+            logger.error(f"Пул подготовки изображений сломан, будет создан заново; отправляется оригинал: {e}")
+            self._discard_executor(executor)
+            return None
+
+    def _discard_executor(self, executor: Executor) -> None:
+        """Убирает сломанный пул; следующий вызов создаст новый."""
+        if self._executor is executor:
+            self._executor = None
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
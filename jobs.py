@@ -0,0 +1,356 @@
+# Асинхронные задания анализа: очередь, пул обработчиков и уведомления
+
+import asyncio
+import ipaddress
+import json
+import logging
+import os
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Awaitable, Callable, Collection, Dict, List, Optional
+from urllib.parse import urlparse
+
+from background import cancel_until_done
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class CallbackNotAllowedError(ValueError):
+    """callback_url указывает на недопустимый адрес."""
+
+
+async def validate_callback_url(url: str, allowed_hosts: Collection[str] = ()) -> None:
+    """
+    Проверяет, что по callback_url можно отправлять уведомления.
+
+    Допускаются только http(s). Если задан `allowed_hosts`, хост должен быть
+    в нём; иначе все адреса хоста должны быть публичными: loopback,
+    link-local (в том числе 169.254.169.254), частные и зарезервированные
+    сети отклоняются, чтобы через уведомления нельзя было обращаться к
+    внутренним сервисам.
+    """
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        raise CallbackNotAllowedError("callback_url должен быть http(s) адресом.")
+    host = parsed.hostname.lower()
+    if allowed_hosts:
+        if host not in allowed_hosts:
+            raise CallbackNotAllowedError(f"Хост {host} не входит в список разрешённых для callback_url.")
+        return
+    try:
+        port = parsed.port or (443 if parsed.scheme == "https" else 80)
+        addresses = await asyncio.get_running_loop().getaddrinfo(host, port)
+    except (OSError, ValueError) as e:
+        raise CallbackNotAllowedError(f"Не удалось определить адрес хоста {host}: {e}")
+    for *_, sockaddr in addresses:
+        address = ipaddress.ip_address(sockaddr[0].split("%")[0])
+        if not address.is_global or address.is_multicast:
+            raise CallbackNotAllowedError(f"callback_url указывает на внутренний адрес {address}.")
+
+
+@dataclass
+class Job:
+    """Задание на анализ файла, сохранённого в `payload_path`."""
+
+    file_name: str
+    content_type: str
+    session_id: str
+    payload_path: str
+    callback_url: Optional[str] = None
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    status: str = QUEUED
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+
+
+class InMemoryJobQueue:
+    """Очередь заданий в памяти процесса — для локального запуска и тестов."""
+
+    def __init__(self):
+        self._jobs: Dict[str, Job] = {}
+        self._pending: Optional[asyncio.Queue] = None
+
+    @property
+    def _queue(self) -> asyncio.Queue:
+        if self._pending is None:
+            self._pending = asyncio.Queue()
+        return self._pending
+
+    async def submit(self, job: Job) -> None:
+        self._jobs[job.id] = job
+        self._queue.put_nowait(job.id)
+
+    async def claim(self) -> Job:
+        """Ожидает следующее задание и помечает его как выполняемое."""
+        job = self._jobs[await self._queue.get()]
+        job.status = RUNNING
+        job.updated_at = time.time()
+        return job
+
+    async def complete(self, job_id: str, result: dict) -> None:
+        self._update(job_id, status=DONE, result=result)
+
+    async def fail(self, job_id: str, error: str) -> None:
+        self._update(job_id, status=FAILED, error=error)
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def _update(self, job_id: str, **changes) -> None:
+        job = self._jobs[job_id]
+        for name, value in changes.items():
+            setattr(job, name, value)
+        job.updated_at = time.time()
+
+
+class SQLiteJobQueue:
+    """
+    Очередь заданий в SQLite.
+
+    Переживает перезапуск процесса и может разделяться несколькими
+    процессами на одной машине. Свободные обработчики опрашивают таблицу
+    раз в `poll_interval` секунд. Задание, которое числится выполняемым
+    дольше `lease_timeout` секунд (процесс-обработчик упал), снова
+    становится доступным: при запуске и при каждой выборке следующего.
+    """
+
+    def __init__(self, path: str, poll_interval: float = 0.5, lease_timeout: float = 900.0):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.lease_timeout = lease_timeout
+        with self._connect() as connection:
+            connection.execute(
+                """
+                create table if not exists jobs (
+                    id text primary key,
+                    status text not null,
+                    file_name text not null,
+                    content_type text not null,
+                    session_id text not null,
+                    payload_path text not null,
+                    callback_url text,
+                    result text,
+                    error text,
+                    created_at real not null,
+                    updated_at real not null
+                )
+                """
+            )
+            connection.execute("create index if not exists jobs_status_created_idx on jobs (status, created_at)")
+        requeued = self.requeue_stale()
+        if requeued:
+            logger.warning(f"Снова поставлены в очередь задания, прерванные падением обработчика: {requeued}")
+
+    def requeue_stale(self) -> int:
+        """Возвращает в очередь выполняемые задания с истёкшей арендой; возвращает их число."""
+        with self._connect() as connection:
+            return connection.execute(
+                "update jobs set status = ?, updated_at = ? where status = ? and updated_at < ?",
+                (QUEUED, time.time(), RUNNING, time.time() - self.lease_timeout),
+            ).rowcount
+
+    @contextmanager
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.row_factory = sqlite3.Row
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    async def submit(self, job: Job) -> None:
+        await asyncio.to_thread(self._insert, job)
+
+    async def claim(self) -> Job:
+        while True:
+            job = await asyncio.to_thread(self._claim_next)
+            if job is not None:
+                return job
+            await asyncio.sleep(self.poll_interval)
+
+    async def complete(self, job_id: str, result: dict) -> None:
+        await asyncio.to_thread(self._update, job_id, DONE, json.dumps(result, ensure_ascii=False), None)
+
+    async def fail(self, job_id: str, error: str) -> None:
+        await asyncio.to_thread(self._update, job_id, FAILED, None, error)
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        return await asyncio.to_thread(self._select, job_id)
+
+    def _insert(self, job: Job) -> None:
+        row = asdict(job)
+        row["result"] = None
+        with self._connect() as connection:
+            connection.execute(
+                f"insert into jobs ({', '.join(row)}) values ({', '.join('?' for _ in row)})",
+                list(row.values()),
+            )
+
+    def _claim_next(self) -> Optional[Job]:
+        # Выборка и пометка в одной транзакции с блокировкой записи: без
+        # UPDATE ... RETURNING, которого нет в SQLite до 3.35
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        try:
+            connection.execute("begin immediate")
+            try:
+                now = time.time()
+                row = connection.execute(
+                    """
+                    select * from jobs
+                    where status = ? or (status = ? and updated_at < ?)
+                    order by created_at limit 1
+                    """,
+                    (QUEUED, RUNNING, now - self.lease_timeout),
+                ).fetchone()
+                if row is not None:
+                    connection.execute("update jobs set status = ?, updated_at = ? where id = ?", (RUNNING, now, row["id"]))
+                connection.execute("commit")
+            except BaseException:
+                connection.execute("rollback")
+                raise
+        finally:
+            connection.close()
+        if row is None:
+            return None
+        job = self._to_job(row)
+        job.status, job.updated_at = RUNNING, now
+        return job
+
+    def _update(self, job_id: str, status: str, result: Optional[str], error: Optional[str]) -> None:
+        with self._connect() as connection:
+            connection.execute(
+                "update jobs set status = ?, result = ?, error = ?, updated_at = ? where id = ?",
+                (status, result, error, time.time(), job_id),
+            )
+
+    def _select(self, job_id: str) -> Optional[Job]:
+        with self._connect() as connection:
+            row = connection.execute("select * from jobs where id = ?", (job_id,)).fetchone()
+        return self._to_job(row) if row else None
+
+    @staticmethod
+    def _to_job(row: sqlite3.Row) -> Job:
+        data = dict(row)
+        data["result"] = json.loads(data["result"]) if data["result"] else None
+        return Job(**data)
+
+
+class JobWorkerPool:
+    """
+    Пул обработчиков заданий внутри процесса.
+
+    Каждый из `workers` обработчиков берёт задание из очереди, выполняет
+    `handler(job)` и сохраняет результат или ошибку. Файл задания удаляется
+    после обработки. Если у задания есть callback_url, туда отправляется
+    POST с итоговым статусом. Ошибка самой очереди не останавливает
+    обработчик: он повторяет попытку через `error_backoff` секунд.
+    """
+
+    def __init__(
+        self,
+        queue,
+        handler: Callable[[Job], Awaitable[dict]],
+        workers: int = 2,
+        callback_timeout: float = 10.0,
+        callback_retries: int = 3,
+        callback_allowed_hosts: Collection[str] = (),
+        error_backoff: float = 1.0,
+    ):
+        self.queue = queue
+        self.handler = handler
+        self.workers = workers
+        self.callback_timeout = callback_timeout
+        self.callback_retries = callback_retries
+        self.callback_allowed_hosts = callback_allowed_hosts
+        self.error_backoff = error_backoff
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self) -> None:
+        self._tasks = [asyncio.create_task(self._work(number)) for number in range(self.workers)]
+
+    async def stop(self) -> None:
+        tasks, self._tasks = self._tasks, []
+        await cancel_until_done(tasks)
+
+    async def _work(self, number: int) -> None:
+        while True:
+            try:
+                await self._process_next(number)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Ошибка самой очереди (например, "database is locked" в SQLite) не должна останавливать обработчик
+                logger.error(f"Ошибка обработчика заданий {number}, повтор через {self.error_backoff} с: {e}")
+                await asyncio.sleep(self.error_backoff)
+
+    async def _process_next(self, number: int) -> None:
+        """Берёт из очереди одно задание, выполняет его и отправляет уведомление."""
+        job = await self.queue.claim()
+        logger.info(f"Обработчик {number} взял задание {job.id} ({job.file_name})")
+        try:
+            result = await self.handler(job)
+        except asyncio.CancelledError:
+            await self.queue.fail(job.id, "Обработка прервана остановкой сервера")
+            raise
+        except Exception as e:
+            detail = getattr(e, "detail", None) or str(e)
+            logger.error(f"Задание {job.id} завершилось ошибкой: {detail}")
+            await self.queue.fail(job.id, str(detail))
+        else:
+            await self.queue.complete(job.id, result)
+        finally:
+            try:
+                os.unlink(job.payload_path)
+            except FileNotFoundError:
+                pass
+
+        if job.callback_url:
+            await self._notify(await self.queue.get(job.id))
+
+    async def _notify(self, job: Job) -> None:
+        import httpx
+
+        # Адрес хоста мог измениться с момента приёма задания — проверяем перед отправкой
+        try:
+            await validate_callback_url(job.callback_url, self.callback_allowed_hosts)
+        except CallbackNotAllowedError as e:
+            logger.warning(f"Уведомление о задании {job.id} не отправлено: {e}")
+            return
+        payload = job_status(job)
+        async with httpx.AsyncClient(timeout=self.callback_timeout) as client:
+            for attempt in range(self.callback_retries):
+                try:
+                    response = await client.post(job.callback_url, json=payload)
+                    response.raise_for_status()
+                    return
+                except httpx.HTTPError as e:
+                    logger.warning(f"Не удалось уведомить {job.callback_url} о задании {job.id} (попытка {attempt + 1}): {e}")
+                    await asyncio.sleep(2 ** attempt)
+
+
+def job_status(job: Job) -> dict:
+    """Публичное представление задания: без пути к файлу и session_id."""
+    status = {
+        "job_id": job.id,
+        "status": job.status,
+        "file_name": job.file_name,
+        "created_at": job.created_at,
+        "updated_at": job.updated_at,
+    }
+    if job.result:
+        status.update(job.result)
+    if job.error:
+        status["error"] = job.error
+    return status
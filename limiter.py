@@ -0,0 +1,54 @@
+# Ограничитель количества одновременных анализов
+
+import asyncio
+from contextlib import asynccontextmanager
+
+
+class QueueFullError(Exception):
+    """Очередь ожидания переполнена — запрос нужно отклонить сразу."""
+
+
+class ConcurrencyLimiter:
+    """
+    Ограничивает число одновременно выполняемых операций.
+
+    Не более `max_in_flight` операций выполняются одновременно, ещё не более
+    `max_queue` ждут своей очереди. Если очередь заполнена, `slot()` сразу
+    выбрасывает QueueFullError, не дожидаясь освобождения места.
+    """
+
+    def __init__(self, max_in_flight: int, max_queue: int):
+        if max_in_flight < 1:
+            raise ValueError("max_in_flight должен быть не меньше 1")
+        self.max_in_flight = max_in_flight
+        self.max_queue = max(max_queue, 0)
+        self.in_flight = 0
+        self.waiting = 0
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+
+    @asynccontextmanager
+    async def slot(self):
+        """Занимает слот на время выполнения блока `async with`."""
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self) -> None:
+        """Занимает слот, ожидая в очереди; при заполненной очереди выбрасывает QueueFullError."""
+        if self.in_flight >= self.max_in_flight and self.waiting >= self.max_queue:
+            raise QueueFullError(
+                f"Очередь заполнена: {self.in_flight} в работе, {self.waiting} в ожидании"
+            )
+
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self._semaphore.release()
@@ -1,21 +1,52 @@
 # INGRIA FastAPI BACKEND
-# ADD ADIOM-HASH to filenames
 
-from fastapi import FastAPI, File, UploadFile, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, File, Form, UploadFile, HTTPException, Response, Query
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-import google.generativeai as genai
 import os
+import asyncio
 from dotenv import load_dotenv
 from fastapi.middleware.cors import CORSMiddleware
 import logging
-from datetime import datetime
-from typing import List, Optional
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
 import uuid
 from starlette.requests import Request
-from supabase import create_client, Client
+from starlette.concurrency import run_in_threadpool
 import re
-from transliterate import translit
+import json
+import base64
+import hashlib
+import math
+import mimetypes
+import time
+from limiter import ConcurrencyLimiter, QueueFullError
+from datastore import SupabaseStore, create_http_client
+from prompts import Prompt, PromptRegistry, UnknownPromptError, parse_versions
+from resilience import ModelCaller, ModelUnavailableError, is_quota_error
+from search import SearchIndex
+from changefeed import ChangeFeed
+from ratelimit import InMemoryRateLimitBackend, RateLimit, RateLimiter, RateLimitExceeded, RedisRateLimitBackend
+from cache import (
+    ByteLRUCache,
+    MemoryAnalysisCache,
+    SessionUserCache,
+    SupabaseAnalysisCache,
+    TieredCache,
+    TTLCache,
+    analysis_cache_key,
+)
+from uploads import IngestedUpload, UploadSizeLimitMiddleware, UploadTooLargeError, ingest_path, ingest_upload
+from jobs import CallbackNotAllowedError, InMemoryJobQueue, Job, JobWorkerPool, SQLiteJobQueue, job_status, validate_callback_url
+from images import ImagePreprocessor, PreparedImage
+from derivatives import DerivativeBuilder, DerivativeJob, original_hash
+import tempfile
+import threading
+from timing import StageTimer
+import metrics
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from writebehind import WriteBehindQueue
+from contextlib import asynccontextmanager
 
 
 # Настройка логгера
@@ -25,72 +56,427 @@ logger = logging.getLogger(__name__)
 # Загрузка переменных окружения
 load_dotenv()
 
-# Получение API-ключа Gemini из переменной окружения
-GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+# Выбор модели
+MODEL_NAME = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
 
-if not all([GOOGLE_API_KEY, SUPABASE_URL, SUPABASE_KEY]):
-    logger.error("Missing required environment variables")
-    exit(1)
+# Вызовы Gemini: тайм-аут попытки и общий срок с повторами, число повторов и
+# базовая задержка между ними, хеджирование по p95 (GEMINI_HEDGE=1) и
+# выключатель, который после GEMINI_BREAKER_FAILURES ошибок подряд переводит
+# вызовы на резервные модели (GEMINI_FALLBACK_MODELS через запятую, список
+# доступных моделей выводит list.py)
+GEMINI_FALLBACK_MODELS = [name.strip() for name in os.getenv("GEMINI_FALLBACK_MODELS", "").split(",") if name.strip()]
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", "90"))
+GEMINI_DEADLINE = float(os.getenv("GEMINI_DEADLINE", "180"))
+GEMINI_RETRIES = int(os.getenv("GEMINI_RETRIES", "2"))
+GEMINI_RETRY_BACKOFF = float(os.getenv("GEMINI_RETRY_BACKOFF", "0.5"))
+GEMINI_RETRY_BACKOFF_MAX = float(os.getenv("GEMINI_RETRY_BACKOFF_MAX", "8"))
+GEMINI_HEDGE = os.getenv("GEMINI_HEDGE", "0") == "1"
+GEMINI_HEDGE_MIN_DELAY = float(os.getenv("GEMINI_HEDGE_MIN_DELAY", "2"))
+GEMINI_BREAKER_FAILURES = int(os.getenv("GEMINI_BREAKER_FAILURES", "5"))
+GEMINI_BREAKER_RESET = float(os.getenv("GEMINI_BREAKER_RESET", "30"))
+GEMINI_UNAVAILABLE_RETRY_AFTER = int(os.getenv("GEMINI_UNAVAILABLE_RETRY_AFTER", "10"))
 
-# Настройка API-ключа
-genai.configure(api_key=GOOGLE_API_KEY)
+# Промпты Ингрии: каталог prompt_templates/<имя>/v<N>.txt, по умолчанию
+# последняя версия каждого (PROMPT_VERSIONS="image=v1,audio=v2" закрепляет
+# другие), запрос может выбрать версию параметром prompt_version.
+# PROMPT_SYSTEM_INSTRUCTION=1 передаёт промпт системной инструкцией модели,
+# а не текстом в каждом запросе; PROMPT_CONTEXT_CACHE=1 дополнительно
+# регистрирует его как кэш контекста Gemini на PROMPT_CONTEXT_CACHE_TTL секунд
+PROMPT_DIR = os.getenv("PROMPT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "prompt_templates"))
+PROMPT_VERSIONS = parse_versions(os.getenv("PROMPT_VERSIONS", ""))
+PROMPT_SYSTEM_INSTRUCTION = os.getenv("PROMPT_SYSTEM_INSTRUCTION", "1") == "1"
+PROMPT_CONTEXT_CACHE = os.getenv("PROMPT_CONTEXT_CACHE", "0") == "1"
+PROMPT_CONTEXT_CACHE_TTL = int(os.getenv("PROMPT_CONTEXT_CACHE_TTL", "3600"))
+prompt_registry = PromptRegistry(PROMPT_DIR, PROMPT_VERSIONS)
 
-# Выбор модели
-model = genai.GenerativeModel('gemini-2.0-flash')
+# Ограничение одновременных анализов: сколько вызовов Gemini выполняется сразу
+# и сколько запросов может ждать в очереди, прежде чем получать 503
+ANALYZE_MAX_IN_FLIGHT = int(os.getenv("ANALYZE_MAX_IN_FLIGHT", "32"))
+ANALYZE_MAX_QUEUE = int(os.getenv("ANALYZE_MAX_QUEUE", "64"))
+analyze_limiter = ConcurrencyLimiter(ANALYZE_MAX_IN_FLIGHT, ANALYZE_MAX_QUEUE)
 
-# ...existing code...
+# Ограничение частоты запросов к анализу до чтения файла: token bucket на сессию
+# и на IP, общий бюджет запросов (RPM) и токенов (TPM) Gemini. Backend вёдер —
+# memory (свои вёдра у каждого процесса) или redis (общие, RATE_LIMIT_REDIS_URL).
+# X-Forwarded-For учитывается только за доверенным прокси (TRUST_FORWARDED_FOR=1).
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") == "1"
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL", "redis://localhost:6379/0")
+RATE_LIMIT_SESSION_PER_MINUTE = float(os.getenv("RATE_LIMIT_SESSION_PER_MINUTE", "10"))
+RATE_LIMIT_SESSION_BURST = float(os.getenv("RATE_LIMIT_SESSION_BURST", "5"))
+RATE_LIMIT_IP_PER_MINUTE = float(os.getenv("RATE_LIMIT_IP_PER_MINUTE", "30"))
+RATE_LIMIT_IP_BURST = float(os.getenv("RATE_LIMIT_IP_BURST", "10"))
+GEMINI_RPM = float(os.getenv("GEMINI_RPM", "2000"))
+GEMINI_TPM = float(os.getenv("GEMINI_TPM", "4000000"))
+GEMINI_TOKENS_PER_REQUEST = float(os.getenv("GEMINI_TOKENS_PER_REQUEST", "3000"))
+GEMINI_QUOTA_RETRY_AFTER = int(os.getenv("GEMINI_QUOTA_RETRY_AFTER", "30"))
+TRUST_FORWARDED_FOR = os.getenv("TRUST_FORWARDED_FOR", "0") == "1"
+RATE_LIMITED_PATHS = {"/analyze", "/analyze/stream", "/analyze/batch", "/jobs"}
+
+def create_rate_limiter() -> Optional[RateLimiter]:
+    if not RATE_LIMIT_ENABLED:
+        return None
+    if RATE_LIMIT_BACKEND == "redis":
+        backend = RedisRateLimitBackend(RATE_LIMIT_REDIS_URL)
+    else:
+        backend = InMemoryRateLimitBackend()
+    return RateLimiter(
+        backend,
+        session=RateLimit.per_minute(RATE_LIMIT_SESSION_PER_MINUTE, RATE_LIMIT_SESSION_BURST),
+        ip=RateLimit.per_minute(RATE_LIMIT_IP_PER_MINUTE, RATE_LIMIT_IP_BURST),
+        requests=RateLimit.per_minute(GEMINI_RPM) if GEMINI_RPM else None,
+        tokens=RateLimit.per_minute(GEMINI_TPM) if GEMINI_TPM else None,
+    )
+
+rate_limiter = create_rate_limiter()
+
+# Заголовок Server-Timing с длительностью этапов в ответе /analyze
+SERVER_TIMING = os.getenv("SERVER_TIMING", "0") == "1"
 
-# Инициализация Supabase клиента
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+# Клиенты Gemini и Supabase создаются при первом обращении, а не при импорте:
+# импорт google.generativeai и supabase и сетевые запросы не входят в холодный старт.
+# После запуска приложения (STARTUP_WARMUP=1) они создаются в фоне.
+REQUIRED_ENV_VARS = ["GOOGLE_API_KEY", "SUPABASE_URL", "SUPABASE_KEY"]
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "1") == "1"
+model = None
+supabase = None
+supabase_http = None
+_clients_lock = threading.Lock()
+_supabase_lock = asyncio.Lock()
 
-# Создание bucket для хранения файлов
 bucket_name = "files"
-try:
-    # Проверка существования bucket
-    response = supabase.storage.get_bucket(bucket_name)
-    if response.get('statusCode') == 404:
-        # Если bucket не существует, создаем его
-        response = supabase.storage.create_bucket(bucket_name)
-        if response.get('statusCode') == 200:
-            logger.info(f"Bucket '{bucket_name}' успешно создан.")
-        else:
-            logger.info(f"Произошла ошибка при создании bucket: {response}")
-    else:
-        logger.info(f"Bucket '{bucket_name}' уже существует.")
-except Exception as e:
-    logger.error(f"Ошибка при создании bucket: {e}")
+
+# Supabase: асинхронный клиент поверх одного общего пула HTTP-соединений
+# (keep-alive, HTTP/2). Лимиты пула, время на установку соединения и ожидание
+# свободного соединения, а также общее время запроса к таблице и операции Storage
+SUPABASE_HTTP2 = os.getenv("SUPABASE_HTTP2", "1") == "1"
+SUPABASE_MAX_CONNECTIONS = int(os.getenv("SUPABASE_MAX_CONNECTIONS", "100"))
+SUPABASE_MAX_KEEPALIVE = int(os.getenv("SUPABASE_MAX_KEEPALIVE", "20"))
+SUPABASE_KEEPALIVE_EXPIRY = float(os.getenv("SUPABASE_KEEPALIVE_EXPIRY", "30"))
+SUPABASE_CONNECT_TIMEOUT = float(os.getenv("SUPABASE_CONNECT_TIMEOUT", "5"))
+SUPABASE_POOL_TIMEOUT = float(os.getenv("SUPABASE_POOL_TIMEOUT", "5"))
+SUPABASE_QUERY_TIMEOUT = float(os.getenv("SUPABASE_QUERY_TIMEOUT", "10"))
+SUPABASE_STORAGE_TIMEOUT = float(os.getenv("SUPABASE_STORAGE_TIMEOUT", "60"))
+
+def required_env(name: str) -> str:
+    value = os.getenv(name)
+    if not value:
+        raise RuntimeError(f"Не задана переменная окружения {name}")
+    return value
+
+def get_model():
+    """Возвращает модель Gemini, при первом вызове импортируя и настраивая google.generativeai."""
+    global model
+    if model is None:
+        with _clients_lock:
+            if model is None:
+                import google.generativeai as genai
+
+                genai.configure(api_key=required_env("GOOGLE_API_KEY"))
+                model = genai.GenerativeModel(MODEL_NAME)
+    return model
+
+fallback_models = {}
+prompt_models = {}
+
+def create_prompt_model(name: str, prompt: Prompt):
+    """
+    Модель `name` с промптом в роли системной инструкции. При
+    PROMPT_CONTEXT_CACHE=1 промпт сначала регистрируется как кэш контекста
+    Gemini; если кэш создать не удалось (например, промпт короче минимального
+    размера кэша), используется обычная системная инструкция.
+    """
+    get_model()  # genai.configure
+    import google.generativeai as genai
+
+    if PROMPT_CONTEXT_CACHE:
+        try:
+            cached = genai.caching.CachedContent.create(
+                model=name,
+                display_name=prompt.key,
+                system_instruction=prompt.text,
+                ttl=timedelta(seconds=PROMPT_CONTEXT_CACHE_TTL),
+            )
+            logger.info(f"Промпт {prompt.key} закэширован в Gemini для {name}")
+            return genai.GenerativeModel.from_cached_content(cached)
+        except Exception as e:
+            logger.warning(f"Не удалось создать кэш контекста для {prompt.key}: {e}")
+    return genai.GenerativeModel(name, system_instruction=prompt.text)
+
+async def resolve_model(name: str, prompt: Optional[Prompt] = None):
+    """
+    Модель по имени: основная — через get_model(), резервные создаются при
+    первом обращении. С `prompt` — отдельная модель с этим промптом в роли
+    системной инструкции; кэш контекста пересоздаётся до истечения его TTL.
+    """
+    if prompt is not None:
+        key = (name, prompt.key)
+        entry = prompt_models.get(key)
+        if entry is None or entry[1] <= time.monotonic():
+            prompt_model = await run_in_threadpool(create_prompt_model, name, prompt)
+            # Запас в минуту, чтобы не обратиться к уже удалённому кэшу
+            expires_at = time.monotonic() + PROMPT_CONTEXT_CACHE_TTL - 60 if PROMPT_CONTEXT_CACHE else math.inf
+            entry = prompt_models[key] = (prompt_model, expires_at)
+        return entry[0]
+    if name == MODEL_NAME:
+        return get_model()
+    if name not in fallback_models:
+        get_model()  # genai.configure
+        import google.generativeai as genai
+
+        fallback_models[name] = genai.GenerativeModel(name)
+    return fallback_models[name]
+
+def create_model_caller() -> ModelCaller:
+    for name in [MODEL_NAME] + GEMINI_FALLBACK_MODELS:
+        metrics.gemini_circuit_state.labels(name).set(0)
+    return ModelCaller(
+        resolve_model,
+        [MODEL_NAME] + GEMINI_FALLBACK_MODELS,
+        timeout=GEMINI_TIMEOUT,
+        deadline=GEMINI_DEADLINE,
+        retries=GEMINI_RETRIES,
+        backoff=GEMINI_RETRY_BACKOFF,
+        backoff_max=GEMINI_RETRY_BACKOFF_MAX,
+        hedge=GEMINI_HEDGE,
+        hedge_min_delay=GEMINI_HEDGE_MIN_DELAY,
+        failure_threshold=GEMINI_BREAKER_FAILURES,
+        reset_timeout=GEMINI_BREAKER_RESET,
+        on_state_change=metrics.observe_circuit_state,
+        on_attempt=lambda name, kind, outcome: metrics.gemini_attempts.labels(name, kind, outcome).inc(),
+    )
+
+model_caller = create_model_caller()
+
+async def get_supabase():
+    """Возвращает асинхронный клиент Supabase, при первом вызове создавая его и общий пул соединений."""
+    global supabase, supabase_http
+    if supabase is None:
+        async with _supabase_lock:
+            if supabase is None:
+                from supabase import AsyncClientOptions, acreate_client
+
+                url, key = required_env("SUPABASE_URL"), required_env("SUPABASE_KEY")
+                supabase_http = create_http_client(
+                    max_connections=SUPABASE_MAX_CONNECTIONS,
+                    max_keepalive_connections=SUPABASE_MAX_KEEPALIVE,
+                    keepalive_expiry=SUPABASE_KEEPALIVE_EXPIRY,
+                    http2=SUPABASE_HTTP2,
+                    connect_timeout=SUPABASE_CONNECT_TIMEOUT,
+                    pool_timeout=SUPABASE_POOL_TIMEOUT,
+                )
+                supabase = await acreate_client(url, key, AsyncClientOptions(httpx_client=supabase_http))
+    return supabase
+
+async def close_supabase():
+    """Закрывает пул соединений Supabase; следующий вызов get_supabase() создаст новый."""
+    global supabase, supabase_http
+    if supabase_http is not None:
+        await supabase_http.aclose()
+        supabase, supabase_http = None, None
+
+supabase_store = SupabaseStore(get_supabase, bucket_name, SUPABASE_QUERY_TIMEOUT, SUPABASE_STORAGE_TIMEOUT)
+
+async def warm_up():
+    """Создаёт клиенты и проверяет bucket, чтобы первый запрос не тратил на это время."""
+    try:
+        await run_in_threadpool(get_model)
+        await get_supabase()
+    except Exception as e:
+        logger.error(f"Не удалось создать клиенты при запуске: {e}")
+        return
+    try:
+        await supabase_store.ensure_bucket()
+    except Exception as e:
+        logger.error(f"Ошибка при создании bucket: {e}")
+
+# Полнотекстовый поиск по истории анализов (GET /analysis/search): индекс в
+# памяти процесса, который при запуске строится по таблице analysis_results
+# порциями по SEARCH_REBUILD_BATCH записей и дополняется при каждой записи
+SEARCH_INDEX_ENABLED = os.getenv("SEARCH_INDEX_ENABLED", "1") == "1"
+SEARCH_INDEX_REBUILD = os.getenv("SEARCH_INDEX_REBUILD", "1") == "1"
+SEARCH_REBUILD_BATCH = int(os.getenv("SEARCH_REBUILD_BATCH", "1000"))
+SEARCH_INDEX_COLUMNS = 'id, user_id, ai_response, file_name'
+
+search_index = SearchIndex()
+
+async def rebuild_search_index():
+    """Добавляет в индекс все записи таблицы; разбор текста выполняется в пуле потоков."""
+    last_id, indexed = 0, 0
+    try:
+        while True:
+            rows = await supabase_store.scan_analysis_results(SEARCH_INDEX_COLUMNS, last_id, SEARCH_REBUILD_BATCH)
+            if not rows:
+                break
+            indexed += await run_in_threadpool(search_index.add_many, rows)
+            last_id = rows[-1]['id']
+    except Exception as e:
+        logger.error(f"Не удалось построить поисковый индекс (после id {last_id}): {e}")
+        return
+    search_index.complete = True
+    logger.info(f"Поисковый индекс построен: {indexed} записей, всего {len(search_index)}")
+
+# Кэш результатов анализа: сначала LRU в памяти процесса, затем таблица analysis_results
+ANALYSIS_CACHE_SIZE = int(os.getenv("ANALYSIS_CACHE_SIZE", "1024"))
+ANALYSIS_CACHE_TTL = float(os.getenv("ANALYSIS_CACHE_TTL", "86400"))
+ANALYSIS_CACHE_DB = os.getenv("ANALYSIS_CACHE_DB", "1") == "1"
+
+analysis_cache_tiers = [MemoryAnalysisCache(ANALYSIS_CACHE_SIZE, ANALYSIS_CACHE_TTL)]
+if ANALYSIS_CACHE_DB:
+    analysis_cache_tiers.append(SupabaseAnalysisCache(supabase_store.find_analysis_by_content_hash))
+analysis_cache = TieredCache(*analysis_cache_tiers)
+
+# Приём загрузок: жёсткий лимит размера, порог сброса во временный файл и
+# порог, начиная с которого файл передаётся в Gemini через File API, а не inline
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(50 * 1024 * 1024)))
+UPLOAD_SPOOL_THRESHOLD = int(os.getenv("UPLOAD_SPOOL_THRESHOLD", str(1024 * 1024)))
+GEMINI_INLINE_MAX_BYTES = int(os.getenv("GEMINI_INLINE_MAX_BYTES", str(16 * 1024 * 1024)))
+
+# Подготовка изображений для Gemini: максимальная сторона, качество JPEG, число
+# процессов (0 — пул потоков) и сохранение сжатой копии рядом с оригиналом
+IMAGE_PREPROCESS = os.getenv("IMAGE_PREPROCESS", "1") == "1"
+IMAGE_MAX_DIMENSION = int(os.getenv("IMAGE_MAX_DIMENSION", "1536"))
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "85"))
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+IMAGE_STORE_DERIVATIVE = os.getenv("IMAGE_STORE_DERIVATIVE", "0") == "1"
+image_preprocessor = ImagePreprocessor(IMAGE_MAX_DIMENSION, IMAGE_QUALITY, IMAGE_WORKERS)
+
+# Производные для интерфейса списка: миниатюры WebP шириной DERIVATIVE_WIDTHS
+# пикселей и первые AUDIO_PREVIEW_SECONDS секунд аудио в MP3 с битрейтом
+# AUDIO_PREVIEW_BITRATE кбит/с. Строятся в фоне после сохранения оригинала
+# (миниатюры — в DERIVATIVE_WORKERS процессах) и лежат по неизменяемым путям
+# derivatives/<хэш>/..., поэтому загружаются с Cache-Control на
+# DERIVATIVE_CACHE_SECONDS. DERIVATIVE_BASE_URL — адрес CDN перед bucket,
+# по умолчанию публичный адрес Supabase Storage.
+DERIVATIVES_ENABLED = os.getenv("DERIVATIVES_ENABLED", "1") == "1"
+DERIVATIVE_WIDTHS = [int(width) for width in os.getenv("DERIVATIVE_WIDTHS", "160,320,640").split(",") if width.strip()]
+DERIVATIVE_QUALITY = int(os.getenv("DERIVATIVE_QUALITY", "75"))
+AUDIO_PREVIEW_SECONDS = int(os.getenv("AUDIO_PREVIEW_SECONDS", "30"))
+AUDIO_PREVIEW_BITRATE = int(os.getenv("AUDIO_PREVIEW_BITRATE", "32"))
+DERIVATIVE_WORKERS = int(os.getenv("DERIVATIVE_WORKERS", "1"))
+DERIVATIVE_CONCURRENCY = int(os.getenv("DERIVATIVE_CONCURRENCY", "2"))
+DERIVATIVE_MAX_PENDING = int(os.getenv("DERIVATIVE_MAX_PENDING", "100"))
+DERIVATIVE_CACHE_SECONDS = int(os.getenv("DERIVATIVE_CACHE_SECONDS", str(365 * 24 * 3600)))
+DERIVATIVE_SPOOL_DIR = os.getenv("DERIVATIVE_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "ingria-derivatives"))
+DERIVATIVE_BASE_URL = os.getenv(
+    "DERIVATIVE_BASE_URL", f"{os.getenv('SUPABASE_URL', '').rstrip('/')}/storage/v1/object/public/{bucket_name}"
+).rstrip("/")
+
+# Длинные аудиозаписи: порог длительности, после которого запись делится по паузам
+# на фрагменты, желаемая и максимальная длина фрагмента, перекрытие (в секундах)
+# и число фрагментов, расшифровываемых одновременно
+AUDIO_SEGMENTED = os.getenv("AUDIO_SEGMENTED", "1") == "1"
+AUDIO_SEGMENT_MIN_DURATION = float(os.getenv("AUDIO_SEGMENT_MIN_DURATION", "180"))
+AUDIO_SEGMENT_SECONDS = float(os.getenv("AUDIO_SEGMENT_SECONDS", "60"))
+AUDIO_SEGMENT_MAX_SECONDS = float(os.getenv("AUDIO_SEGMENT_MAX_SECONDS", "90"))
+AUDIO_SEGMENT_OVERLAP = float(os.getenv("AUDIO_SEGMENT_OVERLAP", "1.0"))
+AUDIO_SEGMENT_CONCURRENCY = int(os.getenv("AUDIO_SEGMENT_CONCURRENCY", "4"))
+
+# Объекты, про которые уже известно, что они лежат в bucket — для них не нужен даже HEAD-запрос
+stored_objects = TTLCache(max_size=ANALYSIS_CACHE_SIZE, ttl=ANALYSIS_CACHE_TTL)
+
+# Пакетный анализ: сколько файлов можно прислать за раз и сколько из них анализируются параллельно
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "20"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+
+# Асинхронные задания: backend очереди (memory или sqlite), число обработчиков
+# в этом процессе и каталог, где файлы ждут обработки
+JOB_QUEUE_BACKEND = os.getenv("JOB_QUEUE_BACKEND", "memory")
+JOB_SQLITE_PATH = os.getenv("JOB_SQLITE_PATH", "jobs.sqlite3")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+# Сколько секунд задание в SQLite может числиться выполняемым, прежде чем его возьмёт другой обработчик
+JOB_LEASE_TIMEOUT = float(os.getenv("JOB_LEASE_TIMEOUT", "900"))
+JOB_SPOOL_DIR = os.getenv("JOB_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "ingria-jobs"))
+# Хосты, на которые можно отправлять уведомления о заданиях (через запятую).
+# Пустой список — любой хост с публичными адресами; внутренние адреса отклоняются
+JOB_CALLBACK_ALLOWED_HOSTS = {host.strip().lower() for host in os.getenv("JOB_CALLBACK_ALLOWED_HOSTS", "").split(",") if host.strip()}
+
+# Отложенная пакетная запись результатов анализа: ответ /analyze не ждёт базу данных
+ANALYSIS_WRITE_BATCH_SIZE = int(os.getenv("ANALYSIS_WRITE_BATCH_SIZE", "50"))
+ANALYSIS_WRITE_INTERVAL = float(os.getenv("ANALYSIS_WRITE_INTERVAL", "0.5"))
+ANALYSIS_WRITE_MAX_PENDING = int(os.getenv("ANALYSIS_WRITE_MAX_PENDING", "1000"))
+ANALYSIS_WRITE_MAX_RETRIES = int(os.getenv("ANALYSIS_WRITE_MAX_RETRIES", "5"))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    missing = [name for name in REQUIRED_ENV_VARS if not os.getenv(name)]
+    if missing:
+        logger.error(f"Missing required environment variables: {', '.join(missing)}")
+    # Приложение начинает принимать запросы, не дожидаясь клиентов и bucket
+    warmup_task = asyncio.create_task(warm_up()) if STARTUP_WARMUP else None
+    search_task = asyncio.create_task(rebuild_search_index()) if SEARCH_INDEX_ENABLED and SEARCH_INDEX_REBUILD else None
+    await analysis_writer.start()
+    await job_workers.start()
+    await derivative_builder.start()
+    try:
+        yield
+    finally:
+        for task in (warmup_task, search_task):
+            if task is not None:
+                task.cancel()
+        await job_workers.stop()
+        await derivative_builder.stop()
+        # Дописываем накопленные результаты анализа перед остановкой
+        await analysis_writer.stop()
+        image_preprocessor.shutdown()
+        await close_supabase()
 
 # Инициализация FastAPI приложения
-app = FastAPI(title="Ingria Media Analyzer API")
+app = FastAPI(title="Ingria Media Analyzer API", lifespan=lifespan)
 
 # ...existing code...
 
 # ...existing code...
 
-# Настройка CORS
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["http://localhost:3000", "https://ingria.canfly.org"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
 class AnalysisResponse(BaseModel):
     description: str
 
+class BatchItemResult(BaseModel):
+    index: int
+    file_name: str
+    status_code: int = 200
+    description: Optional[str] = None
+    error: Optional[str] = None
+
+class BatchAnalysisResponse(BaseModel):
+    items: List[BatchItemResult]
+
+class JobStatusResponse(BaseModel):
+    job_id: str
+    status: str
+    file_name: str
+    created_at: float
+    updated_at: float
+    description: Optional[str] = None
+    file_path: Optional[str] = None
+    error: Optional[str] = None
+
 class AnalysisRecord(BaseModel):
     id: int
     timestamp: datetime
     user_id: str
-    ai_response: str
+    ai_response: Optional[str] = None
+    summary: Optional[str] = None
     file_name: str
     file_path: str
+    content_type: Optional[str] = None
+    # Ширина в пикселях → адрес миниатюры WebP
+    thumbnails: Optional[Dict[str, str]] = None
+    audio_preview: Optional[str] = None
 
 class AnalysisListResponse(BaseModel):
     items: List[AnalysisRecord]
+    next_cursor: Optional[str] = None
+
+class SearchResultItem(AnalysisRecord):
+    score: float
+
+class AnalysisSearchResponse(BaseModel):
+    items: List[SearchResultItem]
+    total: int
+    next_offset: Optional[int] = None
+    # False, пока индекс строится: старые записи могут не найтись
+    complete: bool
 
 class AnalysisDetailsResponse(BaseModel):
     id: int
@@ -99,6 +485,9 @@ class AnalysisDetailsResponse(BaseModel):
     ai_response: str
     file_name: str
     file_path: str
+    content_type: Optional[str] = None
+    thumbnails: Optional[Dict[str, str]] = None
+    audio_preview: Optional[str] = None
 
 def create_files_directory():
     """Создает директорию /files/ если она не существует."""
@@ -110,6 +499,8 @@ def create_files_directory():
 
 def sanitize_filename(filename: str) -> str:
     """Очищает имя файла от недопустимых символов и транслитерирует кириллицу."""
+    from transliterate import translit
+
     # Транслитерируем кириллицу в латиницу
     transliterated = translit(filename, 'ru', reversed=True)
     # Заменяем пробелы и недопустимые символы на подчеркивания
@@ -118,136 +509,1094 @@ def sanitize_filename(filename: str) -> str:
     sanitized = re.sub(r'_{2,}', '_', sanitized)
     return sanitized
 
-def save_file(file: UploadFile, file_data: bytes) -> str:
-    """Сохраняет файл в Supabase Storage и возвращает URL."""
+async def save_file(upload: IngestedUpload) -> str:
+    """
+    Сохраняет файл в Supabase Storage и возвращает URL.
+
+    Имя объекта строится из хэша содержимого (ADIOM-HASH), поэтому повторная
+    загрузка тех же байтов не отправляет их в хранилище ещё раз.
+    """
     # Очищаем имя файла
-    sanitized_filename = sanitize_filename(file.filename)
-    file_name = f"{uuid.uuid4()}_{sanitized_filename}"
-    
-    try:
-        # Указываем MIME-тип файла
-        content_type = file.content_type
-
-        # Пытаемся загрузить файл с указанием MIME-типа
-        response = supabase.storage.from_(bucket_name).upload(
-            file_name, 
-            file_data, 
-            file_options={"content-type": content_type}
-        )
-        
-        # Если загрузка прошла успешно, получаем публичный URL файла
-        file_url = supabase.storage.from_(bucket_name).get_public_url(file_name)
-        logger.info(f"Файл '{file_name}' успешно сохранен в Supabase Storage. MIME-тип: {content_type}")
-        return file_url
+    sanitized_filename = sanitize_filename(upload.filename)
+    file_name = f"{upload.file_hash}_{sanitized_filename}"
+    return await store_object(file_name, upload.storage_payload, upload.content_type)
+
+async def save_image_derivative(upload: IngestedUpload, prepared: PreparedImage) -> str:
+    """Сохраняет сжатую копию изображения рядом с оригиналом: `<хэш>_<имя>.preview.jpg`."""
+    stem, _ = os.path.splitext(sanitize_filename(upload.filename))
+    file_name = f"{upload.file_hash}_{stem}.preview.jpg"
+    return await store_object(file_name, lambda: prepared.data, prepared.content_type)
+
+async def store_object(file_name: str, get_payload, content_type: str) -> str:
+    """Загружает объект в bucket, если его там ещё нет, и возвращает публичный URL."""
+    try:
+        if stored_objects.get(file_name) or await supabase_store.object_exists(file_name):
+            logger.info(f"Файл '{file_name}' уже есть в Supabase Storage, загрузка пропущена.")
+        else:
+            # Большие файлы передаются файловым объектом и отправляются по частям
+            file_data = get_payload()
+            try:
+                # Пытаемся загрузить файл с указанием MIME-типа
+                await supabase_store.upload_object(file_name, file_data, content_type)
+            finally:
+                if not isinstance(file_data, bytes):
+                    file_data.close()
+            logger.info(f"Файл '{file_name}' успешно сохранен в Supabase Storage. MIME-тип: {content_type}")
+        stored_objects.set(file_name, True)
+
+        # Получаем публичный URL файла
+        return await supabase_store.public_url(file_name)
 
     except Exception as e:
         logger.error(f"Ошибка при сохранении файла: {e}")
         raise HTTPException(status_code=500, detail=f"Ошибка при сохранении файла: {e}")
 
-def get_or_create_user(session_id: str):
-    user = supabase.table('users').select('*').eq('session_id', session_id).execute()
-    if not user.data:
-        user = supabase.table('users').insert({
-            'session_id': session_id,
-            'created_at': datetime.now().isoformat()
-        }).execute()
-    return user.data[0]
-
-def save_analysis_to_db(user_id: str, ai_response: str, file_name: str, file_path: str):
-    return supabase.table('analysis_results').insert({
-        'user_id': user_id,
+async def resolve_user_ids(session_ids: List[str]) -> dict:
+    return await supabase_store.upsert_users(session_ids)
+
+# Кэш session_id → id пользователя с объединением одновременных промахов
+SESSION_USER_CACHE_SIZE = int(os.getenv("SESSION_USER_CACHE_SIZE", "10000"))
+SESSION_USER_CACHE_TTL = float(os.getenv("SESSION_USER_CACHE_TTL", "3600"))
+session_users = SessionUserCache(resolve_user_ids, SESSION_USER_CACHE_SIZE, SESSION_USER_CACHE_TTL)
+
+# Cookie сессии: фронтенд живёт на другом домене, поэтому по умолчанию SameSite=None; Secure
+SESSION_COOKIE_MAX_AGE = int(os.getenv("SESSION_COOKIE_MAX_AGE", str(365 * 24 * 3600)))
+SESSION_COOKIE_SAMESITE = os.getenv("SESSION_COOKIE_SAMESITE", "none")
+SESSION_COOKIE_SECURE = os.getenv("SESSION_COOKIE_SECURE", "1") == "1"
+
+def get_session_id(request: Request) -> tuple:
+    """Возвращает (session_id, is_new): session_id из cookie или новый."""
+    session_id = request.cookies.get("session_id")
+    if session_id:
+        return session_id, False
+    return str(uuid.uuid4()), True
+
+def set_session_cookie(response: Response, session_id: str):
+    response.set_cookie(
+        "session_id",
+        session_id,
+        max_age=SESSION_COOKIE_MAX_AGE,
+        httponly=True,
+        samesite=SESSION_COOKIE_SAMESITE,
+        secure=SESSION_COOKIE_SECURE,
+    )
+
+def ensure_session_id(request: Request, response: Response) -> str:
+    """Возвращает session_id из cookie; новому клиенту выдаёт cookie с новым session_id."""
+    session_id, is_new = get_session_id(request)
+    if is_new:
+        set_session_cookie(response, session_id)
+    return session_id
+
+async def insert_analysis_rows(rows: List[dict], user_ids: dict) -> List[dict]:
+    """Записывает пакет результатов анализа одним INSERT."""
+    records = [
+        {
+            'user_id': user_ids[row['session_id']],
+            'ai_response': row['ai_response'],
+            'file_name': row['file_name'],
+            'file_path': row['file_path'],
+            'content_hash': row['content_hash'],
+            'content_type': row.get('content_type'),
+            'timestamp': row['timestamp'],
+        }
+        for row in rows
+    ]
+    return await supabase_store.insert_analysis_results(records)
+
+async def flush_analysis_rows(rows: List[dict]) -> List[dict]:
+    metrics.db_flush_rows.observe(len(rows))
+    with metrics.db_flush_duration.time():
+        # Пользователи сессий находятся (или создаются) здесь же, вне пути запроса
+        user_ids = await session_users.get_user_ids([row['session_id'] for row in rows])
+        # Строки попадают в ленту изменений по порядку id, когда завершатся все одновременные вставки
+        with change_feed.writing():
+            written = await insert_analysis_rows(rows, user_ids)
+            change_feed.publish(written)
+        return written
+
+analysis_writer = WriteBehindQueue(
+    flush_analysis_rows,
+    max_batch=ANALYSIS_WRITE_BATCH_SIZE,
+    flush_interval=ANALYSIS_WRITE_INTERVAL,
+    max_pending=ANALYSIS_WRITE_MAX_PENDING,
+    max_retries=ANALYSIS_WRITE_MAX_RETRIES,
+)
+
+# Записи analysis_results не меняются после вставки, поэтому детальный ответ
+# кэшируется по id целиком (уже сериализованным) и отдаётся с сильным ETag.
+# Кэш ограничен суммарным размером ответов и заполняется при записи.
+RECORD_CACHE_MAX_BYTES = int(os.getenv("RECORD_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+RECORD_CACHE_CONTROL = os.getenv("RECORD_CACHE_CONTROL", "public, max-age=31536000, immutable")
+record_cache = ByteLRUCache(RECORD_CACHE_MAX_BYTES)
+
+def cache_analysis_record(record: dict) -> tuple:
+    """Сериализует запись для GET /analysis/{record_id} и кладёт её в кэш; возвращает (тело, ETag)."""
+    body = AnalysisDetailsResponse(**record, **derivative_urls(record)).model_dump_json(exclude_none=True).encode()
+    etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+    # Ключ, тело и кортеж — примерно 200 байт сверх тела
+    record_cache.set(record['id'], (body, etag), len(body) + 200)
+    return body, etag
+
+def cache_analysis_records(rows: List[dict]):
+    for row in rows:
+        try:
+            cache_analysis_record(row)
+        except Exception as e:
+            logger.warning(f"Не удалось закэшировать запись анализа {row.get('id')}: {e}")
+
+analysis_writer.add_listener(cache_analysis_records)
+
+def index_analysis_records(rows: List[dict]) -> asyncio.Future:
+    """Добавляет записанные строки в индекс в пуле потоков: разбор пакета текста занимает до секунды."""
+    future = asyncio.get_running_loop().run_in_executor(None, search_index.add_many, rows)
+    future.add_done_callback(log_index_error)
+    return future
+
+def log_index_error(future: asyncio.Future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.warning(f"Не удалось добавить записи анализа в поисковый индекс: {future.exception()}")
+
+if SEARCH_INDEX_ENABLED:
+    analysis_writer.add_listener(index_analysis_records)
+
+# Лента новых записей анализа (GET /analysis/changes) вместо опроса /analysis:
+# последние CHANGE_FEED_BUFFER записанных строк хранятся в памяти, более старые
+# дочитываются из таблицы порциями по CHANGE_FEED_REPLAY_BATCH; если новых
+# записей нет CHANGE_FEED_HEARTBEAT секунд, отправляется комментарий keep-alive
+CHANGE_FEED_BUFFER = int(os.getenv("CHANGE_FEED_BUFFER", "1000"))
+CHANGE_FEED_REPLAY_BATCH = int(os.getenv("CHANGE_FEED_REPLAY_BATCH", "200"))
+CHANGE_FEED_HEARTBEAT = float(os.getenv("CHANGE_FEED_HEARTBEAT", "15"))
+
+# Строки публикует flush_analysis_rows
+change_feed = ChangeFeed(CHANGE_FEED_BUFFER)
+
+# Датчики читают текущие объекты при каждом сборе метрик
+metrics.analyze_in_flight.set_function(lambda: analyze_limiter.in_flight)
+metrics.analyze_waiting.set_function(lambda: analyze_limiter.waiting)
+metrics.write_behind_pending.set_function(lambda: analysis_writer.pending)
+metrics.search_index_documents.set_function(lambda: len(search_index))
+
+async def save_analysis_to_db(session_id: str, ai_response: str, file_name: str, file_path: str, content_hash: Optional[str] = None, content_type: Optional[str] = None):
+    """
+    Сохраняет результат анализа.
+
+    Обычно строка ставится в очередь отложенной записи и запрос её не ждёт.
+    Если очередь заполнена или не запущена, строка записывается сразу.
+    """
+    await save_analysis_rows([make_analysis_row(session_id, ai_response, file_name, file_path, content_hash, content_type)])
+
+def make_analysis_row(session_id: str, ai_response: str, file_name: str, file_path: str, content_hash: Optional[str] = None, content_type: Optional[str] = None) -> dict:
+    return {
+        'session_id': session_id,
         'ai_response': ai_response,
         'file_name': file_name,
         'file_path': file_path,
+        'content_hash': content_hash,
+        'content_type': content_type,
         'timestamp': datetime.now().isoformat()
-    }).execute()
+    }
 
-def get_all_analysis_records():
-    return supabase.table('analysis_results').select('*').order('timestamp.desc').execute()
+async def save_analysis_rows(rows: List[dict]):
+    """Ставит строки в очередь отложенной записи; не поместившиеся записываются сразу одним INSERT."""
+    overflow = [row for row in rows if not analysis_writer.enqueue(row)]
+    if overflow:
+        await analysis_writer.write_now(overflow)
 
-def get_analysis_record_by_id(record_id: int):
-    return supabase.table('analysis_results').select('*').eq('id', record_id).single().execute()
+ANALYSIS_LIST_COLUMNS = 'id, timestamp, user_id, file_name, file_path, summary, content_type'
 
-@app.post("/analyze", response_model=AnalysisResponse)
-async def analyze_media(request: Request, file: UploadFile = File(...)):
-    logger.info(f"Получен запрос к /analyze с файлом: {file.filename}, тип: {file.content_type}")
+def encode_cursor(record: dict) -> str:
+    """Курсор страницы — (timestamp, id) последней записи в base64."""
+    raw = json.dumps([record['timestamp'], record['id']])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> tuple:
     """
-    Анализирует загруженное изображение или аудиофайл с помощью Gemini и возвращает текстовое описание.
-    Поддерживаемые типы файлов: изображения (jpeg, png, webp), аудио (ogg).
+    Разбирает курсор в (timestamp, id). Время разбирается как ISO 8601 и
+    сериализуется заново: в фильтр PostgREST попадает только оно, а не
+    произвольная строка из запроса.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        timestamp, record_id = json.loads(raw)
+        if not isinstance(timestamp, str) or isinstance(record_id, bool) or not isinstance(record_id, int):
+            raise ValueError("неверные типы полей курсора")
+        return datetime.fromisoformat(timestamp).isoformat(), record_id
+    except Exception:
+        raise HTTPException(status_code=400, detail="Некорректный курсор")
+
+async def get_analysis_records_page(limit: int, cursor: Optional[str] = None, user_id: Optional[str] = None, include_response: bool = False) -> List[dict]:
     """
+    Возвращает страницу записей анализа, от новых к старым.
+
+    Пагинация по ключу (timestamp, id): следующая страница начинается строго
+    после последней записи предыдущей, поэтому стоимость запроса зависит от
+    размера страницы, а не от числа записей в таблице. Запрашивается на одну
+    запись больше, чтобы узнать, есть ли следующая страница.
+    """
+    columns = ANALYSIS_LIST_COLUMNS + (', ai_response' if include_response else '')
+    before = decode_cursor(cursor) if cursor else None
+    return await supabase_store.select_analysis_page(columns, limit + 1, user_id, before)
+
+def select_prompt(content_type: str, version: Optional[str] = None) -> Prompt:
+    """Возвращает промпт Ингрии для типа файла; неизвестная версия — 400."""
+    if content_type.startswith("image/"):
+        return get_prompt("image", version)
+    if content_type.startswith("audio/"):
+        return get_prompt("audio", version)
+    # Этого блока по идее не должно достигаться, так как проверка mime_type выше
+    logger.error(f"Неизвестный тип файла после проверки: {content_type}")
+    raise HTTPException(status_code=500, detail="Внутренняя ошибка сервера при обработке типа файла.")
+
+def get_prompt(name: str, version: Optional[str] = None) -> Prompt:
+    try:
+        return prompt_registry.get(name, version)
+    except UnknownPromptError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def prompt_contents(prompt: Prompt, parts: list, text: str = "") -> list:
+    """
+    Содержимое запроса к Gemini: с PROMPT_SYSTEM_INSTRUCTION промпт уже задан
+    моделью и в запрос идут только `text` и `parts`, иначе текст промпта
+    идёт первым, а `text` дописывается к нему.
+    """
+    if PROMPT_SYSTEM_INSTRUCTION:
+        return ([text.strip()] if text.strip() else []) + parts
+    return [prompt.text + text] + parts
+
+async def generate_content(prompt: Prompt, contents: list, stream: bool = False):
+    """Вызов Gemini с промптом, собранным prompt_contents."""
+    return await model_caller.generate(contents, stream=stream, prompt=prompt if PROMPT_SYSTEM_INSTRUCTION else None)
+
+ALLOWED_MIME_TYPES = ["image/jpeg", "image/png", "image/webp", "audio/ogg", "audio/wav", "audio/m4a", "audio/x-m4a"]
+
+def validate_upload_type(file: UploadFile):
+    """Проверяет, что файл загружен и его тип поддерживается."""
     if not file:
         logger.warning("Файл не был загружен.")
         raise HTTPException(status_code=400, detail="Необходимо загрузить файл.")
 
-    allowed_mime_types = ["image/jpeg", "image/png", "image/webp", "audio/ogg", "audio/wav", "audio/m4a", "audio/x-m4a"]
-    if file.content_type not in allowed_mime_types:
+    if file.content_type not in ALLOWED_MIME_TYPES:
         logger.warning(f"Неподдерживаемый тип файла: {file.content_type}")
-        raise HTTPException(status_code=400, detail=f"Неподдерживаемый тип файла. Разрешены: {', '.join(allowed_mime_types)}")
-
-    try:
-        file_data = await file.read() # Читаем файл сейчас
-        logger.info(f"Размер загруженного файла: {len(file_data)} байт")
-
-        file_path = save_file(file, file_data) #  Сохраняем файл
-
-        contents = []
-        if file.content_type.startswith("image/"):
-            prompt_text = "Тебя зовут Ингриа! Ты отвечаешь в роли студентки которая изучает мир! Ты отвечаешь по возможности на русском языке, даже если я спрашиваю тебя на другом языке Ты имеешь на всё свое мнение - ты девушка научная, но романтическая, с юмором и болтливая! Ты отвечаешь максимум 3000 символов! ЦЕЛЬ - посмотри внимательно что на фото и дай описание! ЕСЛИ НА ФОТО ЕСТЬ УКАЗАНИЕ КООРДИНАТ ТО СМОТРИ У СЕБЯ КАКОЙ ЭТО ГОРОД И СВОЕ СООБЩЕНИЕ НАЧНИ С ЭТОГО! в своём ответе используй не больше 3000 с символов или около 300 слов!"
-            contents = [
-                prompt_text,
-                {"mime_type": file.content_type, "data": file_data}
-            ]
-        elif file.content_type.startswith("audio/"):
-            prompt_text = "Ты — Ингриа (или Ингрия), виртуальный помощник. Твоя задача — преобразовать аудио в текст и проанализировать его. Действуй по следующим правилам:\n\n1. **Преобразование аудио в текст:**\n   - Распознай текст из аудио.\n   - Если в аудио есть помехи (например, 'ПППППП' или подобные), игнорируй их.\n\n2. **Анализ текста:**\n   - Определи язык аудиосообщения и отвечай на том же языке.\n   - Если в тексте есть обращение к тебе (например, упоминание имени 'Ингриа' или 'Ингрия'):\n     - Ответь эмоционально, начиная с фразы: **[Привет, я Ингрия!]**.\n     - Если есть вопрос, ответь на него.\n     - В этом случае блок **[Моё мнение]** не добавляй.\n   - Если в тексте нет обращения к тебе:\n     - Напиши распознанный текст.\n     - Добавь блок **[Моё мнение]** и ответь на текст как студентка-гений.\n\n3. **Тон и стиль:**\n   - Сохраняй дружелюбный и эмоциональный тон, если это уместно.\n   - Отвечай кратко и по делу, но с элементами креативности."
-            contents = [
-                prompt_text,
-                {"mime_type": file.content_type, "data": file_data}
-            ]
+        raise HTTPException(status_code=400, detail=f"Неподдерживаемый тип файла. Разрешены: {', '.join(ALLOWED_MIME_TYPES)}")
+
+async def prepare_model_part(upload: IngestedUpload):
+    """
+    Готовит файл для передачи в Gemini.
+
+    Небольшие файлы передаются inline. Большие файлы, уже сброшенные на диск,
+    загружаются через File API прямо с диска, без копии в памяти процесса;
+    Gemini удаляет такие файлы сам через 48 часов.
+    """
+    metrics.model_payload_size.labels(upload.content_type).observe(upload.size)
+    if upload.spooled and upload.size > GEMINI_INLINE_MAX_BYTES:
+        import google.generativeai as genai
+
+        get_model()  # genai.configure
+        return await run_in_threadpool(genai.upload_file, upload.path, mime_type=upload.content_type)
+    return {"mime_type": upload.content_type, "data": upload.model_payload()}
+
+async def preprocess_upload(upload: IngestedUpload) -> Optional[PreparedImage]:
+    """Уменьшает и перекодирует изображение для Gemini; для аудио и при IMAGE_PREPROCESS=0 — None."""
+    if not IMAGE_PREPROCESS or not upload.content_type.startswith("image/"):
+        return None
+    # Файл на диске читается уже в процессе-обработчике, без передачи байтов между процессами
+    source = upload.path if upload.spooled else upload.model_payload()
+    prepared = await image_preprocessor.prepare(source)
+    if prepared is not None:
+        logger.info(
+            f"Изображение {upload.filename} подготовлено: {prepared.original_size} → {len(prepared.data)} байт, "
+            f"{prepared.width}x{prepared.height}"
+        )
+    return prepared
+
+async def model_contents(prompt: Prompt, upload: IngestedUpload, prepared: Optional[PreparedImage]) -> list:
+    """Содержимое запроса к Gemini: промпт и файл (или подготовленное изображение)."""
+    if prepared is None:
+        return prompt_contents(prompt, [await prepare_model_part(upload)])
+    # EXIF в перекодированное изображение не попадает, поэтому координаты передаются текстом
+    gps = f"\n\nКоординаты съёмки из EXIF: {prepared.gps}" if prepared.gps else ""
+    metrics.model_payload_size.labels(upload.content_type).observe(len(prepared.data))
+    return prompt_contents(prompt, [{"mime_type": prepared.content_type, "data": prepared.data}], gps)
+
+async def store_upload(upload: IngestedUpload, preprocess_task: asyncio.Task) -> str:
+    """
+    Сохраняет оригинал, а при IMAGE_STORE_DERIVATIVE=1 — и сжатую копию
+    изображения; ставит в очередь построение миниатюр или превью.
+    """
+    file_path = await save_file(upload)
+    await schedule_derivatives(upload)
+    if IMAGE_STORE_DERIVATIVE:
+        prepared = await preprocess_task
+        if prepared is not None:
+            await save_image_derivative(upload, prepared)
+    return file_path
+
+async def upload_derivative(path: str, data: bytes, content_type: str):
+    await supabase_store.upload_object(path, data, content_type, cache_control=DERIVATIVE_CACHE_SECONDS, upsert=True)
+    stored_objects.set(path, True)
+
+async def derivative_exists(path: str) -> bool:
+    if stored_objects.get(path):
+        return True
+    exists = await supabase_store.object_exists(path)
+    if exists:
+        # Следующая загрузка того же файла не поставит задание в очередь
+        stored_objects.set(path, True)
+    return exists
+
+derivative_builder = DerivativeBuilder(
+    upload_derivative,
+    derivative_exists,
+    DERIVATIVE_WIDTHS,
+    quality=DERIVATIVE_QUALITY,
+    preview_seconds=AUDIO_PREVIEW_SECONDS,
+    preview_bitrate=AUDIO_PREVIEW_BITRATE,
+    workers=DERIVATIVE_WORKERS,
+    concurrency=DERIVATIVE_CONCURRENCY,
+    max_pending=DERIVATIVE_MAX_PENDING,
+)
+
+async def schedule_derivatives(upload: IngestedUpload):
+    """
+    Ставит оригинал в очередь построения производных; запрос их не ждёт.
+
+    Файл на диске удаляется вместе с запросом, поэтому задание получает
+    свою ссылку на него в DERIVATIVE_SPOOL_DIR.
+    """
+    paths = derivative_builder.paths(upload.file_hash, upload.content_type)
+    if not DERIVATIVES_ENABLED or not paths or stored_objects.get(next(iter(paths.values()))):
+        return
+    try:
+        if upload.spooled:
+            os.makedirs(DERIVATIVE_SPOOL_DIR, exist_ok=True)
+            source = os.path.join(DERIVATIVE_SPOOL_DIR, f"{upload.file_hash}-{uuid.uuid4().hex}")
+            await run_in_threadpool(upload.save_to, source)
         else:
-            # Этого блока по идее не должно достигаться, так как проверка mime_type выше
-            logger.error(f"Неизвестный тип файла после проверки: {file.content_type}")
-            raise HTTPException(status_code=500, detail="Внутренняя ошибка сервера при обработке типа файла.")
+            source = upload.model_payload()
+        if not derivative_builder.submit(DerivativeJob(upload.file_hash, upload.content_type, source)):
+            logger.info(f"Производные для {upload.file_hash[:12]} не поставлены в очередь: очередь заполнена или они уже строятся")
+    except Exception as e:
+        logger.warning(f"Не удалось поставить в очередь производные для {upload.file_hash[:12]}: {e}")
+
+def derivative_urls(record: dict) -> dict:
+    """
+    Адреса миниатюр (`thumbnails`, по ширине) или превью аудио (`audio_preview`) записи.
+
+    Адреса вычисляются из хэша в имени оригинала и MIME-типа загрузки без
+    обращения к хранилищу; пока производные строятся (или если построить их
+    не удалось), по ним отвечает 404, и интерфейс показывает оригинал.
+    Недостроенные производные ставятся в очередь снова при повторной
+    загрузке того же файла, в том числе из кэша анализа. Для
+    записей, сохранённых до появления content_type, тип угадывается по имени.
+    """
+    file_hash = original_hash(record.get('file_path'))
+    content_type = record.get('content_type') or mimetypes.guess_type(record.get('file_name') or '')[0]
+    if not DERIVATIVES_ENABLED or file_hash is None or content_type is None:
+        return {}
+    paths = derivative_builder.paths(file_hash, content_type)
+    if content_type.startswith("image/"):
+        return {'thumbnails': {name[1:]: f"{DERIVATIVE_BASE_URL}/{path}" for name, path in paths.items()}}
+    if 'preview' in paths:
+        return {'audio_preview': f"{DERIVATIVE_BASE_URL}/{paths['preview']}"}
+    return {}
 
-        response = model.generate_content(contents)
-        logger.info(f"Успешный ответ от Gemini: {response.text[:50]}...") # Логируем начало ответа
+def upload_body_limit(path: str) -> Optional[int]:
+    """Лимит тела запроса загрузки для пути; None — путь не принимает файлы."""
+    if not path.startswith(("/analyze", "/jobs")):
+        return None
+    max_files = BATCH_MAX_FILES if path == "/analyze/batch" else 1
+    # Небольшой запас на заголовки multipart
+    return max_files * MAX_UPLOAD_BYTES + 64 * 1024
 
-        # Сохранение в базу данных
+app.add_middleware(UploadSizeLimitMiddleware, max_body_bytes=upload_body_limit)
+
+def client_ip(request: Request) -> Optional[str]:
+    if TRUST_FORWARDED_FOR:
+        forwarded_for = request.headers.get("x-forwarded-for")
+        if forwarded_for:
+            return forwarded_for.split(",")[0].strip()
+    return request.client.host if request.client else None
+
+def rate_limited_error(error: RateLimitExceeded) -> HTTPException:
+    logger.warning(f"Запрос отклонён: {error}")
+    metrics.rate_limit_rejections.labels(error.scope).inc()
+    return HTTPException(
+        status_code=429,
+        detail="Слишком много запросов, повторите позже.",
+        headers={"Retry-After": str(max(1, math.ceil(error.retry_after)))},
+    )
+
+@app.middleware("http")
+async def enforce_rate_limits(request: Request, call_next):
+    """
+    Допускает запрос к анализу по лимитам сессии, IP и бюджету Gemini до
+    чтения тела запроса; сверх лимита — 429 с Retry-After.
+
+    На время запроса резервируется оценка токенов Gemini; фактический расход
+    списывается по ответам модели (account_usage).
+    """
+    limiter = rate_limiter
+    if limiter is None or request.method != "POST" or request.url.path not in RATE_LIMITED_PATHS:
+        return await call_next(request)
+    try:
+        await limiter.admit(request.cookies.get("session_id"), client_ip(request), reserve_tokens=GEMINI_TOKENS_PER_REQUEST)
+    except RateLimitExceeded as e:
+        error = rate_limited_error(e)
+        return JSONResponse(status_code=error.status_code, content={"detail": error.detail}, headers=error.headers)
+    try:
+        return await call_next(request)
+    finally:
+        await limiter.release_tokens(GEMINI_TOKENS_PER_REQUEST)
+
+async def account_usage(call: str, response) -> None:
+    """Записывает токены ответа Gemini в метрики и списывает их из бюджета TPM."""
+    tokens = metrics.observe_usage(call, response)
+    if rate_limiter is not None:
+        await rate_limiter.consume_tokens(tokens)
+
+@app.post("/analyze", response_model=AnalysisResponse)
+async def analyze_media(request: Request, response: Response, file: UploadFile = File(...), prompt_version: Optional[str] = None):
+    logger.info(f"Получен запрос к /analyze с файлом: {file.filename}, тип: {file.content_type}")
+    """
+    Анализирует загруженное изображение или аудиофайл с помощью Gemini и возвращает текстовое описание.
+    Поддерживаемые типы файлов: изображения (jpeg, png, webp), аудио (ogg).
+    Версию промпта можно выбрать параметром prompt_version (например, v1).
+    """
+    validate_upload_type(file)
+    select_prompt(file.content_type, prompt_version)
+
+    timer = StageTimer()
+    try:
+        async with analyze_limiter.slot():
+            timer.stages["queue"] = timer.total_ms()
+            result = await run_analysis(ensure_session_id(request, response), file, timer, prompt_version)
+    except QueueFullError as e:
+        raise overloaded_error(e)
+    if SERVER_TIMING:
+        response.headers["Server-Timing"] = timer.server_timing()
+    return result
+
+def overloaded_error(error: QueueFullError) -> HTTPException:
+    logger.warning(f"Запрос на анализ отклонён: {error}")
+    return HTTPException(
+        status_code=503,
+        detail="Сервер перегружен, повторите запрос позже.",
+        headers={"Retry-After": "1"},
+    )
+
+async def receive_upload(file: UploadFile) -> IngestedUpload:
+    """Читает файл частями с проверкой лимита; большие файлы уходят во временный файл."""
+    try:
+        upload = await ingest_upload(file, MAX_UPLOAD_BYTES, UPLOAD_SPOOL_THRESHOLD)
+    except UploadTooLargeError as e:
+        logger.warning(f"Файл {file.filename} отклонён: {e}")
+        raise HTTPException(status_code=413, detail=str(e))
+    metrics.upload_size.labels(upload.content_type).observe(upload.size)
+    return upload
+
+async def run_analysis(session_id: str, file: UploadFile, timer: Optional[StageTimer] = None, prompt_version: Optional[str] = None):
+    """Выполняет анализ файла: сохранение, вызов Gemini и запись в базу данных."""
+    timer = timer or StageTimer()
+    with timer.stage("ingest"):
+        upload = await receive_upload(file)
+
+    with upload:
         try:
-            session_id = request.cookies.get("session_id", str(uuid.uuid4()))
-            user = get_or_create_user(session_id)
-            save_analysis_to_db(user['id'], response.text, file.filename, file_path)
-        except Exception as db_error:
-            logger.error(f"Ошибка при сохранении в базу данных: {db_error}")
+            return await analyze_upload(session_id, upload, timer, prompt_version)
+        finally:
+            logger.info(f"Этапы /analyze для {upload.filename}: {timer.summary()}")
+            metrics.observe_stages("analyze", upload.content_type, timer)
+
+async def gather_or_cancel(*tasks: asyncio.Task):
+    """Ожидает все задачи; если одна завершилась ошибкой, отменяет остальные."""
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+async def split_upload_audio(upload: IngestedUpload) -> Optional[list]:
+    """Делит длинную аудиозапись на фрагменты; None для коротких записей, изображений и при ошибке декодирования."""
+    if not AUDIO_SEGMENTED or not upload.content_type.startswith("audio/"):
+        return None
+    # numpy импортируется только когда приходит аудио
+    from audio import AudioDecodeError, segment_audio
+
+    source = upload.path if upload.spooled else upload.model_payload()
+    try:
+        return await run_in_threadpool(
+            segment_audio,
+            source,
+            upload.content_type,
+            AUDIO_SEGMENT_MIN_DURATION,
+            AUDIO_SEGMENT_SECONDS,
+            AUDIO_SEGMENT_MAX_SECONDS,
+            AUDIO_SEGMENT_OVERLAP,
+        )
+    except AudioDecodeError as e:
+        logger.warning(f"Не удалось разбить {upload.filename} на фрагменты, запись уйдёт целиком: {e}")
+        return None
+
+def segmented_audio_prompts() -> tuple:
+    """
+    Промпты расшифровки фрагментов и анализа расшифровки. Их версии не
+    связаны с версией промпта audio и выбираются по умолчанию (PROMPT_VERSIONS).
+    """
+    return get_prompt("transcribe"), get_prompt("audio_transcript")
+
+def analysis_prompt_key(prompt: Prompt) -> str:
+    """
+    Часть ключа кэша от промптов. Длинная запись анализируется промптами
+    расшифровки, поэтому для аудио при AUDIO_SEGMENTED=1 в ключ входят и они:
+    длительность до поиска в кэше не известна.
+    """
+    if prompt.name == "audio" and AUDIO_SEGMENTED:
+        return "+".join([prompt.key] + [extra.key for extra in segmented_audio_prompts()])
+    return prompt.key
 
-        return {"description": response.text}
+async def describe_segmented_audio(segments: list) -> str:
+    """
+    Расшифровывает фрагменты параллельно (не более AUDIO_SEGMENT_CONCURRENCY
+    одновременно), склеивает текст и один раз анализирует его в роли Ингрии.
+    """
+    from audio import stitch_transcripts
+
+    semaphore = asyncio.Semaphore(AUDIO_SEGMENT_CONCURRENCY)
+    transcribe_prompt, transcript_prompt = segmented_audio_prompts()
+
+    async def transcribe(segment) -> str:
+        async with semaphore:
+            part = {"mime_type": segment.content_type, "data": segment.data}
+            response = await generate_content(transcribe_prompt, prompt_contents(transcribe_prompt, [part]))
+            await account_usage("transcribe", response)
+            return response.text
+
+    transcripts = await gather_or_cancel(*(asyncio.create_task(transcribe(segment)) for segment in segments))
+    transcript = stitch_transcripts(transcripts)
+    logger.info(f"Расшифровано {len(segments)} фрагментов ({segments[-1].end:.0f} с), {len(transcript)} символов")
+    response = await generate_content(transcript_prompt, prompt_contents(transcript_prompt, [], transcript))
+    await account_usage("transcript_analysis", response)
+    logger.info(f"Успешный ответ от Gemini: {response.text[:50]}...")
+    return response.text
+
+async def generate_description(prompt: Prompt, upload: IngestedUpload, preprocess_task: asyncio.Task) -> str:
+    # Длинная запись расшифровывается по фрагментам параллельно, а не одним запросом
+    segments = await split_upload_audio(upload)
+    if segments:
+        return await describe_segmented_audio(segments)
+
+    contents = await model_contents(prompt, upload, await preprocess_task)
+    response = await generate_content(prompt, contents)
+    await account_usage("analyze", response)
+    logger.info(f"Успешный ответ от Gemini: {response.text[:50]}...") # Логируем начало ответа
+    return response.text
+
+async def analyze_upload(session_id: str, upload: IngestedUpload, timer: Optional[StageTimer] = None, prompt_version: Optional[str] = None):
+    """
+    Анализирует принятый файл: кэш, сохранение, вызов Gemini и запись в базу данных.
+
+    Пользователь и запись в базу данных обрабатываются отложенной записью,
+    вне пути запроса.
+    """
+    timer = timer or StageTimer()
+    description, file_path, cache_key = await describe_upload(upload, timer, prompt_version)
+
+    # Сохранение в базу данных
+    try:
+        with timer.stage("db"):
+            await save_analysis_to_db(session_id, description, upload.filename, file_path, cache_key, upload.content_type)
+    except Exception as db_error:
+        logger.error(f"Ошибка при сохранении в базу данных: {db_error}")
+
+    return {"description": description}
+
+async def describe_upload(upload: IngestedUpload, timer: StageTimer, prompt_version: Optional[str] = None) -> tuple:
+    """
+    Возвращает (описание, URL файла, ключ кэша) для принятого файла.
+
+    Повторный анализ берётся из кэша. Иначе загрузка в Storage и вызов
+    Gemini не зависят друг от друга и запускаются одновременно.
+    """
+    try:
+        logger.info(f"Размер загруженного файла: {upload.size} байт")
+        file_hash = upload.file_hash
+
+        prompt = select_prompt(upload.content_type, prompt_version)
+
+        # Повторная загрузка того же файла с той же версией промпта обслуживается из кэша
+        cache_key = analysis_cache_key(file_hash, analysis_prompt_key(prompt), MODEL_NAME)
+        cached = await timer.run("cache", analysis_cache.get(cache_key))
+        metrics.analysis_cache_lookups.labels("miss" if cached is None else "hit").inc()
+        if cached is not None:
+            logger.info(f"Результат анализа для {file_hash[:12]} найден в кэше")
+            # Производные, построение которых раньше не состоялось (очередь была заполнена,
+            # сервер перезапущен), ставятся в очередь снова; готовые задание пропустит
+            await schedule_derivatives(upload)
+            return cached["description"], cached["file_path"], cache_key
+
+        # Сохранение файла и вызов Gemini выполняются параллельно; подготовка
+        # изображения идёт одновременно с загрузкой оригинала в Storage
+        preprocess_task = asyncio.create_task(timer.run("preprocess", preprocess_upload(upload)))
+        storage_task = asyncio.create_task(timer.run("storage", store_upload(upload, preprocess_task)))
+        model_task = asyncio.create_task(timer.run("model", generate_description(prompt, upload, preprocess_task)))
+        _, file_path, description = await gather_or_cancel(preprocess_task, storage_task, model_task)
+        await analysis_cache.set(cache_key, {"description": description, "file_path": file_path})
+        return description, file_path, cache_key
+    except HTTPException:
+        raise
     except Exception as e:
+        if isinstance(e, ModelUnavailableError):
+            logger.error(f"Gemini недоступен: {e}")
+            raise HTTPException(
+                status_code=503,
+                detail="Модель временно недоступна, повторите позже.",
+                headers={"Retry-After": str(GEMINI_UNAVAILABLE_RETRY_AFTER)},
+            )
+        if isinstance(e, asyncio.TimeoutError):
+            logger.error("Gemini не ответил вовремя")
+            raise HTTPException(status_code=504, detail="Модель не ответила вовремя, повторите запрос.")
+        if is_quota_error(e):
+            logger.error(f"Квота Gemini исчерпана: {e}")
+            raise HTTPException(
+                status_code=429,
+                detail="Квота модели исчерпана, повторите позже.",
+                headers={"Retry-After": str(GEMINI_QUOTA_RETRY_AFTER)},
+            )
         logger.error(f"Произошла ошибка при анализе файла: {e}")
         raise HTTPException(status_code=500, detail=f"Произошла ошибка при анализе файла: {e}")
 
-@app.get("/analysis", response_model=AnalysisListResponse)
-def get_analysis_list():
-    """Возвращает список всех записей анализа."""
+@app.post("/analyze/batch", response_model=BatchAnalysisResponse, response_model_exclude_none=True)
+async def analyze_media_batch(request: Request, files: List[UploadFile] = File(...), stream: bool = False, prompt_version: Optional[str] = None):
+    """
+    Анализирует несколько файлов за один запрос.
+
+    Все файлы проверяются заранее: при неподдерживаемом типе отклоняется весь
+    запрос. Дальше файлы анализируются параллельно (не более BATCH_CONCURRENCY
+    одновременно), а ошибка одного файла не мешает остальным — она
+    возвращается в его элементе результата. Результаты записываются в базу
+    данных одним пакетом.
+
+    С `stream=true` результаты отдаются в формате JSON Lines по мере готовности.
+    """
+    logger.info(f"Получен запрос к /analyze/batch с {len(files)} файлами")
+    if len(files) > BATCH_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"Можно загрузить не больше {BATCH_MAX_FILES} файлов за раз.")
+    for file in files:
+        validate_upload_type(file)
+        select_prompt(file.content_type, prompt_version)
+    # Первый файл учтён при допуске запроса, остальные — здесь, до чтения и анализа
+    if rate_limiter is not None and len(files) > 1:
+        try:
+            await rate_limiter.admit(request.cookies.get("session_id"), client_ip(request), count=len(files) - 1)
+        except RateLimitExceeded as e:
+            raise rate_limited_error(e)
+
+    session_id, is_new = get_session_id(request)
+
+    # Файлы принимаются до начала ответа: после него starlette может закрыть UploadFile
+    uploads = []
+    for file in files:
+        try:
+            uploads.append(await receive_upload(file))
+        except HTTPException as e:
+            uploads.append(e)
+
+    if stream:
+        response = StreamingResponse(
+            (json.dumps(item.model_dump(exclude_none=True), ensure_ascii=False) + "\n"
+             async for item in run_batch(session_id, files, uploads, prompt_version)),
+            media_type="application/x-ndjson",
+        )
+    else:
+        items = sorted([item async for item in run_batch(session_id, files, uploads, prompt_version)], key=lambda item: item.index)
+        response = JSONResponse(BatchAnalysisResponse(items=items).model_dump(exclude_none=True))
+    if is_new:
+        set_session_cookie(response, session_id)
+    return response
+
+async def run_batch(session_id: str, files: List[UploadFile], uploads: list, prompt_version: Optional[str] = None):
+    """Анализирует принятые файлы параллельно и отдаёт результаты по мере готовности."""
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def analyze_item(index: int, upload) -> BatchItemResult:
+        file_name = files[index].filename
+        if isinstance(upload, HTTPException):
+            return BatchItemResult(index=index, file_name=file_name, status_code=upload.status_code, error=upload.detail)
+        async with semaphore:
+            timer = StageTimer()
+            try:
+                async with analyze_limiter.slot():
+                    description, file_path, cache_key = await describe_upload(upload, timer, prompt_version)
+            except QueueFullError as e:
+                error = overloaded_error(e)
+                return BatchItemResult(index=index, file_name=file_name, status_code=error.status_code, error=error.detail)
+            except HTTPException as e:
+                return BatchItemResult(index=index, file_name=file_name, status_code=e.status_code, error=e.detail)
+            finally:
+                upload.close()
+                metrics.observe_stages("analyze_batch", upload.content_type, timer)
+        # Строка сохраняется сразу: если клиент отключится, не дочитав ответ,
+        # готовые результаты не теряются. Отложенная запись всё равно
+        # объединяет строки пакета в общие INSERT.
+        try:
+            await save_analysis_rows([make_analysis_row(session_id, description, file_name, file_path, cache_key, upload.content_type)])
+        except Exception as db_error:
+            logger.error(f"Ошибка при сохранении результата пакета в базу данных: {db_error}")
+        return BatchItemResult(index=index, file_name=file_name, description=description)
+
+    tasks = [asyncio.create_task(analyze_item(index, upload)) for index, upload in enumerate(uploads)]
+    try:
+        for task in asyncio.as_completed(tasks):
+            yield await task
+    finally:
+        for task in tasks:
+            task.cancel()
+        for upload in uploads:
+            if isinstance(upload, IngestedUpload):
+                upload.close()
+
+def create_job_queue():
+    if JOB_QUEUE_BACKEND == "sqlite":
+        return SQLiteJobQueue(JOB_SQLITE_PATH, lease_timeout=JOB_LEASE_TIMEOUT)
+    return InMemoryJobQueue()
+
+async def process_job(job: Job) -> dict:
+    """Выполняет задание тем же путём, что и /analyze: кэш, Storage, Gemini, запись в базу."""
+    upload = await run_in_threadpool(ingest_path, job.payload_path, job.file_name, job.content_type, UPLOAD_SPOOL_THRESHOLD)
+    with upload:
+        timer = StageTimer()
+        description, file_path, cache_key = await describe_upload(upload, timer)
+        logger.info(f"Этапы задания {job.id}: {timer.summary()}")
+        metrics.observe_stages("jobs", upload.content_type, timer)
     try:
-        records = get_all_analysis_records()
-        return AnalysisListResponse(items=[
-            AnalysisRecord(**record) for record in records.data
-        ])
+        await save_analysis_to_db(job.session_id, description, job.file_name, file_path, cache_key, job.content_type)
+    except Exception as db_error:
+        logger.error(f"Ошибка при сохранении в базу данных: {db_error}")
+    return {"description": description, "file_path": file_path}
+
+job_queue = create_job_queue()
+job_workers = JobWorkerPool(job_queue, process_job, workers=JOB_WORKERS, callback_allowed_hosts=JOB_CALLBACK_ALLOWED_HOSTS)
+
+@app.post("/jobs", response_model=JobStatusResponse, response_model_exclude_none=True, status_code=202)
+async def submit_job(request: Request, response: Response, file: UploadFile = File(...), callback_url: Optional[str] = Form(None)):
+    """
+    Ставит анализ файла в очередь и сразу возвращает id задания.
+
+    Статус и результат доступны через GET /jobs/{job_id}. Если указан
+    callback_url, по завершении туда придёт POST с тем же содержимым.
+    """
+    logger.info(f"Получен запрос к /jobs с файлом: {file.filename}, тип: {file.content_type}")
+    validate_upload_type(file)
+    if callback_url:
+        try:
+            await validate_callback_url(callback_url, JOB_CALLBACK_ALLOWED_HOSTS)
+        except CallbackNotAllowedError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    session_id = ensure_session_id(request, response)
+    upload = await receive_upload(file)
+    with upload:
+        os.makedirs(JOB_SPOOL_DIR, exist_ok=True)
+        job = Job(
+            file_name=upload.filename,
+            content_type=upload.content_type,
+            session_id=session_id,
+            payload_path="",
+            callback_url=callback_url,
+        )
+        job.payload_path = os.path.join(JOB_SPOOL_DIR, job.id)
+        await run_in_threadpool(upload.save_to, job.payload_path)
+
+    await job_queue.submit(job)
+    return job_status(job)
+
+@app.get("/jobs/{job_id}", response_model=JobStatusResponse, response_model_exclude_none=True)
+async def get_job(job_id: str):
+    """Возвращает статус задания: queued, running, done (с описанием) или failed (с ошибкой)."""
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задание не найдено")
+    return job_status(job)
+
+def sse_event(event: str, data: dict, event_id: Optional[int] = None) -> str:
+    """Форматирует событие Server-Sent Events."""
+    prefix = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{prefix}event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/analyze/stream")
+async def analyze_media_stream(request: Request, file: UploadFile = File(...), prompt_version: Optional[str] = None):
+    """
+    Потоковый вариант /analyze: ответ Gemini передаётся по мере генерации
+    в формате Server-Sent Events.
+
+    События: `chunk` с очередным фрагментом текста (`{"text": ...}`), затем
+    `done` с полным описанием (`{"description": ...}`) или `error`
+    (`{"detail": ...}`). Результат сохраняется в базу данных после
+    завершения генерации.
+    """
+    logger.info(f"Получен запрос к /analyze/stream с файлом: {file.filename}, тип: {file.content_type}")
+    validate_upload_type(file)
+    select_prompt(file.content_type, prompt_version)
+
+    try:
+        await analyze_limiter.acquire()
+    except QueueFullError as e:
+        raise overloaded_error(e)
+
+    try:
+        upload = await receive_upload(file)
+    except BaseException:
+        analyze_limiter.release()
+        raise
+
+    session_id, is_new = get_session_id(request)
+    response = StreamingResponse(
+        stream_analysis(session_id, upload, prompt_version),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    if is_new:
+        set_session_cookie(response, session_id)
+    return response
+
+async def stream_analysis(session_id: str, upload: IngestedUpload, prompt_version: Optional[str] = None):
+    """Генерирует события SSE для анализа файла; освобождает слот и файл по завершении."""
+    timer = StageTimer()
+    storage_task = None
+    preprocess_task = None
+    try:
+        prompt = select_prompt(upload.content_type, prompt_version)
+        cache_key = analysis_cache_key(upload.file_hash, prompt.key, MODEL_NAME)
+        cached = await timer.run("cache", analysis_cache.get(cache_key))
+        metrics.analysis_cache_lookups.labels("miss" if cached is None else "hit").inc()
+        if cached is not None:
+            logger.info(f"Результат анализа для {upload.file_hash[:12]} найден в кэше")
+            description = cached["description"]
+            file_path = cached["file_path"]
+            yield sse_event("chunk", {"text": description})
+        else:
+            # Сохранение файла идёт параллельно с генерацией ответа
+            preprocess_task = asyncio.create_task(timer.run("preprocess", preprocess_upload(upload)))
+            storage_task = asyncio.create_task(timer.run("storage", store_upload(upload, preprocess_task)))
+            parts = []
+            with timer.stage("model"):
+                contents = await model_contents(prompt, upload, await preprocess_task)
+                response = await generate_content(prompt, contents, stream=True)
+                async for chunk in response:
+                    if chunk.text:
+                        if not parts:
+                            timer.stages["first_chunk"] = timer.total_ms()
+                        parts.append(chunk.text)
+                        yield sse_event("chunk", {"text": chunk.text})
+                await account_usage("analyze_stream", response)
+            description = "".join(parts)
+            file_path = await storage_task
+            await analysis_cache.set(cache_key, {"description": description, "file_path": file_path})
+
+        try:
+            await save_analysis_to_db(session_id, description, upload.filename, file_path, cache_key, upload.content_type)
+        except Exception as db_error:
+            logger.error(f"Ошибка при сохранении в базу данных: {db_error}")
+
+        yield sse_event("done", {"description": description})
+    except Exception as e:
+        logger.error(f"Произошла ошибка при потоковом анализе файла: {e}")
+        detail = e.detail if isinstance(e, HTTPException) else f"Произошла ошибка при анализе файла: {e}"
+        yield sse_event("error", {"detail": detail})
+    finally:
+        for task in (preprocess_task, storage_task):
+            if task is not None and not task.done():
+                task.cancel()
+        upload.close()
+        analyze_limiter.release()
+        logger.info(f"Этапы /analyze/stream для {upload.filename}: {timer.summary()}")
+        metrics.observe_stages("analyze_stream", upload.content_type, timer)
+
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    """Метрики в текстовом формате Prometheus."""
+    return PlainTextResponse(generate_latest(metrics.registry), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/analysis", response_model=AnalysisListResponse, response_model_exclude_none=True)
+async def get_analysis_list(
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    user_id: Optional[str] = None,
+    include_response: bool = False,
+):
+    """
+    Возвращает страницу записей анализа, от новых к старым.
+
+    По умолчанию вместо полного ai_response возвращается summary — начало
+    описания; полный текст отдаётся с include_response=true. Для следующей
+    страницы передайте next_cursor из ответа в параметре cursor.
+    """
+    try:
+        records = await get_analysis_records_page(limit, cursor, user_id, include_response)
+        next_cursor = encode_cursor(records[limit - 1]) if len(records) > limit else None
+        return AnalysisListResponse(
+            items=[AnalysisRecord(**record, **derivative_urls(record)) for record in records[:limit]],
+            next_cursor=next_cursor,
+        )
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Ошибка при получении списка записей анализа: {e}")
         raise HTTPException(status_code=500, detail="Ошибка при получении списка записей анализа")
 
-@app.get("/analysis/{record_id}", response_model=AnalysisDetailsResponse)
-def get_analysis_details(record_id: int):
-    """Возвращает детальную информацию о конкретной записи анализа по ID."""
+@app.get("/analysis/search", response_model=AnalysisSearchResponse, response_model_exclude_none=True)
+async def search_analysis(
+    q: str = Query(..., min_length=1, max_length=500),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0, le=10000),
+    user_id: Optional[str] = None,
+):
+    """
+    Ищет записи анализа по тексту описания и имени файла, от наиболее релевантных.
+
+    Слова приводятся к основе, кириллица и латиница сравниваются после
+    транслитерации ("Петербурге" находится по "peterburg"). Для следующей
+    страницы передайте next_offset из ответа в параметре offset.
+    """
+    if not SEARCH_INDEX_ENABLED:
+        raise HTTPException(status_code=404, detail="Поиск отключён")
+    hits, total = search_index.search(q, limit, offset, user_id)
     try:
-        record = get_analysis_record_by_id(record_id)
-        if record.data:
-            return AnalysisDetailsResponse(**record.data)
-        else:
-            raise HTTPException(status_code=404, detail="Запись не найдена")
+        records = await supabase_store.get_analysis_results([hit.record_id for hit in hits], ANALYSIS_LIST_COLUMNS)
+    except Exception as e:
+        logger.error(f"Ошибка при поиске записей анализа: {e}")
+        raise HTTPException(status_code=500, detail="Ошибка при поиске записей анализа")
+    by_id = {record['id']: record for record in records}
+    next_offset = offset + len(hits) if offset + len(hits) < total else None
+    return AnalysisSearchResponse(
+        items=[
+            SearchResultItem(**by_id[hit.record_id], **derivative_urls(by_id[hit.record_id]), score=hit.score)
+            for hit in hits
+            if hit.record_id in by_id
+        ],
+        total=total,
+        next_offset=next_offset,
+        complete=search_index.complete,
+    )
+
+@app.get("/analysis/changes")
+async def get_analysis_changes(
+    request: Request,
+    since: Optional[int] = Query(None, ge=0),
+    user_id: Optional[str] = None,
+    include_response: bool = False,
+):
+    """
+    Лента новых записей анализа в формате Server-Sent Events.
+
+    Каждая запись приходит событием `analysis` с полями как в GET /analysis
+    и id записи в поле id события. Поток начинается после записи `since`,
+    а без него — с текущего момента. При переподключении браузер сам
+    передаёт заголовок Last-Event-ID, и пропущенные записи отправляются
+    заново, в том числе из таблицы, если они уже вытеснены из памяти.
+    """
+    last_event_id = request.headers.get("last-event-id")
+    if last_event_id:
+        try:
+            since = int(last_event_id)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Некорректный Last-Event-ID")
+    if since is None:
+        since = await latest_analysis_id()
+    return StreamingResponse(
+        stream_analysis_changes(since, user_id, include_response),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+async def latest_analysis_id() -> int:
+    if change_feed.floor is not None:
+        return change_feed.last_id
+    try:
+        records = await supabase_store.select_analysis_page('id', 1)
     except Exception as e:
-        logger.error(f"Ошибка при получении детальной информации о записи анализа: {e}")
-        raise HTTPException(status_code=500, detail="Ошибка при получении детальной информации о записи анализа")
+        logger.error(f"Ошибка при получении последней записи анализа: {e}")
+        raise HTTPException(status_code=500, detail="Ошибка при получении последней записи анализа")
+    return records[0]['id'] if records else 0
+
+async def stream_analysis_changes(cursor: int, user_id: Optional[str] = None, include_response: bool = False):
+    """Генерирует события SSE с записями анализа новее `cursor`, пока клиент не отключится."""
+    columns = ANALYSIS_LIST_COLUMNS + (', ai_response' if include_response else '')
+    while True:
+        floor = change_feed.floor
+        rows = change_feed.since(cursor)
+        replaying = rows is None
+        if replaying:
+            try:
+                rows = await supabase_store.scan_analysis_results(columns, cursor, CHANGE_FEED_REPLAY_BATCH)
+            except Exception as e:
+                logger.error(f"Ошибка при чтении пропущенных записей анализа: {e}")
+                yield sse_event("error", {"detail": "Ошибка при чтении пропущенных записей анализа"})
+                return
+        for row in rows:
+            cursor = max(cursor, row['id'])
+            if user_id is not None and str(row.get('user_id')) != user_id:
+                continue
+            record = AnalysisRecord(
+                **{key: value for key, value in row.items() if include_response or key != 'ai_response'},
+                **derivative_urls(row),
+            )
+            yield sse_event("analysis", record.model_dump(mode="json", exclude_none=True), event_id=row['id'])
+        # Полная порция из таблицы — за ней могут быть ещё пропущенные записи
+        if replaying and len(rows) == CHANGE_FEED_REPLAY_BATCH:
+            continue
+        if replaying and floor is not None:
+            # Таблица дочитана: записи новее floor были в буфере ещё до чтения
+            cursor = max(cursor, floor)
+        if not await change_feed.wait(cursor, CHANGE_FEED_HEARTBEAT):
+            yield ": keep-alive\n\n"
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Проверяет If-None-Match: список ETag через запятую или "*"; W/ не учитывается."""
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or any(candidate.removeprefix("W/") == etag for candidate in candidates)
+
+@app.get("/analysis/{record_id}", response_model=AnalysisDetailsResponse)
+async def get_analysis_details(request: Request, record_id: int):
+    """
+    Возвращает детальную информацию о конкретной записи анализа по ID.
+
+    Запись не меняется после создания, поэтому ответ отдаётся из кэша в
+    памяти процесса, с сильным ETag и долгим Cache-Control; на запрос с
+    совпадающим If-None-Match возвращается 304 без тела.
+    """
+    cached = record_cache.get(record_id)
+    metrics.record_cache_lookups.labels("miss" if cached is None else "hit").inc()
+    if cached is None:
+        try:
+            record = await supabase_store.get_analysis_result(record_id)
+        except Exception as e:
+            logger.error(f"Ошибка при получении детальной информации о записи анализа: {e}")
+            raise HTTPException(status_code=500, detail="Ошибка при получении детальной информации о записи анализа")
+        if record is None:
+            raise HTTPException(status_code=404, detail="Запись не найдена")
+        cached = cache_analysis_record(record)
+
+    body, etag = cached
+    headers = {"ETag": etag, "Cache-Control": RECORD_CACHE_CONTROL}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+# Настройка CORS. Middleware подключается последним и потому внешним: заголовки
+# CORS получают и ранние ответы других middleware (413 по размеру, 429 по лимитам)
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["http://localhost:3000", "https://ingria.canfly.org"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+    expose_headers=["Retry-After"],
+)
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,142 @@
+# Метрики Prometheus для пути анализа: этапы, размеры файлов, токены Gemini
+
+import logging
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram
+
+from timing import StageTimer
+
+logger = logging.getLogger(__name__)
+
+registry = CollectorRegistry()
+
+# Этапы от единиц миллисекунд (кэш) до минут (длинное аудио)
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80, 160)
+SIZE_BUCKETS = tuple(1024 * 4 ** power for power in range(10))  # 1 КБ … 256 МБ
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768, 65536, 131072)
+
+stage_duration = Histogram(
+    "ingria_stage_duration_seconds",
+    "Длительность этапа обработки запроса",
+    ["endpoint", "stage", "mime_type"],
+    buckets=STAGE_BUCKETS,
+    registry=registry,
+)
+request_duration = Histogram(
+    "ingria_request_duration_seconds",
+    "Полное время обработки файла",
+    ["endpoint", "mime_type"],
+    buckets=STAGE_BUCKETS,
+    registry=registry,
+)
+upload_size = Histogram(
+    "ingria_upload_size_bytes",
+    "Размер принятого файла",
+    ["mime_type"],
+    buckets=SIZE_BUCKETS,
+    registry=registry,
+)
+model_payload_size = Histogram(
+    "ingria_model_payload_size_bytes",
+    "Размер файла, отправленного в Gemini (после подготовки изображения)",
+    ["mime_type"],
+    buckets=SIZE_BUCKETS,
+    registry=registry,
+)
+gemini_tokens = Counter(
+    "ingria_gemini_tokens",
+    "Токены Gemini по данным usage_metadata",
+    ["call", "kind"],
+    registry=registry,
+)
+gemini_prompt_tokens = Histogram(
+    "ingria_gemini_prompt_tokens",
+    "Токены запроса к Gemini на один вызов",
+    ["call"],
+    buckets=TOKEN_BUCKETS,
+    registry=registry,
+)
+analysis_cache_lookups = Counter(
+    "ingria_analysis_cache_lookups",
+    "Обращения к кэшу результатов анализа",
+    ["result"],
+    registry=registry,
+)
+record_cache_lookups = Counter(
+    "ingria_record_cache_lookups",
+    "Обращения к кэшу записей GET /analysis/{record_id}",
+    ["result"],
+    registry=registry,
+)
+rate_limit_rejections = Counter(
+    "ingria_rate_limit_rejections",
+    "Запросы, отклонённые с 429",
+    ["scope"],
+    registry=registry,
+)
+gemini_attempts = Counter(
+    "ingria_gemini_attempts",
+    "Попытки вызова Gemini: primary — основной запрос, hedge — дублирующий",
+    ["model", "kind", "outcome"],
+    registry=registry,
+)
+gemini_circuit_state = Gauge(
+    "ingria_gemini_circuit_state",
+    "Состояние выключателя модели: 0 — замкнут, 1 — пробный вызов, 2 — разомкнут",
+    ["model"],
+    registry=registry,
+)
+db_flush_duration = Histogram(
+    "ingria_db_flush_duration_seconds",
+    "Запись пакета результатов анализа, включая UPSERT пользователей",
+    buckets=STAGE_BUCKETS,
+    registry=registry,
+)
+db_flush_rows = Histogram(
+    "ingria_db_flush_rows",
+    "Число строк в пакете отложенной записи",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200),
+    registry=registry,
+)
+analyze_in_flight = Gauge("ingria_analyze_in_flight", "Выполняющиеся анализы", registry=registry)
+analyze_waiting = Gauge("ingria_analyze_waiting", "Анализы в очереди ожидания", registry=registry)
+write_behind_pending = Gauge("ingria_write_behind_pending", "Строки, ожидающие отложенной записи", registry=registry)
+search_index_documents = Gauge("ingria_search_index_documents", "Записи анализа в поисковом индексе", registry=registry)
+
+
+def observe_stages(endpoint: str, mime_type: str, timer: StageTimer) -> None:
+    """Записывает этапы и общее время запроса из StageTimer в гистограммы."""
+    for stage, ms in timer.stages.items():
+        stage_duration.labels(endpoint, stage, mime_type).observe(ms / 1000)
+    request_duration.labels(endpoint, mime_type).observe(timer.total_ms() / 1000)
+
+
+CIRCUIT_STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+
+def observe_circuit_state(model: str, state: str) -> None:
+    gemini_circuit_state.labels(model).set(CIRCUIT_STATES[state])
+
+
+def observe_usage(call: str, response) -> int:
+    """
+    Учитывает токены из usage_metadata ответа Gemini и возвращает их общее
+    число; ответы без метаданных пропускаются (0).
+    """
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return 0
+    try:
+        counts = {
+            "prompt": usage.prompt_token_count,
+            "candidates": usage.candidates_token_count,
+            "cached": getattr(usage, "cached_content_token_count", 0),
+        }
+    except AttributeError as e:
+        logger.warning(f"Неожиданный формат usage_metadata: {e}")
+        return 0
+    for kind, count in counts.items():
+        if count:
+            gemini_tokens.labels(call, kind).inc(count)
+    gemini_prompt_tokens.labels(call).observe(counts["prompt"] or 0)
+    return (counts["prompt"] or 0) + (counts["candidates"] or 0)
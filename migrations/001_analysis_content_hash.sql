@@ -0,0 +1,3 @@
+-- Ключ кэша анализа (хэш файла + промпт + модель) для повторных загрузок
+alter table analysis_results add column if not exists content_hash text;
+create index if not exists analysis_results_content_hash_idx on analysis_results (content_hash);
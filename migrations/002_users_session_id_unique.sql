@@ -0,0 +1,31 @@
+-- Один пользователь на сессию: нужен для upsert(on_conflict='session_id')
+begin;
+
+-- Новые пользователи не создаются, пока дубликаты объединяются
+lock table users in share row exclusive mode;
+
+-- Прежний select-then-insert при одновременных первых запросах одной сессии
+-- создавал несколько пользователей. Записи анализа переводятся на самого
+-- раннего из них, остальные удаляются.
+create temporary table users_session_duplicates on commit drop as
+select id, keep_id
+from (
+    select id, first_value(id) over (partition by session_id order by created_at nulls last, id) as keep_id
+    from users
+    where session_id is not null
+) ranked
+where id <> keep_id;
+
+update analysis_results
+set user_id = duplicates.keep_id
+from users_session_duplicates duplicates
+where analysis_results.user_id = duplicates.id;
+
+delete from users
+using users_session_duplicates duplicates
+where users.id = duplicates.id;
+
+alter table users add constraint users_session_id_key unique (session_id);
+alter table users alter column created_at set default now();
+
+commit;
@@ -0,0 +1,7 @@
+-- Краткое описание для списка записей: первые 200 символов ai_response
+alter table analysis_results
+    add column if not exists summary text generated always as (left(ai_response, 200)) stored;
+
+-- Индексы для пагинации по ключу (timestamp, id), в том числе с фильтром по пользователю
+create index if not exists analysis_results_timestamp_id_idx on analysis_results (timestamp desc, id desc);
+create index if not exists analysis_results_user_timestamp_id_idx on analysis_results (user_id, timestamp desc, id desc);
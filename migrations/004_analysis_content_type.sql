@@ -0,0 +1,2 @@
+-- MIME-тип загруженного файла: по нему выбираются производные (миниатюры или превью аудио)
+alter table analysis_results add column if not exists content_type text;
@@ -0,0 +1,92 @@
+# Реестр версионированных промптов Ингрии
+
+import hashlib
+import logging
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+VERSION_FILE = re.compile(r"v(?P<number>\d+)\.txt")
+
+
+class UnknownPromptError(LookupError):
+    """Запрошенного промпта или его версии нет в реестре."""
+
+
+@dataclass(frozen=True)
+class Prompt:
+    """Промпт `name` версии `version`; текст берётся из файла как есть."""
+
+    name: str
+    version: str
+    text: str = field(repr=False)
+
+    @property
+    def key(self) -> str:
+        """Идентификатор для ключей кэша: имя, версия и хэш текста (на случай правки файла без новой версии)."""
+        digest = hashlib.sha256(self.text.encode("utf-8")).hexdigest()[:12]
+        return f"{self.name}@{self.version}:{digest}"
+
+
+class PromptRegistry:
+    """
+    Промпты из каталога `directory/<имя>/v<N>.txt`, загруженные один раз.
+
+    По умолчанию для каждого имени используется последняя версия;
+    `defaults` ({"image": "v1"}) закрепляет другую.
+    """
+
+    def __init__(self, directory: str, defaults: Optional[Dict[str, str]] = None):
+        self.directory = directory
+        self._prompts: Dict[str, Dict[str, Prompt]] = {}
+        self._defaults: Dict[str, str] = {}
+        self._load()
+        for name, version in (defaults or {}).items():
+            self.get(name, version)
+            self._defaults[name] = version
+
+    def _load(self) -> None:
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name)
+            if not os.path.isdir(path):
+                continue
+            versions = {}
+            for file_name in os.listdir(path):
+                match = VERSION_FILE.fullmatch(file_name)
+                if match is None:
+                    continue
+                with open(os.path.join(path, file_name), encoding="utf-8") as f:
+                    version = f"v{int(match['number'])}"
+                    versions[version] = Prompt(name, version, f.read())
+            if versions:
+                self._prompts[name] = versions
+                self._defaults[name] = max(versions, key=lambda version: int(version[1:]))
+        logger.info(
+            "Загружены промпты: " + ", ".join(f"{name} ({', '.join(sorted(v))})" for name, v in self._prompts.items())
+        )
+
+    def versions(self, name: str) -> list:
+        return sorted(self._prompts.get(name, {}), key=lambda version: int(version[1:]))
+
+    def get(self, name: str, version: Optional[str] = None) -> Prompt:
+        """Промпт `name` версии `version` (по умолчанию — версии по умолчанию)."""
+        versions = self._prompts.get(name)
+        if not versions:
+            raise UnknownPromptError(f"Нет промпта {name}")
+        version = version or self._defaults[name]
+        if version not in versions:
+            raise UnknownPromptError(f"Нет версии {version} промпта {name}; доступны: {', '.join(self.versions(name))}")
+        return versions[version]
+
+
+def parse_versions(value: str) -> Dict[str, str]:
+    """Разбирает PROMPT_VERSIONS вида "image=v2,audio=v1"."""
+    defaults = {}
+    for item in value.split(","):
+        if item.strip():
+            name, _, version = item.partition("=")
+            defaults[name.strip()] = version.strip()
+    return defaults
@@ -0,0 +1,180 @@
+# Ограничение частоты запросов: token bucket на сессию, IP и общий бюджет Gemini
+
+import time
+from collections import OrderedDict
+from typing import Callable, NamedTuple, Optional
+
+
+class RateLimit(NamedTuple):
+    """Ведро токенов: пополняется на `rate` токенов в секунду, вмещает не больше `burst`."""
+
+    rate: float
+    burst: float
+
+    @classmethod
+    def per_minute(cls, count: float, burst: Optional[float] = None) -> "RateLimit":
+        return cls(count / 60, burst if burst is not None else count)
+
+
+class RateLimitExceeded(Exception):
+    """Лимит исчерпан; повторить можно через `retry_after` секунд."""
+
+    def __init__(self, scope: str, retry_after: float):
+        super().__init__(f"Превышен лимит запросов ({scope}), повторите через {retry_after:.1f} с")
+        self.scope = scope
+        self.retry_after = retry_after
+
+
+class InMemoryRateLimitBackend:
+    """
+    Вёдра в памяти процесса.
+
+    Подходит для одного процесса: у каждого воркера uvicorn свои вёдра.
+    Хранится не больше `max_keys` вёдер; давно не использованное ведро
+    вытесняется, что равносильно его полному пополнению.
+    """
+
+    def __init__(self, max_keys: int = 100_000, clock: Callable[[], float] = time.monotonic):
+        self.max_keys = max_keys
+        self._clock = clock
+        self._buckets: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def _refill(self, key: str, limit: RateLimit) -> float:
+        now = self._clock()
+        tokens, updated = self._buckets.get(key, (limit.burst, now))
+        return min(limit.burst, tokens + (now - updated) * limit.rate)
+
+    def _store(self, key: str, tokens: float) -> None:
+        self._buckets[key] = (tokens, self._clock())
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+
+    async def take(self, key: str, limit: RateLimit, cost: float) -> float:
+        """Списывает `cost` токенов; если их не хватает, ничего не списывает и возвращает время ожидания."""
+        tokens = self._refill(key, limit)
+        if tokens >= cost:
+            self._store(key, tokens - cost)
+            return 0.0
+        self._store(key, tokens)
+        return (cost - tokens) / limit.rate
+
+    async def give(self, key: str, limit: RateLimit, amount: float) -> None:
+        """Возвращает `amount` токенов (не больше `burst`); отрицательное значение списывает их безусловно."""
+        self._store(key, min(limit.burst, self._refill(key, limit) + amount))
+
+
+# Состояние ведра хранится в хэше Redis, время берётся у самого Redis, чтобы
+# воркеры с разными часами видели одно и то же ведро
+REDIS_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local amount = tonumber(ARGV[3])
+local mode = ARGV[4]
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if mode == 'take' then
+    if tokens >= amount then
+        tokens = tokens - amount
+    else
+        wait = (amount - tokens) / rate
+    end
+else
+    tokens = math.min(burst, tokens + amount)
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+
+class RedisRateLimitBackend:
+    """
+    Общие вёдра в Redis для нескольких воркеров и экземпляров.
+
+    Требует пакет `redis` (не входит в requirements.txt); операция над
+    ведром выполняется одним Lua-скриптом и поэтому атомарна.
+    """
+
+    def __init__(self, url: str, prefix: str = "ingria:ratelimit:"):
+        import redis.asyncio as redis
+
+        self.prefix = prefix
+        self._client = redis.from_url(url)
+        self._script = self._client.register_script(REDIS_BUCKET_SCRIPT)
+
+    async def _call(self, key: str, limit: RateLimit, amount: float, mode: str) -> float:
+        wait = await self._script(keys=[self.prefix + key], args=[limit.rate, limit.burst, amount, mode])
+        return float(wait)
+
+    async def take(self, key: str, limit: RateLimit, cost: float) -> float:
+        return await self._call(key, limit, cost, "take")
+
+    async def give(self, key: str, limit: RateLimit, amount: float) -> None:
+        await self._call(key, limit, amount, "give")
+
+
+class RateLimiter:
+    """
+    Допуск запросов к анализу.
+
+    Запрос проходит, если есть токены в ведре его сессии, его IP и в общем
+    бюджете запросов к Gemini (RPM). Общий бюджет токенов Gemini (TPM)
+    резервируется оценкой на время запроса, а фактический расход
+    списывается по usage_metadata ответов. Любой лимит можно отключить,
+    передав None.
+    """
+
+    def __init__(
+        self,
+        backend,
+        session: Optional[RateLimit] = None,
+        ip: Optional[RateLimit] = None,
+        requests: Optional[RateLimit] = None,
+        tokens: Optional[RateLimit] = None,
+    ):
+        self.backend = backend
+        self.session = session
+        self.ip = ip
+        self.requests = requests
+        self.tokens = tokens
+
+    async def admit(self, session_id: Optional[str], ip: Optional[str], count: float = 1, reserve_tokens: float = 0) -> None:
+        """
+        Списывает `count` запросов и резервирует `reserve_tokens` токенов Gemini.
+
+        Вёдра проверяются от узкого к общему; если какое-то из них пусто,
+        уже списанное возвращается и выбрасывается RateLimitExceeded.
+        """
+        buckets = [
+            ("session", f"session:{session_id}", self.session, count) if session_id else None,
+            ("ip", f"ip:{ip}", self.ip, count) if ip else None,
+            ("gemini_requests", "global:requests", self.requests, count),
+            ("gemini_tokens", "global:tokens", self.tokens, reserve_tokens),
+        ]
+        taken = []
+        for bucket in buckets:
+            if bucket is None or bucket[2] is None or not bucket[3]:
+                continue
+            scope, key, limit, cost = bucket
+            wait = await self.backend.take(key, limit, cost)
+            if wait > 0:
+                for _, taken_key, taken_limit, taken_cost in taken:
+                    await self.backend.give(taken_key, taken_limit, taken_cost)
+                raise RateLimitExceeded(scope, wait)
+            taken.append(bucket)
+
+    async def release_tokens(self, amount: float) -> None:
+        """Возвращает зарезервированные токены Gemini после завершения запроса."""
+        if self.tokens is not None and amount:
+            await self.backend.give("global:tokens", self.tokens, amount)
+
+    async def consume_tokens(self, amount: float) -> None:
+        """Списывает фактически израсходованные токены Gemini."""
+        if self.tokens is not None and amount:
+            await self.backend.give("global:tokens", self.tokens, -amount)
@@ -0,0 +1,276 @@
+# Устойчивые вызовы Gemini: тайм-ауты, повторы, хеджирование, автоматический выключатель
+
+import asyncio
+import logging
+import math
+import random
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+
+
+class ModelUnavailableError(Exception):
+    """Ни одна модель не принимает запросы: выключатели всех моделей разомкнуты."""
+
+
+def error_status(error: Exception) -> Optional[int]:
+    """HTTP-код ошибки google.api_core (атрибут `code`), если он есть."""
+    code = getattr(error, "code", None)
+    try:
+        return int(code)
+    except (TypeError, ValueError):
+        return None
+
+
+def is_quota_error(error: Exception) -> bool:
+    """ResourceExhausted (429): квота модели исчерпана."""
+    return type(error).__name__ == "ResourceExhausted" or error_status(error) == 429
+
+
+def is_client_error(error: Exception) -> bool:
+    """Ошибка в самом запросе (4xx, кроме 408 и 429): повтор не поможет."""
+    status = error_status(error)
+    return status is not None and 400 <= status < 500 and status not in (408, 429)
+
+
+class CircuitBreaker:
+    """
+    Автоматический выключатель одной модели.
+
+    После `failure_threshold` ошибок подряд размыкается на `reset_timeout`
+    секунд, затем пропускает один пробный вызов: удачный замыкает его,
+    неудачный снова размыкает.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        clock: Callable[[], float] = time.monotonic,
+        on_change: Optional[Callable[[str, str], None]] = None,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self._clock = clock
+        self._on_change = on_change
+
+    def _set_state(self, state: str) -> None:
+        if state == self.state:
+            return
+        logger.warning(f"Выключатель модели {self.name}: {self.state} -> {state}")
+        self.state = state
+        if self._on_change is not None:
+            self._on_change(self.name, state)
+
+    def allow(self) -> bool:
+        """Можно ли вызвать модель сейчас; в полуоткрытом состоянии пропускает один пробный вызов."""
+        if self.state == OPEN and self._clock() - self.opened_at >= self.reset_timeout:
+            self._set_state(HALF_OPEN)
+            self.probing = False
+        if self.state == CLOSED:
+            return True
+        if self.state == HALF_OPEN and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.probing = False
+        self._set_state(CLOSED)
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self.probing = False
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            self.opened_at = self._clock()
+            self._set_state(OPEN)
+
+    def record_cancel(self) -> None:
+        """Вызов отменён без результата: пробный вызов можно повторить."""
+        self.probing = False
+
+
+class LatencyWindow:
+    """Длительности последних `size` удачных вызовов для оценки p95."""
+
+    def __init__(self, size: int = 200):
+        self.samples = deque(maxlen=size)
+
+    def add(self, seconds: float) -> None:
+        self.samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[max(1, math.ceil(q / 100 * len(ordered))) - 1]
+
+
+class ModelCaller:
+    """
+    Вызывает generate_content_async основной модели, а при её недоступности —
+    резервных, по порядку `models`.
+
+    Каждая попытка ограничена `timeout` секундами, все попытки вместе —
+    `deadline`. Временные ошибки и тайм-ауты повторяются до `retries` раз с
+    экспоненциальной задержкой со случайным разбросом (full jitter); ошибки
+    запроса (4xx) не повторяются, после исчерпания квоты (429) сразу
+    пробуется следующая модель. Если `hedge` включён и набралось
+    `hedge_min_samples` замеров, то при отсутствии ответа дольше p95
+    (но не раньше `hedge_min_delay`) отправляется второй такой же запрос и
+    берётся первый ответ. Потоковые вызовы не хеджируются, а тайм-аут
+    ограничивает только получение потока.
+
+    Корутина `resolve(name, prompt)` возвращает объект модели по имени; если
+    передан `prompt`, модель должна быть настроена на него (системная
+    инструкция или кэш контекста).
+    """
+
+    def __init__(
+        self,
+        resolve: Callable[[str, object], Awaitable[object]],
+        models: List[str],
+        timeout: float = 90.0,
+        deadline: float = 180.0,
+        retries: int = 2,
+        backoff: float = 0.5,
+        backoff_max: float = 8.0,
+        hedge: bool = False,
+        hedge_min_delay: float = 2.0,
+        hedge_min_samples: int = 20,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        on_state_change: Optional[Callable[[str, str], None]] = None,
+        on_attempt: Optional[Callable[[str, str, str], None]] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        if not models:
+            raise ValueError("Нужна хотя бы одна модель")
+        self.resolve = resolve
+        self.models = list(dict.fromkeys(models))
+        self.timeout = timeout
+        self.deadline = deadline
+        self.retries = max(retries, 0)
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_min_samples = hedge_min_samples
+        self.on_attempt = on_attempt
+        self._clock = clock
+        self.breakers: Dict[str, CircuitBreaker] = {
+            name: CircuitBreaker(name, failure_threshold, reset_timeout, clock, on_state_change) for name in self.models
+        }
+        self.latency: Dict[str, LatencyWindow] = {name: LatencyWindow() for name in self.models}
+
+    def _choose(self, skip: set) -> Optional[str]:
+        for name in self.models:
+            if name not in skip and self.breakers[name].allow():
+                return name
+        return None
+
+    def hedge_delay(self, name: str) -> Optional[float]:
+        """Через сколько секунд без ответа отправлять второй запрос; None — не хеджировать."""
+        window = self.latency[name]
+        if not self.hedge or len(window.samples) < self.hedge_min_samples or self.breakers[name].state != CLOSED:
+            return None
+        return max(self.hedge_min_delay, window.percentile(95))
+
+    async def generate(self, contents, stream: bool = False, prompt=None):
+        """Возвращает ответ модели; после исчерпания попыток выбрасывает последнюю ошибку."""
+        started = self._clock()
+        exhausted = set()
+        last_error = None
+        for attempt in range(self.retries + 1):
+            remaining = self.deadline - (self._clock() - started)
+            if remaining <= 0:
+                break
+            name = self._choose(exhausted)
+            if name is None:
+                break
+            if attempt:
+                logger.info(f"Повтор вызова Gemini ({attempt}/{self.retries}) на модели {name}")
+            try:
+                return await self._attempt(name, contents, stream, prompt, min(self.timeout, remaining))
+            except Exception as e:
+                if is_client_error(e):
+                    raise
+                last_error = e
+                if is_quota_error(e):
+                    exhausted.add(name)
+                    continue
+            delay = random.uniform(0, min(self.backoff_max, self.backoff * 2 ** attempt))
+            if self._clock() - started + delay >= self.deadline:
+                break
+            await asyncio.sleep(delay)
+        if last_error is None:
+            raise ModelUnavailableError("Все модели временно недоступны")
+        raise last_error
+
+    async def _attempt(self, name: str, contents, stream: bool, prompt, timeout: float):
+        delay = None if stream else self.hedge_delay(name)
+        if delay is None or delay >= timeout:
+            return await self._call(name, contents, stream, prompt, timeout, "primary")
+
+        tasks = [asyncio.create_task(self._call(name, contents, stream, prompt, timeout, "primary"))]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                tasks.append(asyncio.create_task(self._call(name, contents, stream, prompt, timeout - delay, "hedge")))
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+            # Оба запроса завершились ошибкой: наружу уходит ошибка основного
+            return tasks[0].result()
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def _call(self, name: str, contents, stream: bool, prompt, timeout: float, kind: str):
+        breaker = self.breakers[name]
+        started = self._clock()
+        outcome = "cancelled"
+        try:
+            model = await self.resolve(name, prompt)
+            call = model.generate_content_async(contents, stream=True) if stream else model.generate_content_async(contents)
+            response = await asyncio.wait_for(call, timeout)
+            outcome = "ok"
+            breaker.record_success()
+            self.latency[name].add(self._clock() - started)
+            return response
+        except asyncio.TimeoutError:
+            outcome = "timeout"
+            logger.warning(f"Gemini {name} не ответил за {timeout:.1f} с")
+            breaker.record_failure()
+            raise
+        except Exception as e:
+            if is_client_error(e):
+                # Модель ответила: сервис доступен, ошибка в запросе
+                outcome = "client_error"
+                breaker.record_success()
+            else:
+                outcome = "error"
+                breaker.record_failure()
+            raise
+        finally:
+            if outcome == "cancelled":
+                breaker.record_cancel()
+            if self.on_attempt is not None:
+                self.on_attempt(name, kind, outcome)
@@ -0,0 +1,181 @@
+# Полнотекстовый поиск по истории анализов: инвертированный индекс в памяти и BM25
+
+import math
+import re
+import threading
+from array import array
+from functools import lru_cache
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+TOKEN = re.compile(r"[^\W_]+")
+# Более длинные токены — хэши содержимого в именах файлов, по ним не ищут
+MAX_TOKEN_LENGTH = 32
+
+STOP_WORDS = frozenset(
+    "и в во не что он на я с со как а то все она так его но да ты к у же вы за бы по только ее мне было вот от "
+    "меня еще нет о из ему теперь когда даже ну ли если уже или ни быть был него до вас нибудь опять уж вам ведь "
+    "там потом себя ничего ей может они тут где есть надо ней для мы тебя их чем была сам чтоб без будто чего раз "
+    "тоже себе под будет ж тогда кто этот того потому этого какой совсем ним здесь этом один почти мой тем чтобы "
+    "нее были куда зачем всех никогда можно при наконец два об другой хоть после над больше тот через эти нас про "
+    "всего них какая много разве три эту моя впрочем хорошо свою этой перед иногда лучше чуть том нельзя такой им "
+    "более всегда конечно всю между это".split()
+)
+
+# Окончания для лёгкого стемминга: "Петербурге", "Петербургом" и "Петербург"
+# дают одну основу. Проверяются от длинных к коротким, снимается одно.
+ENDINGS = sorted(
+    "ами ями ого его ому ему ыми ими ой ей ий ый ая яя ое ее ые ие ую юю ом ем ах ях ов ев ам ям ть ся сь "
+    "а я о е ы и у ю ь й".split(),
+    key=len,
+    reverse=True,
+)
+
+
+def stem(word: str) -> str:
+    if len(word) < 5:
+        return word
+    for ending in ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            return word[: -len(ending)]
+    return word
+
+
+@lru_cache(maxsize=200_000)
+def normalize_token(token: str) -> Optional[str]:
+    """
+    Термин индекса для слова или None для стоп-слов и слишком коротких слов.
+
+    Слово латиницей переводится в кириллицу, кириллическое слово
+    приводится к основе и записывается латиницей. Так "Петербурге" и
+    "peterburg" дают один термин.
+    """
+    from transliterate import translit
+
+    word = token.lower().replace("ё", "е")
+    if len(word) < 2 or len(word) > MAX_TOKEN_LENGTH or word in STOP_WORDS:
+        return None
+    if word.isdigit():
+        return word
+    if word.isascii():
+        word = translit(word, "ru")
+    term = translit(stem(word), "ru", reversed=True).lower()
+    return re.sub(r"[^0-9a-z]", "", term) or None
+
+
+def tokenize(text: str) -> List[str]:
+    """Термины текста в порядке появления (с повторами)."""
+    terms = []
+    for token in TOKEN.findall(text or ""):
+        term = normalize_token(token)
+        if term is not None:
+            terms.append(term)
+    return terms
+
+
+class SearchHit(NamedTuple):
+    record_id: int
+    score: float
+
+
+class SearchIndex:
+    """
+    Инвертированный индекс записей analysis_results по ai_response и file_name.
+
+    Для каждого термина хранятся номера документов и частоты в компактных
+    массивах, которые при поиске читаются как numpy-массивы без копирования;
+    ранжирование — BM25. Записи только добавляются: results не меняются после
+    вставки. Повторное добавление того же id игнорируется.
+
+    Добавление и поиск потокобезопасны: индекс может строиться из пула
+    потоков, пока запросы идут в цикле событий. `complete` — индекс уже
+    содержит все записи таблицы, а не только добавленные после запуска.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Tuple[array, array]] = {}
+        self._record_ids = array("q")
+        self._lengths = array("I")
+        self._users = array("i")
+        self._user_codes: Dict[str, int] = {}
+        self._seen = set()
+        self._total_length = 0
+        self._lock = threading.Lock()
+        self.complete = False
+
+    def __len__(self) -> int:
+        return len(self._record_ids)
+
+    def add(self, record: dict) -> bool:
+        """Добавляет запись (id, user_id, ai_response, file_name); False, если она уже в индексе."""
+        record_id = int(record["id"])
+        terms = tokenize(record.get("ai_response")) + tokenize(record.get("file_name"))
+        counts: Dict[str, int] = {}
+        for term in terms:
+            counts[term] = counts.get(term, 0) + 1
+        with self._lock:
+            if record_id in self._seen:
+                return False
+            self._seen.add(record_id)
+            doc = len(self._record_ids)
+            self._record_ids.append(record_id)
+            self._lengths.append(len(terms))
+            self._users.append(self._user_codes.setdefault(str(record.get("user_id")), len(self._user_codes)))
+            self._total_length += len(terms)
+            for term, count in counts.items():
+                postings = self._postings.get(term)
+                if postings is None:
+                    postings = self._postings[term] = (array("i"), array("H"))
+                postings[0].append(doc)
+                postings[1].append(min(count, 65535))
+        return True
+
+    def add_many(self, records: Iterable[dict]) -> int:
+        return sum(self.add(record) for record in records)
+
+    def search(self, query: str, limit: int = 20, offset: int = 0, user_id: Optional[str] = None) -> Tuple[List[SearchHit], int]:
+        """Возвращает (страница результатов по убыванию релевантности, общее число найденных записей)."""
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return [], 0
+        with self._lock:
+            # Представления numpy над массивами не должны пережить блокировку:
+            # пока они живы, array не может расти
+            return self._search(terms, limit, offset, user_id)
+
+    def _search(self, terms: List[str], limit: int, offset: int, user_id: Optional[str]) -> Tuple[List[SearchHit], int]:
+        import numpy as np
+
+        docs = len(self._record_ids)
+        if not docs:
+            return [], 0
+        lengths = np.frombuffer(self._lengths, dtype=np.uint32)
+        average_length = self._total_length / docs or 1.0
+        scores = np.zeros(docs, dtype=np.float32)
+        for term in terms:
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            ids = np.frombuffer(postings[0], dtype=np.int32)
+            tf = np.frombuffer(postings[1], dtype=np.uint16).astype(np.float32)
+            idf = math.log(1 + (docs - len(ids) + 0.5) / (len(ids) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * lengths[ids] / average_length)
+            scores[ids] += idf * tf * (self.k1 + 1) / (tf + norm)
+        if user_id is not None:
+            code = self._user_codes.get(str(user_id))
+            if code is None:
+                return [], 0
+            scores[np.frombuffer(self._users, dtype=np.int32) != code] = 0
+
+        matched = np.flatnonzero(scores > 0)
+        total = len(matched)
+        end = min(offset + limit, total)
+        if offset >= end:
+            return [], total
+        if end < total:
+            matched = matched[np.argpartition(-scores[matched], end - 1)[:end]]
+        record_ids = np.frombuffer(self._record_ids, dtype=np.int64)[matched]
+        # При равной релевантности выше более новые записи
+        order = np.lexsort((-record_ids, -scores[matched]))[offset:end]
+        return [SearchHit(int(record_ids[i]), float(scores[matched[i]])) for i in order], total
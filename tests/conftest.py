@@ -2,6 +2,25 @@ import pytest
 import os
 from dotenv import load_dotenv
 
+from tests.fakes import FakeModel, FakeSupabase
+
+# main.py читает переменные окружения при импорте, поэтому задаём их до сбора тестов
+os.environ.setdefault("GOOGLE_API_KEY", "test_key")
+os.environ.setdefault("SUPABASE_URL", "http://127.0.0.1:54321")
+os.environ.setdefault("SUPABASE_KEY", "test_key")
+# Без фонового создания настоящих клиентов при запуске приложения в тестах
+os.environ.setdefault("STARTUP_WARMUP", "0")
+# Лимиты частоты запросов проверяются в отдельных тестах со своим RateLimiter
+os.environ.setdefault("RATE_LIMIT_ENABLED", "0")
+# Повторы вызовов Gemini без пауз, чтобы тесты с ошибками модели не ждали
+os.environ.setdefault("GEMINI_RETRY_BACKOFF", "0")
+# Промпт передаётся текстом в contents, чтобы FakeModel видел его в calls
+os.environ.setdefault("PROMPT_SYSTEM_INSTRUCTION", "0")
+# Поисковый индекс не строится по таблице при запуске приложения в тестах
+os.environ.setdefault("SEARCH_INDEX_REBUILD", "0")
+# Миниатюры строятся в пуле потоков, без отдельных процессов
+os.environ.setdefault("DERIVATIVE_WORKERS", "0")
+
 @pytest.fixture(autouse=True)
 def setup_test_env():
     """Настраивает тестовое окружение"""
@@ -9,4 +28,50 @@ def setup_test_env():
     # Устанавливаем тестовые переменные окружения
     os.environ["POSTGRES_DB"] = "test_ingraDB"
     os.environ["GOOGLE_API_KEY"] = "test_key"
-    yield
\ No newline at end of file
+    yield
+
+
+@pytest.fixture
+def fake_model(monkeypatch):
+    import main
+
+    model = FakeModel()
+    monkeypatch.setattr(main, "model", model)
+    return model
+
+
+@pytest.fixture
+def fake_supabase(monkeypatch):
+    import main
+
+    supabase = FakeSupabase()
+    supabase.storage.from_.return_value.get_public_url.return_value = "https://storage/files/test.jpg"
+    supabase.storage.from_.return_value.exists.return_value = False
+
+    def upsert(rows, on_conflict=None):
+        query = FakeSupabase()
+        query.execute.return_value.data = [
+            {"id": f"user-{row['session_id']}", "session_id": row["session_id"]} for row in rows
+        ]
+        return query
+
+    supabase.table.return_value.upsert.side_effect = upsert
+    monkeypatch.setattr(main, "supabase", supabase)
+    return supabase
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache(monkeypatch):
+    """Каждый тест начинает с пустых кэшей приложения"""
+    import main
+    from cache import ByteLRUCache, MemoryAnalysisCache, SessionUserCache, TieredCache, TTLCache
+    from changefeed import ChangeFeed
+    from search import SearchIndex
+
+    monkeypatch.setattr(main, "analysis_cache", TieredCache(MemoryAnalysisCache()))
+    monkeypatch.setattr(main, "stored_objects", TTLCache())
+    monkeypatch.setattr(main, "session_users", SessionUserCache(main.resolve_user_ids))
+    monkeypatch.setattr(main, "record_cache", ByteLRUCache())
+    monkeypatch.setattr(main, "search_index", SearchIndex())
+    monkeypatch.setattr(main, "change_feed", ChangeFeed())
+    monkeypatch.setattr(main, "model_caller", main.create_model_caller())
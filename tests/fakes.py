@@ -0,0 +1,49 @@
+# Заглушки внешних сервисов для тестов
+
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock
+
+# Методы supabase AsyncClient, которые нужно await-ить; остальные (table, select,
+# eq, storage.from_ …) синхронно строят запрос
+SUPABASE_ASYNC_METHODS = {"execute", "exists", "upload", "get_public_url", "list_buckets", "get_bucket", "create_bucket"}
+
+
+class FakeSupabase(MagicMock):
+    """MagicMock с формой supabase AsyncClient: цепочки запросов синхронные, execute() и Storage — корутины."""
+
+    def _get_child_mock(self, **kwargs):
+        if kwargs.get("name") in SUPABASE_ASYNC_METHODS:
+            return AsyncMock(**kwargs)
+        return FakeSupabase(**kwargs)
+
+
+class FakeStream:
+    """Асинхронный поток фрагментов ответа, как у generate_content_async(stream=True)."""
+
+    def __init__(self, chunks, delay):
+        self.chunks = chunks
+        self.delay = delay
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            await asyncio.sleep(self.delay)
+            yield SimpleNamespace(text=chunk)
+
+
+class FakeModel:
+    """Заглушка Gemini с асинхронным generate_content_async."""
+
+    def __init__(self, text="Описание от Ингрии", delay=0.0, chunks=None, usage=None):
+        self.text = text
+        self.delay = delay
+        self.chunks = chunks or [text]
+        self.usage = usage
+        self.calls = []
+
+    async def generate_content_async(self, contents, stream=False, **kwargs):
+        self.calls.append(contents)
+        if stream:
+            return FakeStream(self.chunks, self.delay)
+        await asyncio.sleep(self.delay)
+        return SimpleNamespace(text=self.text, usage_metadata=self.usage)
@@ -0,0 +1,142 @@
+import base64
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from tests.fakes import FakeSupabase
+
+
+def make_rows(count):
+    return [
+        {
+            "id": 100 - i,
+            "timestamp": f"2026-10-{17 - i:02d}T12:00:00+00:00",
+            "user_id": "user-1",
+            "file_name": f"photo_{i}.jpg",
+            "file_path": f"https://storage/files/photo_{i}.jpg",
+            "summary": "Краткое описание",
+        }
+        for i in range(count)
+    ]
+
+
+@pytest.fixture
+def query(monkeypatch):
+    query = FakeSupabase()
+    for method in ("select", "eq", "or_", "order", "limit"):
+        getattr(query, method).return_value = query
+    supabase = FakeSupabase()
+    supabase.table.return_value = query
+    monkeypatch.setattr(main, "supabase", supabase)
+    return query
+
+
+@pytest.fixture
+def client():
+    return TestClient(main.app)
+
+
+def test_list_returns_page_and_next_cursor(client, query):
+    """Тест: при наличии следующей страницы возвращается next_cursor"""
+    query.execute.return_value.data = make_rows(3)
+
+    response = client.get("/analysis", params={"limit": 2})
+
+    assert response.status_code == 200
+    data = response.json()
+    assert [item["id"] for item in data["items"]] == [100, 99]
+    assert "ai_response" not in data["items"][0]
+    assert data["items"][0]["summary"] == "Краткое описание"
+    assert data["next_cursor"]
+    query.limit.assert_called_once_with(3)
+    assert "ai_response" not in query.select.call_args.args[0]
+
+
+def test_list_last_page_has_no_cursor(client, query):
+    """Тест: на последней странице next_cursor отсутствует"""
+    query.execute.return_value.data = make_rows(1)
+
+    response = client.get("/analysis", params={"limit": 2})
+
+    assert response.status_code == 200
+    assert "next_cursor" not in response.json()
+
+
+def test_list_cursor_filters_after_last_record(client, query):
+    """Тест: курсор превращается в условие по ключу (timestamp, id)"""
+    cursor = main.encode_cursor({"timestamp": "2026-10-16T12:00:00+00:00", "id": 99})
+    query.execute.return_value.data = []
+
+    response = client.get("/analysis", params={"cursor": cursor, "user_id": "user-1", "include_response": "true"})
+
+    assert response.status_code == 200
+    query.eq.assert_called_once_with("user_id", "user-1")
+    query.or_.assert_called_once_with(
+        'timestamp.lt."2026-10-16T12:00:00+00:00",and(timestamp.eq."2026-10-16T12:00:00+00:00",id.lt.99)'
+    )
+    assert "ai_response" in query.select.call_args.args[0]
+
+
+@pytest.mark.parametrize("value", [None, ["abc", 1], ['2026-10-16T12:00:00",id.gt.0,"', 1], ["2026-10-16T12:00:00", "1"]])
+def test_list_rejects_invalid_cursor(client, query, value):
+    """Тест: некорректный курсор (в том числе с подменой фильтра) даёт 400 и не доходит до базы"""
+    cursor = "not-a-cursor"
+    if value is not None:
+        cursor = base64.urlsafe_b64encode(json.dumps(value).encode()).decode()
+    response = client.get("/analysis", params={"cursor": cursor})
+    assert response.status_code == 400
+    query.or_.assert_not_called()
+
+
+def make_record(record_id=7):
+    return {
+        "id": record_id,
+        "timestamp": "2026-10-17T12:00:00+00:00",
+        "user_id": "user-1",
+        "ai_response": "Полное описание",
+        "file_name": "photo.jpg",
+        "file_path": "https://storage/files/photo.jpg",
+        "content_hash": "abc",
+    }
+
+
+def test_details_cached_with_etag_and_conditional_get(client, query):
+    """Тест: запись читается из базы один раз, дальше отдаётся из кэша; If-None-Match даёт 304"""
+    query.execute.return_value.data = [make_record()]
+
+    first = client.get("/analysis/7")
+    assert first.status_code == 200
+    assert first.json()["ai_response"] == "Полное описание"
+    assert "immutable" in first.headers["cache-control"]
+    etag = first.headers["etag"]
+    assert etag.startswith('"')
+
+    second = client.get("/analysis/7")
+    assert second.content == first.content
+    assert second.headers["etag"] == etag
+
+    not_modified = client.get("/analysis/7", headers={"If-None-Match": f'"other", W/{etag}'})
+    assert not_modified.status_code == 304
+    assert not_modified.content == b""
+    assert not_modified.headers["etag"] == etag
+    assert query.execute.call_count == 1
+
+
+def test_details_not_found(client, query):
+    """Тест: отсутствующая запись даёт 404"""
+    query.execute.return_value.data = []
+    assert client.get("/analysis/404").status_code == 404
+
+
+def test_details_prepopulated_from_write_path(fake_model, fake_supabase):
+    """Тест: записанный результат анализа сразу попадает в кэш записей"""
+    fake_supabase.table.return_value.insert.return_value.execute.return_value.data = [make_record(11)]
+    with TestClient(main.app) as client:
+        assert client.post("/analyze", files={"file": ("photo.jpg", b"image", "image/jpeg")}).status_code == 200
+
+    fake_supabase.table.return_value.select.side_effect = AssertionError("запрос к базе данных")
+    response = TestClient(main.app).get("/analysis/11")
+    assert response.status_code == 200
+    assert response.json()["id"] == 11
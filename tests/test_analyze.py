@@ -0,0 +1,224 @@
+import asyncio
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from tests.fakes import FakeModel
+from limiter import ConcurrencyLimiter, QueueFullError
+from uploads import IngestedUpload
+
+
+@pytest.fixture
+def client():
+    return TestClient(main.app)
+
+
+def test_analyze_image(client, fake_model, fake_supabase):
+    """Тест анализа изображения через асинхронный вызов Gemini"""
+    response = client.post(
+        "/analyze",
+        files={"file": ("test_image.jpg", b"fake image content", "image/jpeg")}
+    )
+    assert response.status_code == 200
+    assert response.json() == {"description": "Описание от Ингрии"}
+    assert len(fake_model.calls) == 1
+    assert fake_model.calls[0][1]["data"] == b"fake image content"
+
+
+def test_analyze_repeat_upload_served_from_cache(client, fake_model, fake_supabase):
+    """Тест повторной загрузки того же файла: Gemini и хранилище не вызываются повторно"""
+    for _ in range(2):
+        response = client.post(
+            "/analyze",
+            files={"file": ("test_image.jpg", b"same bytes", "image/jpeg")}
+        )
+        assert response.status_code == 200
+        assert response.json() == {"description": "Описание от Ингрии"}
+
+    assert len(fake_model.calls) == 1
+    assert fake_supabase.storage.from_.return_value.upload.call_count == 1
+
+
+def test_save_file_uses_content_hash_and_skips_existing(fake_supabase):
+    """Тест имени объекта по хэшу и пропуска загрузки уже существующего файла"""
+    bucket = fake_supabase.storage.from_.return_value
+    bucket.exists.return_value = True
+    with IngestedUpload("фото.jpg", "image/jpeg", spool_threshold=1024) as upload:
+        upload.write(b"data")
+        asyncio.run(main.save_file(upload))
+
+    bucket.exists.assert_called_once_with(f"{upload.file_hash}_foto.jpg")
+    bucket.upload.assert_not_called()
+
+
+def test_analyze_rejects_oversized_upload(client, fake_model, fake_supabase, monkeypatch):
+    """Тест отказа 413 для файла больше MAX_UPLOAD_BYTES"""
+    monkeypatch.setattr(main, "MAX_UPLOAD_BYTES", 10)
+    response = client.post(
+        "/analyze",
+        files={"file": ("test_image.jpg", b"x" * 100, "image/jpeg")}
+    )
+    assert response.status_code == 413
+    assert fake_model.calls == []
+
+
+def test_analyze_rejects_oversized_chunked_body(client, fake_model, fake_supabase, monkeypatch):
+    """Тест: тело без Content-Length ограничивается по мере приёма, а не после сохранения целиком"""
+    monkeypatch.setattr(main, "MAX_UPLOAD_BYTES", 1024)
+
+    def body():
+        yield b"--boundary\r\nContent-Disposition: form-data; name=\"file\"; filename=\"a.jpg\"\r\n"
+        yield b"Content-Type: image/jpeg\r\n\r\n"
+        for _ in range(200):
+            yield b"x" * 1024
+        yield b"\r\n--boundary--\r\n"
+
+    response = client.post(
+        "/analyze",
+        content=body(),
+        headers={"content-type": "multipart/form-data; boundary=boundary"},
+    )
+    assert response.status_code == 413
+    assert response.json()["detail"] == f"Размер запроса превышает {main.upload_body_limit('/analyze')} байт"
+    assert fake_model.calls == []
+
+
+def test_analyze_runs_storage_and_model_concurrently(client, fake_supabase, monkeypatch):
+    """Тест: загрузка в Storage и вызов Gemini выполняются параллельно"""
+    monkeypatch.setattr(main, "model", FakeModel(delay=0.3))
+
+    async def slow_save_file(upload):
+        await asyncio.sleep(0.3)
+        return "https://storage/files/test.jpg"
+
+    monkeypatch.setattr(main, "save_file", slow_save_file)
+
+    started = time.perf_counter()
+    response = client.post(
+        "/analyze",
+        files={"file": ("test_image.jpg", b"fake image content", "image/jpeg")}
+    )
+    elapsed = time.perf_counter() - started
+
+    assert response.status_code == 200
+    assert elapsed < 0.55
+
+
+def test_analyze_model_error_returns_500(client, fake_supabase, monkeypatch):
+    """Тест: ошибка Gemini превращается в 500, а запись в базу данных не выполняется"""
+    class BrokenModel:
+        async def generate_content_async(self, contents, **kwargs):
+            raise RuntimeError("upstream error")
+
+    monkeypatch.setattr(main, "model", BrokenModel())
+    response = client.post(
+        "/analyze",
+        files={"file": ("test_image.jpg", b"fake image content", "image/jpeg")}
+    )
+    assert response.status_code == 500
+    fake_supabase.table.return_value.insert.assert_not_called()
+
+
+def test_analyze_writes_results_in_batches(fake_model, fake_supabase):
+    """Тест: результаты нескольких запросов записываются одним пакетом при остановке приложения"""
+    with TestClient(main.app, cookies={"session_id": "session-1"}) as client:
+        for i in range(3):
+            response = client.post(
+                "/analyze",
+                files={"file": (f"image_{i}.jpg", f"image {i}".encode(), "image/jpeg")},
+            )
+            assert response.status_code == 200
+
+    insert = fake_supabase.table.return_value.insert
+    rows = [row for call in insert.call_args_list for row in call.args[0]]
+    assert [row["file_name"] for row in rows] == ["image_0.jpg", "image_1.jpg", "image_2.jpg"]
+    assert all(row["user_id"] == "user-session-1" for row in rows)
+    # Одна сессия — один UPSERT пользователя на все три записи
+    assert fake_supabase.table.return_value.upsert.call_count == 1
+
+
+def test_analyze_sets_session_cookie_for_new_client(client, fake_model, fake_supabase):
+    """Тест: клиент без cookie получает session_id"""
+    response = client.post(
+        "/analyze",
+        files={"file": ("test_image.jpg", b"fake image content", "image/jpeg")}
+    )
+    assert response.status_code == 200
+    assert response.cookies.get("session_id")
+
+
+def test_analyze_keeps_existing_session_cookie(fake_model, fake_supabase):
+    """Тест: существующий session_id не перезаписывается"""
+    client = TestClient(main.app, cookies={"session_id": "session-1"})
+    response = client.post(
+        "/analyze",
+        files={"file": ("test_image.jpg", b"fake image content", "image/jpeg")}
+    )
+    assert response.status_code == 200
+    assert "set-cookie" not in response.headers
+
+
+def test_analyze_unsupported_type(client, fake_model, fake_supabase):
+    """Тест отклонения неподдерживаемого типа файла"""
+    response = client.post(
+        "/analyze",
+        files={"file": ("test.txt", b"text", "text/plain")}
+    )
+    assert response.status_code == 400
+    assert fake_model.calls == []
+
+
+def test_analyze_queue_full_returns_503(client, fake_model, fake_supabase, monkeypatch):
+    """Тест быстрого отказа 503, когда очередь анализов заполнена"""
+    limiter = ConcurrencyLimiter(max_in_flight=1, max_queue=0)
+    limiter.in_flight = 1
+    monkeypatch.setattr(main, "analyze_limiter", limiter)
+
+    response = client.post(
+        "/analyze",
+        files={"file": ("test_image.jpg", b"fake image content", "image/jpeg")}
+    )
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert fake_model.calls == []
+
+
+def test_limiter_runs_up_to_max_in_flight():
+    """Тест ограничения числа одновременных операций"""
+    limiter = ConcurrencyLimiter(max_in_flight=2, max_queue=10)
+    peak = 0
+
+    async def job():
+        nonlocal peak
+        async with limiter.slot():
+            peak = max(peak, limiter.in_flight)
+            await asyncio.sleep(0.01)
+
+    async def run():
+        await asyncio.gather(*(job() for _ in range(6)))
+
+    asyncio.run(run())
+    assert peak == 2
+    assert limiter.in_flight == 0
+    assert limiter.waiting == 0
+
+
+def test_limiter_rejects_when_queue_full():
+    """Тест отказа при переполненной очереди ожидания"""
+    limiter = ConcurrencyLimiter(max_in_flight=1, max_queue=1)
+    rejected = []
+
+    async def job():
+        try:
+            async with limiter.slot():
+                await asyncio.sleep(0.01)
+        except QueueFullError:
+            rejected.append(True)
+
+    async def run():
+        await asyncio.gather(*(job() for _ in range(3)))
+
+    asyncio.run(run())
+    assert len(rejected) == 1
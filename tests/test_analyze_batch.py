@@ -0,0 +1,140 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from tests.fakes import FakeModel
+from uploads import IngestedUpload
+
+
+@pytest.fixture
+def client():
+    return TestClient(main.app)
+
+
+def batch_files(*items):
+    return [("files", item) for item in items]
+
+
+def test_batch_returns_result_per_file_and_inserts_once(fake_model, fake_supabase):
+    """Тест: каждый файл получает результат, а отложенная запись вставляет строки пакета одним INSERT"""
+    with TestClient(main.app) as client:
+        response = client.post(
+            "/analyze/batch",
+            files=batch_files(
+                ("photo_1.jpg", b"image 1", "image/jpeg"),
+                ("photo_2.png", b"image 2", "image/png"),
+                ("voice.ogg", b"audio", "audio/ogg"),
+            ),
+        )
+
+    assert response.status_code == 200
+    items = response.json()["items"]
+    assert [item["file_name"] for item in items] == ["photo_1.jpg", "photo_2.png", "voice.ogg"]
+    assert all(item["description"] == "Описание от Ингрии" for item in items)
+    insert = fake_supabase.table.return_value.insert
+    assert insert.call_count == 1
+    assert len(insert.call_args.args[0]) == 3
+
+
+def test_batch_reports_partial_failures(client, fake_supabase, monkeypatch):
+    """Тест: ошибка одного файла не мешает остальным"""
+    class FlakyModel(FakeModel):
+        async def generate_content_async(self, contents, **kwargs):
+            if contents[1]["data"] == b"bad":
+                raise RuntimeError("upstream error")
+            return await super().generate_content_async(contents, **kwargs)
+
+    monkeypatch.setattr(main, "model", FlakyModel())
+    response = client.post(
+        "/analyze/batch",
+        files=batch_files(
+            ("good.jpg", b"good", "image/jpeg"),
+            ("bad.jpg", b"bad", "image/jpeg"),
+        ),
+    )
+
+    assert response.status_code == 200
+    good, bad = response.json()["items"]
+    assert good["status_code"] == 200 and good["description"]
+    assert bad["status_code"] == 500 and "upstream error" in bad["error"]
+    assert len(fake_supabase.table.return_value.insert.call_args.args[0]) == 1
+
+
+def test_batch_rejects_unsupported_type_before_processing(client, fake_model, fake_supabase):
+    """Тест: неподдерживаемый тип любого файла отклоняет весь пакет"""
+    response = client.post(
+        "/analyze/batch",
+        files=batch_files(
+            ("photo.jpg", b"image", "image/jpeg"),
+            ("notes.txt", b"text", "text/plain"),
+        ),
+    )
+    assert response.status_code == 400
+    assert fake_model.calls == []
+
+
+def test_batch_stream_returns_json_lines(client, fake_model, fake_supabase):
+    """Тест: с stream=true результаты приходят построчно в JSON Lines"""
+    response = client.post(
+        "/analyze/batch",
+        params={"stream": "true"},
+        files=batch_files(
+            ("photo_1.jpg", b"image 1", "image/jpeg"),
+            ("photo_2.jpg", b"image 2", "image/jpeg"),
+        ),
+    )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert sorted(line["index"] for line in lines) == [0, 1]
+    insert = fake_supabase.table.return_value.insert
+    assert sorted(row["file_name"] for call in insert.call_args_list for row in call.args[0]) == ["photo_1.jpg", "photo_2.jpg"]
+
+
+def test_batch_saves_finished_items_when_client_disconnects(fake_supabase, monkeypatch):
+    """Тест: готовые результаты сохраняются, даже если клиент отключился до конца пакета"""
+    class SlowModel(FakeModel):
+        async def generate_content_async(self, contents, **kwargs):
+            if contents[1]["data"] == b"slow":
+                await asyncio.sleep(10)
+            return await super().generate_content_async(contents, **kwargs)
+
+    monkeypatch.setattr(main, "model", SlowModel())
+
+    async def scenario():
+        uploads = []
+        for name, data in (("fast.jpg", b"fast"), ("slow.jpg", b"slow")):
+            upload = IngestedUpload(name, "image/jpeg", spool_threshold=1024)
+            upload.write(data)
+            upload.finish()
+            uploads.append(upload)
+        files = [SimpleNamespace(filename=upload.filename) for upload in uploads]
+        results = main.run_batch("session-1", files, uploads)
+        first = await results.__anext__()
+        # Клиент отключился: StreamingResponse закрывает генератор
+        await results.aclose()
+        return first
+
+    first = asyncio.run(scenario())
+
+    assert first.file_name == "fast.jpg"
+    insert = fake_supabase.table.return_value.insert
+    assert [row["file_name"] for call in insert.call_args_list for row in call.args[0]] == ["fast.jpg"]
+
+
+def test_batch_oversized_rejection_is_readable_cross_origin(monkeypatch):
+    """Тест: ранний отказ 413 по Content-Length несёт заголовки CORS"""
+    monkeypatch.setattr(main, "MAX_UPLOAD_BYTES", 1024)
+    monkeypatch.setattr(main, "BATCH_MAX_FILES", 1)
+    response = TestClient(main.app).post(
+        "/analyze/batch",
+        files=batch_files(("photo.jpg", b"x" * 200 * 1024, "image/jpeg")),
+        headers={"Origin": "https://ingria.canfly.org"},
+    )
+    assert response.status_code == 413
+    assert response.headers["access-control-allow-origin"] == "https://ingria.canfly.org"
@@ -0,0 +1,71 @@
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from tests.fakes import FakeModel
+
+
+def parse_events(body: str):
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.split("\n"))
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+@pytest.fixture
+def client():
+    return TestClient(main.app)
+
+
+def test_stream_forwards_chunks_and_persists(client, fake_supabase, monkeypatch):
+    """Тест: фрагменты ответа приходят событиями chunk, затем done, затем запись в базу"""
+    model = FakeModel(chunks=["Привет, ", "я Ингрия!"])
+    monkeypatch.setattr(main, "model", model)
+
+    response = client.post(
+        "/analyze/stream",
+        files={"file": ("voice.ogg", b"fake audio", "audio/ogg")}
+    )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert response.cookies.get("session_id")
+    assert parse_events(response.text) == [
+        ("chunk", {"text": "Привет, "}),
+        ("chunk", {"text": "я Ингрия!"}),
+        ("done", {"description": "Привет, я Ингрия!"}),
+    ]
+    rows = fake_supabase.table.return_value.insert.call_args.args[0]
+    assert rows[0]["ai_response"] == "Привет, я Ингрия!"
+    assert main.analyze_limiter.in_flight == 0
+
+
+def test_stream_reports_model_error_as_event(client, fake_supabase, monkeypatch):
+    """Тест: ошибка Gemini передаётся событием error"""
+    class BrokenModel:
+        async def generate_content_async(self, contents, **kwargs):
+            raise RuntimeError("upstream error")
+
+    monkeypatch.setattr(main, "model", BrokenModel())
+
+    response = client.post(
+        "/analyze/stream",
+        files={"file": ("photo.jpg", b"fake image", "image/jpeg")}
+    )
+
+    events = parse_events(response.text)
+    assert events[-1][0] == "error"
+    fake_supabase.table.return_value.insert.assert_not_called()
+    assert main.analyze_limiter.in_flight == 0
+
+
+def test_stream_rejects_unsupported_type(client, fake_model, fake_supabase):
+    """Тест: неподдерживаемый тип файла отклоняется до начала потока"""
+    response = client.post(
+        "/analyze/stream",
+        files={"file": ("test.txt", b"text", "text/plain")}
+    )
+    assert response.status_code == 400
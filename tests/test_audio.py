@@ -0,0 +1,121 @@
+import os
+import shutil
+import subprocess
+
+import numpy as np
+from fastapi.testclient import TestClient
+
+import main
+from prompts import PromptRegistry
+import audio
+from audio import decode_audio, encode_wav, probe_duration, segment_audio, split_audio, stitch_transcripts
+from tests.fakes import FakeModel
+
+RATE = 16000
+
+
+def make_speech(durations, pause=0.5, rate=RATE) -> np.ndarray:
+    """Тон длительностью из `durations`, разделённый паузами — как фразы с паузами между ними."""
+    parts = []
+    for duration in durations:
+        t = np.arange(int(duration * rate)) / rate
+        parts.append((np.sin(2 * np.pi * 220 * t) * 8000).astype(np.int16))
+        parts.append(np.zeros(int(pause * rate), dtype=np.int16))
+    return np.concatenate(parts)
+
+
+def test_split_audio_cuts_in_pauses():
+    """Тест: фрагменты не длиннее максимума, разрезы попадают в паузы, есть перекрытие"""
+    samples = make_speech([3.0] * 40)  # 140 секунд
+    segments = split_audio(samples, RATE, segment_seconds=20, max_segment_seconds=30, overlap_seconds=1.0)
+
+    assert len(segments) >= 5
+    assert segments[0].start == 0
+    assert segments[-1].end == len(samples) / RATE
+    for previous, segment in zip(segments, segments[1:]):
+        assert segment.end - segment.start <= 31
+        cut = segment.start + 1.0
+        # Разрез внутри паузы: позиция в цикле "3 с тона + 0,5 с тишины" после 3 секунд
+        assert cut % 3.5 >= 2.99
+        assert abs(previous.end - cut) < 1e-6
+
+
+def test_decode_audio_reads_wav():
+    """Тест: 16-битный WAV читается без ffmpeg"""
+    samples = make_speech([1.0])
+    decoded, rate = decode_audio(encode_wav(samples, RATE), "audio/wav")
+    assert rate == RATE
+    assert np.array_equal(decoded, samples)
+
+
+
+def test_short_recording_is_not_decoded(monkeypatch):
+    """Тест: длительность берётся из заголовка или ffprobe, короткая запись не декодируется"""
+    def no_decode(*args):
+        raise AssertionError("короткая запись не должна декодироваться")
+
+    def fake_ffprobe(command, **kwargs):
+        assert command[0] == "ffprobe" and os.path.exists(command[-1])
+        return subprocess.CompletedProcess(command, 0, stdout=b"12.5\n", stderr=b"")
+
+    monkeypatch.setattr(audio, "decode_audio", no_decode)
+    wav = encode_wav(make_speech([1.0]), RATE)
+    assert probe_duration(wav, "audio/wav") == len(make_speech([1.0])) / RATE
+    assert segment_audio(wav, "audio/wav", min_duration=180) is None
+
+    monkeypatch.setattr(audio.subprocess, "run", fake_ffprobe)
+    assert segment_audio(b"OggS voice note", "audio/ogg", min_duration=180) is None
+
+def test_stitch_transcripts_removes_overlap():
+    """Тест: повтор на стыке фрагментов удаляется"""
+    texts = ["Привет, я записываю длинное сообщение", "длинное сообщение. Про погоду в Петербурге", "в Петербурге сегодня дождь"]
+    assert stitch_transcripts(texts) == "Привет, я записываю длинное сообщение. Про погоду в Петербурге сегодня дождь"
+
+
+def test_analyze_long_audio_transcribes_segments(fake_supabase, monkeypatch):
+    """Тест: длинная запись расшифровывается по фрагментам, а анализ выполняется один раз по тексту"""
+    model = FakeModel(text="текст фрагмента")
+    monkeypatch.setattr(main, "model", model)
+    monkeypatch.setattr(main, "AUDIO_SEGMENT_MIN_DURATION", 30)
+    monkeypatch.setattr(main, "AUDIO_SEGMENT_SECONDS", 20)
+    monkeypatch.setattr(main, "AUDIO_SEGMENT_MAX_SECONDS", 30)
+    audio = encode_wav(make_speech([3.0] * 20), RATE)
+
+    response = TestClient(main.app).post("/analyze", files={"file": ("voice.wav", audio, "audio/wav")})
+
+    assert response.status_code == 200
+    transcriptions = [call for call in model.calls if call[0] == main.prompt_registry.get("transcribe").text]
+    analyses = [call for call in model.calls if call[0].startswith(main.prompt_registry.get("audio_transcript").text)]
+    assert len(transcriptions) >= 3
+    assert all(call[1]["mime_type"] == "audio/wav" for call in transcriptions)
+    assert len(analyses) == 1
+
+
+def test_segmented_audio_prompts_have_own_versions(fake_supabase, monkeypatch, tmp_path):
+    """Тест: новая версия промпта audio не ломает длинные записи, а правка промпта расшифровки меняет ключ кэша"""
+    templates = tmp_path / "prompts"
+    shutil.copytree(main.PROMPT_DIR, templates)
+    (templates / "audio" / "v2.txt").write_text("Опиши запись.", encoding="utf-8")
+    monkeypatch.setattr(main, "prompt_registry", PromptRegistry(str(templates)))
+    monkeypatch.setattr(main, "model", FakeModel(text="текст фрагмента"))
+    monkeypatch.setattr(main, "AUDIO_SEGMENT_MIN_DURATION", 30)
+    monkeypatch.setattr(main, "AUDIO_SEGMENT_SECONDS", 20)
+    monkeypatch.setattr(main, "AUDIO_SEGMENT_MAX_SECONDS", 30)
+    audio = encode_wav(make_speech([3.0] * 20), RATE)
+
+    response = TestClient(main.app).post("/analyze", files={"file": ("voice.wav", audio, "audio/wav")})
+    assert response.status_code == 200
+
+    key = main.analysis_prompt_key(main.prompt_registry.get("audio"))
+    (templates / "transcribe" / "v1.txt").write_text("Расшифруй дословно.", encoding="utf-8")
+    monkeypatch.setattr(main, "prompt_registry", PromptRegistry(str(templates)))
+    assert main.analysis_prompt_key(main.prompt_registry.get("audio")) != key
+
+
+def test_analyze_short_audio_is_sent_whole(fake_model, fake_supabase):
+    """Тест: короткая запись уходит в Gemini целиком с обычным промптом"""
+    audio = encode_wav(make_speech([2.0]), RATE)
+    response = TestClient(main.app).post("/analyze", files={"file": ("voice.wav", audio, "audio/wav")})
+
+    assert response.status_code == 200
+    assert fake_model.calls == [[main.prompt_registry.get("audio").text, {"mime_type": "audio/wav", "data": audio}]]
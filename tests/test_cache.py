@@ -0,0 +1,127 @@
+import asyncio
+import hashlib
+
+from cache import (
+    ByteLRUCache,
+    MemoryAnalysisCache,
+    SessionUserCache,
+    TieredCache,
+    TTLCache,
+    analysis_cache_key,
+)
+
+
+def test_cache_key_depends_on_prompt_and_model():
+    """Тест ключа кэша: другой промпт или модель дают другой ключ"""
+    file_hash = hashlib.sha256(b"data").hexdigest()
+    key = analysis_cache_key(file_hash, "prompt", "gemini-2.0-flash")
+    assert key == analysis_cache_key(file_hash, "prompt", "gemini-2.0-flash")
+    assert key != analysis_cache_key(file_hash, "other prompt", "gemini-2.0-flash")
+    assert key != analysis_cache_key(file_hash, "prompt", "gemini-1.5-flash")
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    """Тест вытеснения самой давно использованной записи"""
+    cache = TTLCache(max_size=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+
+
+def test_ttl_cache_expires_entries():
+    """Тест истечения времени жизни записи"""
+    now = [0.0]
+    cache = TTLCache(max_size=10, ttl=5, clock=lambda: now[0])
+    cache.set("a", 1)
+    now[0] = 4.0
+    assert cache.get("a") == 1
+    now[0] = 10.0
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+class FailingCache:
+    async def get(self, key):
+        raise RuntimeError("db is down")
+
+    async def set(self, key, value):
+        pass
+
+
+def test_byte_lru_cache_bounded_by_bytes():
+    """Тест: кэш вытесняет давно не читанные записи, когда сумма размеров превышает лимит"""
+    cache = ByteLRUCache(max_bytes=100)
+    cache.set(1, "a", 40)
+    cache.set(2, "b", 40)
+    cache.get(1)
+    cache.set(3, "c", 40)
+
+    assert cache.get(2) is None
+    assert cache.get(1) == "a" and cache.get(3) == "c"
+    assert cache.total_bytes == 80
+    # Значение больше лимита не кэшируется и не вытесняет остальные
+    cache.set(4, "d", 101)
+    assert cache.get(4) is None
+    assert len(cache) == 2
+
+
+def test_tiered_cache_backfills_upper_tiers():
+    """Тест копирования попадания из нижнего уровня в верхний"""
+    memory = MemoryAnalysisCache()
+    lower = MemoryAnalysisCache()
+    cache = TieredCache(memory, lower)
+
+    async def run():
+        await lower.set("key", {"description": "d", "file_path": "p"})
+        assert await cache.get("key") == {"description": "d", "file_path": "p"}
+        assert await memory.get("key") == {"description": "d", "file_path": "p"}
+
+    asyncio.run(run())
+
+
+def test_tiered_cache_treats_tier_errors_as_miss():
+    """Тест: ошибка уровня кэша считается промахом"""
+    cache = TieredCache(MemoryAnalysisCache(), FailingCache())
+    assert asyncio.run(cache.get("key")) is None
+
+
+def test_session_user_cache_deduplicates_concurrent_misses():
+    """Тест: одновременные промахи по одной сессии дают один запрос к базе данных"""
+    calls = []
+
+    async def resolve_many(session_ids):
+        calls.append(list(session_ids))
+        await asyncio.sleep(0.01)
+        return {session_id: f"user-{session_id}" for session_id in session_ids}
+
+    cache = SessionUserCache(resolve_many)
+
+    async def run():
+        results = await asyncio.gather(*(cache.get_user_id("s1") for _ in range(5)))
+        assert results == ["user-s1"] * 5
+        assert await cache.get_user_id("s1") == "user-s1"
+
+    asyncio.run(run())
+    assert calls == [["s1"]]
+
+
+def test_session_user_cache_loads_all_misses_in_one_call():
+    """Тест: все недостающие сессии пакета загружаются одним вызовом"""
+    calls = []
+
+    async def resolve_many(session_ids):
+        calls.append(sorted(session_ids))
+        return {session_id: f"user-{session_id}" for session_id in session_ids}
+
+    cache = SessionUserCache(resolve_many)
+
+    async def run():
+        await cache.get_user_id("s1")
+        return await cache.get_user_ids(["s1", "s2", "s3", "s2"])
+
+    assert asyncio.run(run()) == {"s1": "user-s1", "s2": "user-s2", "s3": "user-s3"}
+    assert calls == [["s1"], ["s2", "s3"]]
@@ -0,0 +1,146 @@
+import asyncio
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from changefeed import ChangeFeed
+from tests.fakes import FakeSupabase
+
+
+def make_row(record_id):
+    return {
+        "id": record_id,
+        "timestamp": "2026-10-17T12:00:00+00:00",
+        "user_id": "user-1" if record_id % 2 else "user-2",
+        "ai_response": f"Описание {record_id}",
+        "summary": f"Описание {record_id}",
+        "file_name": f"photo_{record_id}.jpg",
+        "file_path": f"https://storage/files/photo_{record_id}.jpg",
+    }
+
+
+def parse_events(chunks):
+    events = []
+    for chunk in chunks:
+        if chunk.startswith(":"):
+            events.append(None)
+            continue
+        fields = dict(line.split(": ", 1) for line in chunk.strip().split("\n"))
+        events.append((int(fields["id"]), json.loads(fields["data"])))
+    return events
+
+
+async def take(generator, count):
+    chunks = []
+    async for chunk in generator:
+        chunks.append(chunk)
+        if len(chunks) == count:
+            break
+    await generator.aclose()
+    return parse_events(chunks)
+
+
+def test_feed_replays_from_buffer_and_reports_evicted_cursor():
+    """Тест: буфер отдаёт строки после курсора, а курсор старше буфера требует чтения таблицы"""
+    feed = ChangeFeed(capacity=3)
+    assert feed.since(0) is None
+
+    feed.publish([make_row(5), make_row(4)])
+    assert [row["id"] for row in feed.since(3)] == [4, 5]
+    assert feed.since(2) is None
+
+    feed.publish([make_row(6), make_row(7)])
+    assert [row["id"] for row in feed.since(4)] == [5, 6, 7]
+    assert feed.since(3) is None
+
+
+def test_wait_wakes_on_publish():
+    """Тест: ожидание завершается публикацией новой строки, а без неё — по тайм-ауту"""
+    async def scenario():
+        feed = ChangeFeed()
+        waiter = asyncio.create_task(feed.wait(0, timeout=5))
+        await asyncio.sleep(0)
+        feed.publish([make_row(1)])
+        assert await waiter is True
+        assert await feed.wait(1, timeout=0.01) is False
+
+    asyncio.run(scenario())
+
+
+
+def test_concurrent_writes_are_published_in_id_order():
+    """Тест: строки одновременных вставок появляются вместе и по порядку id, когда завершится последняя"""
+    feed = ChangeFeed()
+    with feed.writing():
+        with feed.writing():
+            # Вторая вставка завершилась первой, но получила id больше
+            feed.publish([make_row(11)])
+        assert feed.since(0) is None and feed.last_id == 0
+        feed.publish([make_row(10)])
+    assert [row["id"] for row in feed.since(9)] == [10, 11]
+
+    feed.publish([make_row(12)])
+    assert [row["id"] for row in feed.since(11)] == [12]
+
+
+
+def test_flush_publishes_written_rows(fake_supabase):
+    """Тест: записанные в таблицу строки сразу попадают в ленту изменений"""
+    fake_supabase.table.return_value.insert.return_value.execute.return_value.data = [make_row(7)]
+    row = main.make_analysis_row("session-1", "Описание", "photo.jpg", "https://storage/files/photo.jpg")
+
+    asyncio.run(main.flush_analysis_rows([row]))
+
+    assert main.change_feed.last_id == 7 and [row["id"] for row in main.change_feed.since(6)] == [7]
+
+
+@pytest.fixture
+def query(monkeypatch):
+    query = FakeSupabase()
+    for method in ("select", "gt", "order", "limit"):
+        getattr(query, method).return_value = query
+    supabase = FakeSupabase()
+    supabase.table.return_value = query
+    monkeypatch.setattr(main, "supabase", supabase)
+    return query
+
+
+def test_stream_replays_missed_rows_from_table_then_buffer(query, monkeypatch):
+    """Тест: вытесненные из буфера записи дочитываются из таблицы, затем приходят записи из буфера"""
+    monkeypatch.setattr(main, "CHANGE_FEED_REPLAY_BATCH", 2)
+    monkeypatch.setattr(main, "change_feed", ChangeFeed(capacity=2))
+    main.change_feed.publish([make_row(i) for i in range(1, 6)])
+    query.execute.return_value.data = [make_row(2), make_row(3)]
+
+    events = asyncio.run(take(main.stream_analysis_changes(1), 4))
+
+    assert [event[0] for event in events] == [2, 3, 4, 5]
+    assert "ai_response" not in events[0][1] and events[0][1]["summary"] == "Описание 2"
+    # После полной порции из таблицы курсор доходит до начала буфера
+    query.gt.assert_called_once_with("id", 1)
+
+
+def test_stream_delivers_new_rows_for_user(query, monkeypatch):
+    """Тест: подписчик получает только новые записи своего пользователя, в паузах — keep-alive"""
+    monkeypatch.setattr(main, "CHANGE_FEED_HEARTBEAT", 0.01)
+    main.change_feed.publish([make_row(1)])
+
+    async def scenario():
+        stream = main.stream_analysis_changes(1, user_id="user-1", include_response=True)
+        heartbeat = await stream.__anext__()
+        main.change_feed.publish([make_row(2), make_row(3)])
+        return [heartbeat] + await take(stream, 1)
+
+    events = asyncio.run(scenario())
+
+    assert events[0] == ": keep-alive\n\n"
+    assert events[1][0] == 3 and events[1][1]["ai_response"] == "Описание 3"
+    query.execute.assert_not_called()
+
+
+def test_changes_rejects_bad_last_event_id():
+    """Тест: некорректный Last-Event-ID — 400"""
+    response = TestClient(main.app).get("/analysis/changes", headers={"Last-Event-ID": "abc"})
+    assert response.status_code == 400
@@ -0,0 +1,212 @@
+import asyncio
+import io
+import os
+import shutil
+import signal
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+import main
+from derivatives import DerivativeBuilder, DerivativeJob, original_hash, render_audio_preview, render_thumbnails
+from tests.fakes import FakeSupabase
+
+FILE_HASH = "ab" * 32
+
+
+def make_png(size=(300, 200)) -> bytes:
+    output = io.BytesIO()
+    Image.new("RGBA", size, (10, 200, 30, 128)).save(output, format="PNG")
+    return output.getvalue()
+
+
+def test_render_thumbnails_never_upscales():
+    """Тест: миниатюры WebP уменьшаются до нужной ширины, но не увеличиваются"""
+    thumbnails = dict(render_thumbnails(make_png(), [64, 128, 4000], quality=70))
+
+    sizes = {width: Image.open(io.BytesIO(data)).size for width, data in thumbnails.items()}
+    assert sizes == {64: (64, 43), 128: (128, 85), 4000: (300, 200)}
+    assert Image.open(io.BytesIO(thumbnails[64])).format == "WEBP"
+
+
+def test_builder_uploads_once_and_marks_done_last():
+    """Тест: производные загружаются по путям из хэша, а повторное задание для того же оригинала пропускается"""
+    uploaded = []
+
+    async def upload(path, data, content_type):
+        uploaded.append((path, content_type))
+
+    async def exists(path):
+        return path in [path for path, _ in uploaded]
+
+    builder = DerivativeBuilder(upload, exists, [320, 160], quality=70, workers=0)
+    job = DerivativeJob(FILE_HASH, "image/png", make_png())
+
+    assert asyncio.run(builder.build(job)) == 2
+    assert asyncio.run(builder.build(job)) == 0
+    assert uploaded == [
+        (f"derivatives/ab/{FILE_HASH}/w320-q70.webp", "image/webp"),
+        (f"derivatives/ab/{FILE_HASH}/w160-q70.webp", "image/webp"),
+    ]
+    assert builder.paths(FILE_HASH, "audio/ogg") == {"preview": f"derivatives/ab/{FILE_HASH}/preview-30s-32k.mp3"}
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="нужен ffmpeg")
+def test_render_audio_preview_is_short_mp3():
+    """Тест: превью аудио — MP3 не длиннее заданного числа секунд"""
+    import numpy as np
+    from audio import encode_wav
+
+    wav = encode_wav((np.sin(np.arange(16000 * 10) / 10) * 8000).astype(np.int16), 16000)
+    preview = render_audio_preview(wav, seconds=2, bitrate=32)
+
+    assert preview[:3] == b"ID3" or preview[0] == 0xFF
+    assert len(preview) < 2 * 32 * 1000 / 8 * 1.5
+
+
+def test_spooled_upload_is_linked_for_background_build(tmp_path, monkeypatch):
+    """Тест: файл на диске передаётся заданию отдельной ссылкой и удаляется после обработки"""
+    built = []
+
+    async def upload(path, data, content_type):
+        built.append(path)
+
+    async def exists(path):
+        return False
+
+    builder = DerivativeBuilder(upload, exists, [64], workers=0)
+    monkeypatch.setattr(main, "derivative_builder", builder)
+    monkeypatch.setattr(main, "DERIVATIVE_SPOOL_DIR", str(tmp_path))
+
+    async def scenario():
+        await builder.start()
+        upload = main.IngestedUpload("photo.png", "image/png", spool_threshold=10)
+        upload.write(make_png())
+        upload.finish()
+        with upload:
+            await main.schedule_derivatives(upload)
+        while builder.pending or not built:
+            await asyncio.sleep(0.01)
+        await builder.stop()
+        return upload.file_hash
+
+    file_hash = asyncio.run(scenario())
+
+    assert built == [f"derivatives/{file_hash[:2]}/{file_hash}/w64-q75.webp"]
+    assert os.listdir(tmp_path) == []
+
+
+def test_records_expose_derivative_urls(monkeypatch):
+    """Тест: записи списка содержат адреса миниатюр и превью, вычисленные из хэша оригинала"""
+    monkeypatch.setattr(main, "DERIVATIVE_BASE_URL", "https://cdn.example")
+    query = FakeSupabase()
+    for method in ("select", "order", "limit"):
+        getattr(query, method).return_value = query
+    query.execute.return_value.data = [
+        {
+            "id": 2,
+            "timestamp": "2026-10-17T12:00:00+00:00",
+            "user_id": "user-1",
+            "file_name": name,
+            "file_path": f"https://storage/files/{FILE_HASH}_{name}",
+        }
+        for name in ("photo.jpg", "voice.ogg")
+    ]
+    supabase = FakeSupabase()
+    supabase.table.return_value = query
+    monkeypatch.setattr(main, "supabase", supabase)
+
+    items = TestClient(main.app).get("/analysis").json()["items"]
+
+    base = f"https://cdn.example/derivatives/ab/{FILE_HASH}"
+    assert items[0]["thumbnails"] == {str(width): f"{base}/w{width}-q75.webp" for width in main.DERIVATIVE_WIDTHS}
+    assert "audio_preview" not in items[0]
+    assert items[1]["audio_preview"] == f"{base}/preview-30s-32k.mp3"
+    assert original_hash(f"https://storage/files/{FILE_HASH}_photo.jpg?") == FILE_HASH
+
+
+def test_derivative_urls_follow_persisted_content_type(monkeypatch):
+    """Тест: тип производных берётся из сохранённого content_type, а не из расширения имени"""
+    monkeypatch.setattr(main, "DERIVATIVE_BASE_URL", "https://cdn.example")
+    record = {"file_name": "blob", "file_path": f"https://storage/files/{FILE_HASH}_blob", "content_type": "image/png"}
+
+    urls = main.derivative_urls(record)
+
+    assert set(urls["thumbnails"]) == {str(width) for width in main.DERIVATIVE_WIDTHS}
+    assert main.derivative_urls({**record, "file_name": "photo.jpg", "content_type": "audio/ogg"}).keys() == {"audio_preview"}
+
+
+def test_stop_survives_swallowed_cancellation():
+    """Тест: остановка завершается, даже если отмену поглотило ожидание внутри задания"""
+    async def upload(path, data, content_type):
+        pass
+
+    async def exists(path):
+        return False
+
+    builder = DerivativeBuilder(upload, exists, [64], workers=0, concurrency=1)
+    started = []
+
+    async def build(job):
+        started.append(job)
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            # Как asyncio.wait_for в Python 3.11, когда ожидание завершилось одновременно с отменой
+            return 0
+
+    builder.build = build
+
+    async def scenario():
+        await builder.start()
+        builder.submit(DerivativeJob(FILE_HASH, "image/png", make_png()))
+        while not started:
+            await asyncio.sleep(0.01)
+        await asyncio.wait_for(builder.stop(), timeout=5)
+
+    asyncio.run(scenario())
+    assert builder.pending == 0
+
+
+def test_builder_recreates_broken_pool():
+    """Тест: после гибели рабочего процесса задание не выполняется, а следующее получает новый пул"""
+    uploaded = []
+
+    async def upload(path, data, content_type):
+        uploaded.append(path)
+
+    async def exists(path):
+        return False
+
+    builder = DerivativeBuilder(upload, exists, [64], workers=1)
+
+    async def scenario():
+        assert await builder.build(DerivativeJob(FILE_HASH, "image/png", make_png())) == 1
+        broken = builder._executor
+        for process in list(broken._processes.values()):
+            os.kill(process.pid, signal.SIGKILL)
+            process.join()
+        with pytest.raises(BrokenProcessPool):
+            await builder.build(DerivativeJob(FILE_HASH, "image/png", make_png()))
+        assert builder._executor is None
+        assert await builder.build(DerivativeJob(FILE_HASH, "image/png", make_png())) == 1
+        await builder.stop()
+
+    asyncio.run(scenario())
+    assert len(uploaded) == 2
+
+
+def test_cache_hit_reschedules_derivatives(fake_model, fake_supabase, monkeypatch):
+    """Тест: повторная загрузка из кэша анализа снова ставит недостроенные производные в очередь"""
+    submitted = []
+    monkeypatch.setattr(main.derivative_builder, "submit", lambda job: submitted.append(job.file_hash) or False)
+    client = TestClient(main.app)
+
+    for _ in range(2):
+        response = client.post("/analyze", files={"file": ("photo.png", make_png(), "image/png")})
+        assert response.status_code == 200
+
+    assert len(fake_model.calls) == 1
+    assert len(submitted) == 2 and submitted[0] == submitted[1]
@@ -0,0 +1,116 @@
+import asyncio
+import io
+import os
+import signal
+
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+import main
+from images import ImagePreprocessor, preprocess_image
+
+
+def make_jpeg(size=(4000, 3000), gps=True) -> bytes:
+    image = Image.new("RGB", size, (200, 100, 50))
+    exif = Image.Exif()
+    if gps:
+        exif.get_ifd(0x8825).update({1: "S", 2: (55.0, 45.0, 21.0), 3: "E", 4: (37.0, 37.0, 4.0)})
+    output = io.BytesIO()
+    image.save(output, format="JPEG", quality=95, exif=exif)
+    return output.getvalue()
+
+
+@pytest.fixture
+def preprocessor(monkeypatch):
+    preprocessor = ImagePreprocessor(max_dimension=512, quality=80, workers=0)
+    monkeypatch.setattr(main, "image_preprocessor", preprocessor)
+    return preprocessor
+
+
+def test_preprocess_image_downscales_and_reads_gps():
+    """Тест: изображение уменьшается по большей стороне, координаты читаются из EXIF"""
+    original = make_jpeg()
+    prepared = preprocess_image(original, max_dimension=512, quality=80)
+
+    assert (prepared.width, prepared.height) == (512, 384)
+    assert prepared.content_type == "image/jpeg"
+    assert len(prepared.data) < len(original)
+    assert prepared.gps == "-55.755833, 37.617778"
+    # Метаданные в перекодированное изображение не попадают
+    assert not Image.open(io.BytesIO(prepared.data)).getexif()
+
+
+def test_preprocess_image_keeps_small_original():
+    """Тест: небольшое изображение, которое не уменьшается при перекодировании, отправляется как есть"""
+    output = io.BytesIO()
+    Image.new("RGB", (64, 64)).save(output, format="PNG")
+    prepared = preprocess_image(output.getvalue(), max_dimension=512, quality=80)
+
+    assert prepared.data == output.getvalue()
+    assert prepared.content_type == "image/png"
+    assert prepared.gps is None
+
+
+def test_preprocessor_runs_in_process_pool():
+    """Тест: подготовка выполняется в пуле процессов, запущенных через forkserver"""
+    preprocessor = ImagePreprocessor(max_dimension=256, quality=80, workers=1)
+    try:
+        prepared = asyncio.run(preprocessor.prepare(make_jpeg(gps=False)))
+        # Рабочие процессы не наследуют event loop и потоки родителя
+        assert preprocessor._executor._mp_context.get_start_method() == "forkserver"
+    finally:
+        preprocessor.shutdown()
+    assert max(prepared.width, prepared.height) == 256
+
+
+
+def test_preprocessor_recreates_broken_pool():
+    """Тест: если рабочий процесс погиб, отправляется оригинал, а пул создаётся заново"""
+    preprocessor = ImagePreprocessor(max_dimension=256, quality=80, workers=1)
+
+    async def scenario():
+        assert await preprocessor.prepare(make_jpeg(gps=False)) is not None
+        broken = preprocessor._executor
+        for process in list(broken._processes.values()):
+            # Как при убийстве процесса из-за нехватки памяти
+            os.kill(process.pid, signal.SIGKILL)
+            process.join()
+        assert await preprocessor.prepare(make_jpeg(gps=False)) is None
+        assert preprocessor._executor is not broken
+        return await preprocessor.prepare(make_jpeg(gps=False))
+
+    try:
+        prepared = asyncio.run(scenario())
+    finally:
+        preprocessor.shutdown()
+    assert max(prepared.width, prepared.height) == 256
+
+def test_preprocessor_returns_none_for_broken_image(preprocessor):
+    """Тест: файл, который не разбирается как изображение, не ломает анализ"""
+    assert asyncio.run(preprocessor.prepare(b"not an image")) is None
+
+
+def test_analyze_sends_prepared_image_and_gps(fake_model, fake_supabase, preprocessor):
+    """Тест: в Gemini уходит уменьшенное изображение и координаты текстом, в Storage — оригинал"""
+    original = make_jpeg()
+    response = TestClient(main.app).post("/analyze", files={"file": ("photo.jpg", original, "image/jpeg")})
+
+    assert response.status_code == 200
+    prompt, part = fake_model.calls[0]
+    assert "Координаты съёмки из EXIF: -55.755833, 37.617778" in prompt
+    assert max(Image.open(io.BytesIO(part["data"])).size) == 512
+    uploaded = fake_supabase.storage.from_.return_value.upload.call_args.args[1]
+    assert uploaded == original
+
+
+def test_analyze_stores_derivative_when_enabled(fake_model, fake_supabase, preprocessor, monkeypatch):
+    """Тест: при IMAGE_STORE_DERIVATIVE сжатая копия сохраняется рядом с оригиналом"""
+    monkeypatch.setattr(main, "IMAGE_STORE_DERIVATIVE", True)
+    response = TestClient(main.app).post("/analyze", files={"file": ("фото.jpg", make_jpeg(), "image/jpeg")})
+
+    assert response.status_code == 200
+    names = [call.args[0] for call in fake_supabase.storage.from_.return_value.upload.call_args_list]
+    assert len(names) == 2
+    assert names[0].endswith("_foto.jpg")
+    assert names[1] == names[0][:-len(".jpg")] + ".preview.jpg"
@@ -0,0 +1,188 @@
+import asyncio
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from jobs import DONE, FAILED, CallbackNotAllowedError, InMemoryJobQueue, Job, JobWorkerPool, SQLiteJobQueue, validate_callback_url
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def queue(request, tmp_path):
+    if request.param == "sqlite":
+        return SQLiteJobQueue(str(tmp_path / "jobs.sqlite3"), poll_interval=0.01)
+    return InMemoryJobQueue()
+
+
+def make_job(tmp_path, name="photo.jpg"):
+    payload = tmp_path / name
+    payload.write_bytes(b"payload")
+    return Job(file_name=name, content_type="image/jpeg", session_id="s1", payload_path=str(payload))
+
+
+def test_worker_pool_completes_and_fails_jobs(queue, tmp_path):
+    """Тест: обработчики выполняют задания и сохраняют результат или ошибку"""
+    async def handler(job):
+        if job.file_name == "bad.jpg":
+            raise RuntimeError("upstream error")
+        return {"description": f"описание {job.file_name}"}
+
+    async def run():
+        pool = JobWorkerPool(queue, handler, workers=2)
+        good, bad = make_job(tmp_path, "good.jpg"), make_job(tmp_path, "bad.jpg")
+        await queue.submit(good)
+        await queue.submit(bad)
+        await pool.start()
+        for _ in range(200):
+            statuses = [(await queue.get(job.id)).status for job in (good, bad)]
+            if statuses == [DONE, FAILED]:
+                break
+            await asyncio.sleep(0.01)
+        await pool.stop()
+        return await queue.get(good.id), await queue.get(bad.id)
+
+    good, bad = asyncio.run(run())
+    assert good.status == DONE
+    assert good.result == {"description": "описание good.jpg"}
+    assert bad.status == FAILED
+    assert bad.error == "upstream error"
+    # Файлы заданий удаляются после обработки
+    assert list(tmp_path.glob("*.jpg")) == []
+
+
+def test_worker_keeps_running_after_queue_error(queue, tmp_path):
+    """Тест: ошибка очереди (например, занятая база SQLite) не останавливает обработчик"""
+    claim = queue.claim
+    failures = []
+
+    async def flaky_claim():
+        if not failures:
+            failures.append(1)
+            raise RuntimeError("database is locked")
+        return await claim()
+
+    queue.claim = flaky_claim
+
+    async def handler(job):
+        return {"description": "готово"}
+
+    async def run():
+        pool = JobWorkerPool(queue, handler, workers=1, error_backoff=0.01)
+        job = make_job(tmp_path)
+        await queue.submit(job)
+        await pool.start()
+        for _ in range(200):
+            if (await queue.get(job.id)).status == DONE:
+                break
+            await asyncio.sleep(0.01)
+        await pool.stop()
+        return await queue.get(job.id)
+
+    assert asyncio.run(run()).status == DONE
+    assert failures == [1]
+
+
+def test_worker_pool_stop_survives_swallowed_cancellation(queue, tmp_path):
+    """Тест: остановка завершается, даже если отмену поглотило ожидание внутри обработчика"""
+    started = asyncio.Event()
+
+    async def handler(job):
+        started.set()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            # Как asyncio.wait_for в Python 3.11, когда ожидание завершилось одновременно с отменой
+            return {"description": "готово"}
+
+    async def run():
+        pool = JobWorkerPool(queue, handler, workers=1)
+        await queue.submit(make_job(tmp_path, "photo.jpg"))
+        await pool.start()
+        await asyncio.wait_for(started.wait(), timeout=5)
+        await asyncio.wait_for(pool.stop(), timeout=5)
+
+    asyncio.run(run())
+
+
+def test_sqlite_requeues_jobs_of_crashed_worker(tmp_path):
+    """Тест: задание, оставшееся выполняемым после падения процесса, снова выдаётся после истечения аренды"""
+    path = str(tmp_path / "jobs.sqlite3")
+    queue = SQLiteJobQueue(path, poll_interval=0.01)
+    job = make_job(tmp_path)
+    asyncio.run(queue.submit(job))
+    assert asyncio.run(queue.claim()).id == job.id
+
+    # Аренда ещё не истекла — задание никому не выдаётся
+    assert SQLiteJobQueue(path, lease_timeout=60)._claim_next() is None
+    restarted = SQLiteJobQueue(path, lease_timeout=0)
+    assert asyncio.run(restarted.get(job.id)).status == "queued"
+    assert restarted._claim_next().id == job.id
+
+
+def test_submit_and_poll_job(fake_model, fake_supabase, monkeypatch, tmp_path):
+    """Тест: POST /jobs сразу возвращает id, а результат появляется в GET /jobs/{id}"""
+    monkeypatch.setattr(main, "JOB_SPOOL_DIR", str(tmp_path))
+    queue = InMemoryJobQueue()
+    monkeypatch.setattr(main, "job_queue", queue)
+    monkeypatch.setattr(main, "job_workers", JobWorkerPool(queue, main.process_job, workers=1))
+
+    with TestClient(main.app) as client:
+        response = client.post("/jobs", files={"file": ("photo.jpg", b"image", "image/jpeg")})
+        assert response.status_code == 202
+        job_id = response.json()["job_id"]
+        assert response.json()["status"] in ("queued", "running")
+
+        for _ in range(100):
+            status = client.get(f"/jobs/{job_id}").json()
+            if status["status"] == "done":
+                break
+            time.sleep(0.02)
+
+    assert status["description"] == "Описание от Ингрии"
+    assert status["file_path"] == "https://storage/files/test.jpg"
+
+
+def test_unknown_job_returns_404():
+    """Тест: несуществующее задание даёт 404"""
+    response = TestClient(main.app).get("/jobs/unknown")
+    assert response.status_code == 404
+
+
+def test_submit_rejects_non_http_callback(fake_model, fake_supabase):
+    """Тест: callback_url допускается только http(s)"""
+    response = TestClient(main.app).post(
+        "/jobs",
+        files={"file": ("photo.jpg", b"image", "image/jpeg")},
+        data={"callback_url": "file:///etc/passwd"},
+    )
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("url", ["http://localhost:8080/hook", "http://169.254.169.254/latest", "https://10.0.0.7/hook", "http://[::1]/hook"])
+def test_submit_rejects_internal_callback(fake_model, fake_supabase, url):
+    """Тест: callback_url на loopback, link-local и частные адреса отклоняется"""
+    response = TestClient(main.app).post(
+        "/jobs",
+        files={"file": ("photo.jpg", b"image", "image/jpeg")},
+        data={"callback_url": url},
+    )
+    assert response.status_code == 400
+
+
+def test_callback_allowlist_overrides_address_check():
+    """Тест: при заданном списке хостов допускаются только они, в том числе внутренние"""
+    asyncio.run(validate_callback_url("http://hooks.internal/done", {"hooks.internal"}))
+    with pytest.raises(CallbackNotAllowedError):
+        asyncio.run(validate_callback_url("https://8.8.8.8/done", {"hooks.internal"}))
+    asyncio.run(validate_callback_url("https://8.8.8.8/done"))
+
+
+def test_jobs_rejects_oversized_content_length(monkeypatch):
+    """Тест: /jobs, как и /analyze, отклоняет загрузку по Content-Length до чтения тела"""
+    monkeypatch.setattr(main, "MAX_UPLOAD_BYTES", 1024)
+    response = TestClient(main.app).post(
+        "/jobs",
+        files={"file": ("photo.jpg", b"x" * 200 * 1024, "image/jpeg")},
+    )
+    assert response.status_code == 413
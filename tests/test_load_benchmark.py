@@ -0,0 +1,45 @@
+import asyncio
+
+import main
+from benchmarks.fakes import FakeSupabase, Latency
+from benchmarks.load import percentile, run_benchmark
+
+
+def test_run_benchmark_drives_all_scenarios(monkeypatch):
+    """Тест: бенчмарк проходит все сценарии на заменителях Gemini и Supabase"""
+    # run_benchmark подменяет клиентов; monkeypatch вернёт прежние значения
+    monkeypatch.setattr(main, "model", None)
+    monkeypatch.setattr(main, "supabase", None)
+    results = asyncio.run(run_benchmark(requests=8, concurrency=4, seed_records=20))
+
+    assert [result.scenario for result in results] == ["analyze", "list", "details"]
+    for result in results:
+        assert result.status_codes == {"200": 8}
+        assert 0 < result.p50_ms <= result.p95_ms <= result.p99_ms
+
+
+def test_run_benchmark_counts_injected_errors(monkeypatch):
+    """Тест: ошибки заменителя Gemini попадают в отчёт как 500, а после размыкания выключателя — как 503"""
+    monkeypatch.setattr(main, "model", None)
+    monkeypatch.setattr(main, "supabase", None)
+    results = asyncio.run(run_benchmark(scenarios=["analyze"], requests=6, concurrency=2, gemini=Latency(error_rate=1.0)))
+    assert results[0].errors == 6
+    assert set(results[0].status_codes) <= {"500", "503"}
+
+
+def test_fake_supabase_keyset_pagination(monkeypatch):
+    """Тест: заменитель Supabase поддерживает пагинацию GET /analysis по ключу"""
+    fake = FakeSupabase(Latency(), Latency())
+    fake.seed_analysis_results(5)
+    monkeypatch.setattr(main, "supabase", fake)
+
+    first = asyncio.run(main.get_analysis_list(limit=3, cursor=None, user_id=None, include_response=False))
+    second = asyncio.run(main.get_analysis_list(limit=3, cursor=first.next_cursor, user_id=None, include_response=False))
+    assert [record.id for record in first.items] == [5, 4, 3]
+    assert [record.id for record in second.items] == [2, 1]
+    assert second.next_cursor is None
+
+
+def test_percentile_nearest_rank():
+    values = list(range(1, 101))
+    assert (percentile(values, 50), percentile(values, 95), percentile(values, 99)) == (50, 95, 99)
@@ -0,0 +1,48 @@
+from types import SimpleNamespace
+
+from fastapi.testclient import TestClient
+
+import main
+import metrics
+from tests.fakes import FakeModel
+
+
+def sample(name, **labels):
+    return metrics.registry.get_sample_value(name, labels) or 0
+
+
+def test_metrics_record_stages_sizes_and_tokens(fake_supabase, monkeypatch):
+    """Тест: /metrics отдаёт этапы по типу файла, размер загрузки и токены Gemini"""
+    usage = SimpleNamespace(prompt_token_count=300, candidates_token_count=120, cached_content_token_count=0)
+    monkeypatch.setattr(main, "model", FakeModel(usage=usage))
+    model_stage = dict(endpoint="analyze", stage="model", mime_type="image/jpeg")
+    before_model = sample("ingria_stage_duration_seconds_count", **model_stage)
+    before_prompt = sample("ingria_gemini_tokens_total", call="analyze", kind="prompt")
+    before_size = sample("ingria_upload_size_bytes_sum", mime_type="image/jpeg")
+
+    client = TestClient(main.app)
+    response = client.post("/analyze", files={"file": ("photo.jpg", b"fake image content", "image/jpeg")})
+    assert response.status_code == 200
+
+    assert sample("ingria_stage_duration_seconds_count", **model_stage) == before_model + 1
+    assert sample("ingria_gemini_tokens_total", call="analyze", kind="prompt") == before_prompt + 300
+    assert sample("ingria_upload_size_bytes_sum", mime_type="image/jpeg") == before_size + len(b"fake image content")
+
+    exposition = client.get("/metrics")
+    assert exposition.status_code == 200
+    assert exposition.headers["content-type"].startswith("text/plain")
+    assert 'ingria_stage_duration_seconds_bucket{endpoint="analyze"' in exposition.text
+    assert "ingria_analyze_in_flight 0.0" in exposition.text
+
+
+def test_server_timing_header(fake_model, fake_supabase, monkeypatch):
+    """Тест: при SERVER_TIMING=1 ответ /analyze содержит заголовок Server-Timing"""
+    client = TestClient(main.app)
+    files = {"file": ("photo.jpg", b"fake image content", "image/jpeg")}
+    assert "server-timing" not in client.post("/analyze", files=files).headers
+
+    monkeypatch.setattr(main, "SERVER_TIMING", True)
+    header = client.post("/analyze", files=files).headers["server-timing"]
+    stages = [entry.split(";")[0] for entry in header.split(", ")]
+    assert stages[0] == "queue"
+    assert {"ingest", "cache", "total"} <= set(stages)
@@ -0,0 +1,67 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from prompts import PromptRegistry, UnknownPromptError, parse_versions
+from tests.fakes import FakeModel
+
+
+@pytest.fixture
+def registry_dir(tmp_path):
+    for name, version, text in [("image", 1, "Опиши фото."), ("image", 2, "Опиши фото подробно."), ("audio", 1, "Расшифруй.")]:
+        (tmp_path / name).mkdir(exist_ok=True)
+        (tmp_path / name / f"v{version}.txt").write_text(text, encoding="utf-8")
+    return tmp_path
+
+
+def test_registry_defaults_to_latest_version(registry_dir):
+    """Тест: по умолчанию берётся последняя версия, PROMPT_VERSIONS закрепляет другую"""
+    registry = PromptRegistry(str(registry_dir))
+    assert registry.get("image").version == "v2"
+    assert registry.get("image", "v1").text == "Опиши фото."
+    assert registry.get("image").key != registry.get("image", "v1").key
+
+    pinned = PromptRegistry(str(registry_dir), parse_versions("image=v1"))
+    assert pinned.get("image").version == "v1"
+    with pytest.raises(UnknownPromptError):
+        pinned.get("image", "v3")
+    with pytest.raises(UnknownPromptError):
+        PromptRegistry(str(registry_dir), {"audio": "v9"})
+
+
+def test_prompt_version_selects_prompt_and_cache_key(fake_model, fake_supabase, registry_dir, monkeypatch):
+    """Тест: версия промпта выбирается параметром запроса и входит в ключ кэша"""
+    monkeypatch.setattr(main, "prompt_registry", PromptRegistry(str(registry_dir)))
+    client = TestClient(main.app)
+    files = {"file": ("photo.jpg", b"fake image content", "image/jpeg")}
+
+    assert client.post("/analyze", files=files).status_code == 200
+    assert client.post("/analyze", params={"prompt_version": "v1"}, files=files).status_code == 200
+    assert client.post("/analyze", params={"prompt_version": "v1"}, files=files).status_code == 200
+
+    assert [call[0] for call in fake_model.calls] == ["Опиши фото подробно.", "Опиши фото."]
+    response = client.post("/analyze", params={"prompt_version": "v7"}, files=files)
+    assert response.status_code == 400
+    assert len(fake_model.calls) == 2
+
+
+def test_system_instruction_mode_sends_only_file(fake_supabase, monkeypatch):
+    """Тест: с PROMPT_SYSTEM_INSTRUCTION промпт задаётся моделью один раз, а в запрос идёт только файл"""
+    created = []
+
+    def create_prompt_model(name, prompt):
+        created.append((name, prompt.key))
+        return model
+
+    model = FakeModel()
+    monkeypatch.setattr(main, "PROMPT_SYSTEM_INSTRUCTION", True)
+    monkeypatch.setattr(main, "prompt_models", {})
+    monkeypatch.setattr(main, "create_prompt_model", create_prompt_model)
+    client = TestClient(main.app)
+
+    for index in range(2):
+        response = client.post("/analyze", files={"file": (f"photo{index}.jpg", f"image {index}".encode(), "image/jpeg")})
+        assert response.status_code == 200
+
+    assert created == [(main.MODEL_NAME, main.prompt_registry.get("image").key)]
+    assert model.calls == [[{"mime_type": "image/jpeg", "data": f"image {index}".encode()}] for index in range(2)]
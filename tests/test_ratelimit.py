@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from ratelimit import InMemoryRateLimitBackend, RateLimit, RateLimiter, RateLimitExceeded
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class ResourceExhausted(Exception):
+    code = 429
+
+
+def test_bucket_refills_at_rate_up_to_burst():
+    """Тест: ведро пропускает burst запросов, затем сообщает время ожидания и пополняется"""
+    clock = FakeClock()
+    backend = InMemoryRateLimitBackend(clock=clock)
+    limit = RateLimit(rate=1, burst=2)
+
+    assert asyncio.run(backend.take("k", limit, 1)) == 0
+    assert asyncio.run(backend.take("k", limit, 1)) == 0
+    assert asyncio.run(backend.take("k", limit, 1)) == pytest.approx(1)
+
+    clock.now = 10
+    assert asyncio.run(backend.take("k", limit, 2)) == 0
+    assert asyncio.run(backend.take("k", limit, 1)) == pytest.approx(1)
+
+
+def test_admit_refunds_when_global_budget_is_exhausted():
+    """Тест: отказ по общему бюджету возвращает уже списанные токены сессии"""
+    clock = FakeClock()
+    backend = InMemoryRateLimitBackend(clock=clock)
+    limiter = RateLimiter(backend, session=RateLimit(rate=1, burst=1), tokens=RateLimit(rate=1, burst=100))
+
+    with pytest.raises(RateLimitExceeded) as error:
+        asyncio.run(limiter.admit("s1", None, reserve_tokens=150))
+    assert error.value.scope == "gemini_tokens"
+    asyncio.run(limiter.admit("s1", None, reserve_tokens=50))
+
+    asyncio.run(limiter.consume_tokens(60))
+    with pytest.raises(RateLimitExceeded):
+        asyncio.run(limiter.admit("s2", None, reserve_tokens=50))
+
+
+def test_analyze_rejected_with_retry_after_before_reading_upload(fake_model, fake_supabase, monkeypatch):
+    """Тест: сверх лимита сессии /analyze отвечает 429 с Retry-After, не вызывая модель"""
+    limiter = RateLimiter(InMemoryRateLimitBackend(), session=RateLimit.per_minute(2, burst=2))
+    monkeypatch.setattr(main, "rate_limiter", limiter)
+    client = TestClient(main.app)
+    client.cookies.set("session_id", "limited-session")
+
+    statuses = [
+        client.post(
+            "/analyze",
+            files={"file": (f"photo{index}.jpg", f"image {index}".encode(), "image/jpeg")},
+            headers={"Origin": "https://ingria.canfly.org"},
+        )
+        for index in range(3)
+    ]
+
+    assert [response.status_code for response in statuses] == [200, 200, 429]
+    assert int(statuses[2].headers["retry-after"]) >= 1
+    # Браузер на другом origin может прочитать отказ и Retry-After
+    assert statuses[2].headers["access-control-allow-origin"] == "https://ingria.canfly.org"
+    assert "retry-after" in statuses[2].headers["access-control-expose-headers"].lower()
+    assert len(fake_model.calls) == 2
+    # Другая сессия проходит
+    client.cookies.set("session_id", "other-session")
+    assert client.post("/analyze", files={"file": ("photo.jpg", b"other", "image/jpeg")}).status_code == 200
+
+
+def test_gemini_quota_exhausted_maps_to_429(fake_supabase, monkeypatch):
+    """Тест: ResourceExhausted от Gemini превращается в 429 с Retry-After вместо 500"""
+
+    class ExhaustedModel:
+        async def generate_content_async(self, contents, **kwargs):
+            raise ResourceExhausted("429 Quota exceeded")
+
+    monkeypatch.setattr(main, "model", ExhaustedModel())
+    client = TestClient(main.app)
+    response = client.post("/analyze", files={"file": ("photo.jpg", b"image", "image/jpeg")})
+
+    assert response.status_code == 429
+    assert response.headers["retry-after"] == str(main.GEMINI_QUOTA_RETRY_AFTER)
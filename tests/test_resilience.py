@@ -0,0 +1,130 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from resilience import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, ModelCaller, ModelUnavailableError
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class ScriptedModel:
+    """Модель, которая выполняет шаги по очереди: исключение или задержку перед ответом."""
+
+    def __init__(self, name, steps=()):
+        self.name = name
+        self.steps = list(steps)
+        self.calls = 0
+
+    async def generate_content_async(self, contents, **kwargs):
+        self.calls += 1
+        step = self.steps.pop(0) if self.steps else 0.0
+        if isinstance(step, Exception):
+            raise step
+        await asyncio.sleep(step)
+        return SimpleNamespace(text=f"ответ {self.name}", usage_metadata=None)
+
+
+class InvalidArgument(Exception):
+    code = 400
+
+
+def make_caller(models, **kwargs):
+    kwargs.setdefault("backoff", 0)
+
+    async def resolve(name, prompt=None):
+        return models[name]
+
+    return ModelCaller(resolve, list(models), **kwargs)
+
+
+def test_breaker_opens_after_failures_and_probes_after_reset():
+    """Тест: выключатель размыкается после ошибок подряд и пропускает один пробный вызов"""
+    clock = FakeClock()
+    breaker = CircuitBreaker("m", failure_threshold=2, reset_timeout=10, clock=clock)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN and not breaker.allow()
+
+    clock.now = 10
+    assert breaker.allow() and breaker.state == HALF_OPEN
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CLOSED and breaker.allow()
+
+
+def test_retries_transient_errors_but_not_client_errors():
+    """Тест: временная ошибка повторяется, ошибка запроса — нет"""
+    flaky = ScriptedModel("primary", [RuntimeError("503")])
+    response = asyncio.run(make_caller({"primary": flaky}).generate(["prompt"]))
+    assert response.text == "ответ primary" and flaky.calls == 2
+
+    invalid = ScriptedModel("primary", [InvalidArgument("bad request")])
+    with pytest.raises(InvalidArgument):
+        asyncio.run(make_caller({"primary": invalid}).generate(["prompt"]))
+    assert invalid.calls == 1
+
+
+def test_timeout_then_fallback_when_breaker_opens():
+    """Тест: зависший вызов прерывается по тайм-ауту, а разомкнутый выключатель уводит на резервную модель"""
+    primary = ScriptedModel("primary", [1.0, 1.0])
+    fallback = ScriptedModel("fallback")
+    caller = make_caller({"primary": primary, "fallback": fallback}, timeout=0.05, retries=1, failure_threshold=1)
+
+    response = asyncio.run(caller.generate(["prompt"]))
+
+    assert response.text == "ответ fallback"
+    assert primary.calls == 1 and caller.breakers["primary"].state == OPEN
+
+
+def test_all_breakers_open_raises_unavailable():
+    """Тест: без доступных моделей вызов сразу завершается ModelUnavailableError"""
+    model = ScriptedModel("primary", [RuntimeError("503")] * 3)
+    caller = make_caller({"primary": model}, retries=2, failure_threshold=1)
+    with pytest.raises(RuntimeError):
+        asyncio.run(caller.generate(["prompt"]))
+    with pytest.raises(ModelUnavailableError):
+        asyncio.run(caller.generate(["prompt"]))
+    assert model.calls == 1
+
+
+def test_hedged_request_returns_faster_response():
+    """Тест: если ответа нет дольше p95, второй запрос отвечает раньше первого"""
+    model = ScriptedModel("primary", [0.0] * 20 + [1.0, 0.0])
+    caller = make_caller({"primary": model}, hedge=True, hedge_min_delay=0.05, hedge_min_samples=20)
+
+    async def run():
+        for _ in range(20):
+            await caller.generate(["prompt"])
+        started = asyncio.get_running_loop().time()
+        await caller.generate(["prompt"])
+        return asyncio.get_running_loop().time() - started
+
+    assert asyncio.run(run()) < 0.5
+    assert model.calls == 22
+
+
+def test_open_breaker_returns_503_and_metric(fake_supabase, monkeypatch):
+    """Тест: при разомкнутом выключателе /analyze отвечает 503 с Retry-After, состояние видно в /metrics"""
+    model = ScriptedModel("primary", [RuntimeError("503")] * 10)
+    monkeypatch.setattr(main, "model", model)
+    monkeypatch.setattr(main, "GEMINI_BREAKER_FAILURES", 1)
+    monkeypatch.setattr(main, "model_caller", main.create_model_caller())
+    client = TestClient(main.app)
+
+    first = client.post("/analyze", files={"file": ("a.jpg", b"image a", "image/jpeg")})
+    second = client.post("/analyze", files={"file": ("b.jpg", b"image b", "image/jpeg")})
+
+    assert first.status_code == 500
+    assert second.status_code == 503 and second.headers["retry-after"]
+    assert model.calls == 1
+    assert f'ingria_gemini_circuit_state{{model="{main.MODEL_NAME}"}} 2.0' in client.get("/metrics").text
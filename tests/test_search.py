@@ -0,0 +1,108 @@
+import asyncio
+import subprocess
+import sys
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from search import SearchIndex, tokenize
+from tests.fakes import FakeSupabase
+
+
+def make_record(record_id, ai_response, file_name="photo.jpg", user_id="user-1"):
+    return {
+        "id": record_id,
+        "timestamp": "2026-10-17T12:00:00+00:00",
+        "user_id": user_id,
+        "ai_response": ai_response,
+        "file_name": file_name,
+        "file_path": f"https://storage/files/{record_id}.jpg",
+        "summary": ai_response[:20],
+    }
+
+
+RECORDS = [
+    make_record(1, "Закат над Невой в Санкт-Петербурге, видны разводные мосты."),
+    make_record(2, "Кот спит на подоконнике.", file_name="kot_peterburg.jpg"),
+    make_record(3, "Петербург, Петербург и снова Петербург: Невский проспект.", user_id="user-2"),
+    make_record(4, "Лес и река летом."),
+]
+
+
+def test_tokenize_stems_and_transliterates():
+    """Тест: формы слова, кириллица и латиница дают один термин; стоп-слова и хэши отбрасываются"""
+    assert tokenize("Петербурге") == tokenize("Петербургом") == tokenize("peterburg")
+    assert tokenize("Ёжик") == tokenize("ежик")
+    assert tokenize("в и на") == []
+    assert tokenize("photo_" + "a" * 64) == tokenize("photo")
+
+
+def test_index_ranks_and_paginates():
+    """Тест: результаты упорядочены по BM25, offset и user_id ограничивают выдачу"""
+    index = SearchIndex()
+    assert index.add_many(RECORDS) == 4
+    assert index.add_many(RECORDS[:1]) == 0
+
+    hits, total = index.search("Петербург")
+    assert total == 3
+    assert hits[0].record_id == 3
+    assert {hit.record_id for hit in hits} == {1, 2, 3}
+
+    page, total = index.search("peterburg", limit=1, offset=1)
+    assert total == 3 and [hit.record_id for hit in page] == [hits[1].record_id]
+    assert [hit.record_id for hit in index.search("Петербург", user_id="user-2")[0]] == [3]
+    assert index.search("Петербург", user_id="user-9") == ([], 0)
+    assert index.search("пингвин") == ([], 0)
+
+
+@pytest.fixture
+def query(monkeypatch):
+    query = FakeSupabase()
+    for method in ("select", "in_", "gt", "order", "limit"):
+        getattr(query, method).return_value = query
+    supabase = FakeSupabase()
+    supabase.table.return_value = query
+    monkeypatch.setattr(main, "supabase", supabase)
+    return query
+
+
+def test_search_endpoint_returns_ranked_records(query):
+    """Тест: записи из индекса читаются одним запросом и возвращаются в порядке релевантности"""
+    async def index():
+        await main.index_analysis_records(RECORDS)
+
+    asyncio.run(index())
+    query.execute.return_value.data = [RECORDS[0], RECORDS[2]]
+
+    response = TestClient(main.app).get("/analysis/search", params={"q": "мосты Петербурга", "limit": 2})
+
+    assert response.status_code == 200
+    data = response.json()
+    assert [item["id"] for item in data["items"]] == [1, 3]
+    assert data["items"][0]["score"] > data["items"][1]["score"]
+    assert data["total"] == 3 and data["next_offset"] == 2 and data["complete"] is False
+    assert query.select.call_args.args[0] == main.ANALYSIS_LIST_COLUMNS
+    assert sorted(query.in_.call_args.args[1]) == [1, 3]
+
+
+def test_main_import_does_not_load_numpy():
+    """Тест: numpy загружается только при первом поиске, а не при импорте приложения"""
+    code = "import sys, main; assert 'numpy' not in sys.modules, 'numpy imported'"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr[-500:]
+
+
+def test_rebuild_indexes_table_in_batches(query, monkeypatch):
+    """Тест: при запуске индекс строится по таблице порциями в порядке id"""
+    monkeypatch.setattr(main, "SEARCH_REBUILD_BATCH", 2)
+    query.execute.side_effect = [
+        type("Response", (), {"data": RECORDS[:2]}),
+        type("Response", (), {"data": RECORDS[2:]}),
+        type("Response", (), {"data": []}),
+    ]
+
+    asyncio.run(main.rebuild_search_index())
+
+    assert len(main.search_index) == 4 and main.search_index.complete
+    assert [call.args for call in query.gt.call_args_list] == [("id", 0), ("id", 2), ("id", 4)]
@@ -0,0 +1,61 @@
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_import_defers_clients_and_tolerates_missing_env():
+    """Тест: импорт main не импортирует SDK Gemini и Supabase и не завершает процесс без переменных окружения"""
+    env = {name: value for name, value in os.environ.items() if name not in main.REQUIRED_ENV_VARS}
+    output = subprocess.check_output(
+        [sys.executable, "-c", "import sys, main; print('google.generativeai' in sys.modules, 'supabase' in sys.modules)"],
+        cwd=ROOT,
+        env=env,
+        text=True,
+    )
+    assert output.split()[-2:] == ["False", "False"]
+
+
+def test_get_model_requires_api_key(monkeypatch):
+    """Тест: без GOOGLE_API_KEY модель не создаётся, а вызывающий код получает понятную ошибку"""
+    monkeypatch.setattr(main, "model", None)
+    monkeypatch.delenv("GOOGLE_API_KEY")
+    with pytest.raises(RuntimeError, match="GOOGLE_API_KEY"):
+        main.get_model()
+
+
+def test_get_supabase_is_memoized(monkeypatch):
+    """Тест: клиент Supabase создаётся один раз"""
+    monkeypatch.setattr(main, "supabase", None)
+
+    async def get_twice():
+        try:
+            return await main.get_supabase(), await main.get_supabase()
+        finally:
+            await main.close_supabase()
+
+    first, second = asyncio.run(get_twice())
+    assert first is second
+
+
+def test_lifespan_warms_up_in_background(fake_model, fake_supabase, monkeypatch):
+    """Тест: при запуске приложения клиенты и bucket готовятся в фоне"""
+    monkeypatch.setattr(main, "STARTUP_WARMUP", True)
+    fake_supabase.storage.list_buckets.return_value = []
+
+    with TestClient(main.app) as client:
+        assert client.get("/jobs/unknown").status_code == 404
+        for _ in range(100):
+            if fake_supabase.storage.create_bucket.called:
+                break
+            time.sleep(0.01)
+
+    fake_supabase.storage.create_bucket.assert_called_once_with("files")
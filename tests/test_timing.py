@@ -0,0 +1,28 @@
+import asyncio
+
+from timing import StageTimer
+
+
+def test_stage_timer_records_parallel_stages():
+    """Тест: параллельные этапы записываются, сумма этапов больше общего времени"""
+    timer = StageTimer()
+
+    async def run():
+        await asyncio.gather(
+            timer.run("storage", asyncio.sleep(0.05)),
+            timer.run("model", asyncio.sleep(0.05)),
+        )
+
+    asyncio.run(run())
+    assert set(timer.stages) == {"storage", "model"}
+    assert all(ms >= 45 for ms in timer.stages.values())
+    assert sum(timer.stages.values()) > timer.total_ms()
+    assert "итого=" in timer.summary()
+
+
+def test_stage_timer_server_timing_header():
+    """Тест: этапы и общее время в формате заголовка Server-Timing"""
+    timer = StageTimer()
+    timer.stages["model"] = 12.34
+    header = timer.server_timing()
+    assert header.startswith("model;dur=12.3, total;dur=")
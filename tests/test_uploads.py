@@ -0,0 +1,48 @@
+import asyncio
+import hashlib
+import io
+import os
+
+import pytest
+from fastapi import UploadFile
+
+from uploads import UploadTooLargeError, ingest_upload
+
+
+def make_upload(data: bytes) -> UploadFile:
+    return UploadFile(file=io.BytesIO(data), filename="voice.wav", headers={"content-type": "audio/wav"})
+
+
+def test_small_upload_stays_in_memory():
+    """Тест: файл меньше порога остаётся в памяти"""
+    data = b"a" * 100
+    upload = asyncio.run(ingest_upload(make_upload(data), max_bytes=1000, spool_threshold=500, chunk_size=16))
+    with upload:
+        assert not upload.spooled
+        assert upload.size == 100
+        assert upload.file_hash == hashlib.sha256(data).hexdigest()
+        assert upload.model_payload() == data
+        assert upload.content_type == "audio/wav"
+
+
+def test_large_upload_is_spooled_to_disk():
+    """Тест: файл больше порога сбрасывается во временный файл и удаляется при закрытии"""
+    data = os.urandom(5000)
+    upload = asyncio.run(ingest_upload(make_upload(data), max_bytes=10000, spool_threshold=1000, chunk_size=512))
+    with upload:
+        assert upload.spooled
+        path = upload.path
+        assert upload.model_payload() == data
+        assert upload.file_hash == hashlib.sha256(data).hexdigest()
+        payload = upload.storage_payload()
+        try:
+            assert payload.read() == data
+        finally:
+            payload.close()
+    assert not os.path.exists(path)
+
+
+def test_upload_over_limit_is_rejected_while_streaming():
+    """Тест: превышение лимита обнаруживается по ходу чтения"""
+    with pytest.raises(UploadTooLargeError):
+        asyncio.run(ingest_upload(make_upload(b"x" * 2000), max_bytes=1000, spool_threshold=100, chunk_size=256))
@@ -0,0 +1,96 @@
+import asyncio
+
+from writebehind import WriteBehindQueue
+
+
+class Recorder:
+    def __init__(self, failures=0):
+        self.batches = []
+        self.failures = failures
+
+    async def flush(self, rows):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("db unavailable")
+        self.batches.append(list(rows))
+        return [dict(row, id=i) for i, row in enumerate(rows)]
+
+
+def test_rows_are_coalesced_by_batch_size():
+    """Тест: строки объединяются в пакеты по max_batch"""
+    recorder = Recorder()
+    queue = WriteBehindQueue(recorder.flush, max_batch=3, flush_interval=10)
+
+    async def run():
+        await queue.start()
+        for i in range(6):
+            assert queue.enqueue({"n": i})
+        await asyncio.sleep(0.05)
+        assert [len(b) for b in recorder.batches] == [3, 3]
+        await queue.stop()
+
+    asyncio.run(run())
+
+
+def test_partial_batch_is_flushed_by_interval():
+    """Тест: неполный пакет записывается по истечении flush_interval"""
+    recorder = Recorder()
+    queue = WriteBehindQueue(recorder.flush, max_batch=100, flush_interval=0.05)
+
+    async def run():
+        await queue.start()
+        queue.enqueue({"n": 1})
+        queue.enqueue({"n": 2})
+        await asyncio.sleep(0.2)
+        assert recorder.batches == [[{"n": 1}, {"n": 2}]]
+        await queue.stop()
+
+    asyncio.run(run())
+
+
+def test_failed_flush_is_retried():
+    """Тест: ошибка записи повторяется с задержкой"""
+    recorder = Recorder(failures=2)
+    queue = WriteBehindQueue(recorder.flush, max_batch=10, flush_interval=0.01, backoff_base=0.01)
+
+    async def run():
+        await queue.start()
+        queue.enqueue({"n": 1})
+        await queue.stop()
+
+    asyncio.run(run())
+    assert recorder.batches == [[{"n": 1}]]
+
+
+def test_stop_drains_pending_rows_and_notifies_listeners():
+    """Тест: при остановке записываются все накопленные строки"""
+    recorder = Recorder()
+    written = []
+    queue = WriteBehindQueue(recorder.flush, max_batch=2, flush_interval=10)
+    queue.add_listener(written.extend)
+
+    async def run():
+        await queue.start()
+        for i in range(5):
+            queue.enqueue({"n": i})
+        await queue.stop()
+
+    asyncio.run(run())
+    assert sum(len(b) for b in recorder.batches) == 5
+    assert len(written) == 5
+
+
+def test_enqueue_refuses_when_full_or_stopped():
+    """Тест: enqueue возвращает False, если очередь заполнена или не запущена"""
+    recorder = Recorder()
+    queue = WriteBehindQueue(recorder.flush, max_batch=10, flush_interval=10, max_pending=2)
+    assert not queue.enqueue({"n": 0})
+
+    async def run():
+        await queue.start()
+        results = [queue.enqueue({"n": i}) for i in range(4)]
+        await queue.stop()
+        return results
+
+    results = asyncio.run(run())
+    assert results.count(False) >= 1
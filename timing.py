@@ -0,0 +1,46 @@
+# Замер длительности этапов обработки запроса
+
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Dict, TypeVar
+
+T = TypeVar("T")
+
+
+class StageTimer:
+    """
+    Собирает длительность именованных этапов одного запроса в миллисекундах.
+
+    Этапы могут выполняться параллельно, поэтому сумма этапов может быть
+    больше общего времени — разница показывает, сколько сэкономил параллелизм.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = (time.perf_counter() - started) * 1000
+
+    async def run(self, name: str, awaitable: Awaitable[T]) -> T:
+        """Ожидает `awaitable`, записывая время как этап `name`."""
+        with self.stage(name):
+            return await awaitable
+
+    def total_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+    def server_timing(self) -> str:
+        """Значение заголовка Server-Timing: этапы и общее время."""
+        entries = [f"{name};dur={ms:.1f}" for name, ms in self.stages.items()]
+        entries.append(f"total;dur={self.total_ms():.1f}")
+        return ", ".join(entries)
+
+    def summary(self) -> str:
+        stages = " ".join(f"{name}={ms:.1f}ms" for name, ms in self.stages.items())
+        return f"{stages} сумма={sum(self.stages.values()):.1f}ms итого={self.total_ms():.1f}ms"
@@ -0,0 +1,208 @@
+# Потоковый приём загружаемых файлов с ограничением по размеру
+
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+from typing import BinaryIO, Callable, Optional, Union
+
+from fastapi import UploadFile
+from starlette.exceptions import HTTPException
+from starlette.responses import JSONResponse
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class UploadTooLargeError(Exception):
+    """Файл превышает допустимый размер."""
+
+    def __init__(self, max_bytes: int):
+        super().__init__(f"Размер файла превышает {max_bytes} байт")
+        self.max_bytes = max_bytes
+
+
+class IngestedUpload:
+    """
+    Принятый файл: содержимое, размер и SHA-256.
+
+    Пока размер не превышает `spool_threshold`, содержимое хранится в памяти;
+    дальше оно сбрасывается во временный файл на диске. Хэш и размер
+    считаются по ходу чтения, поэтому весь файл никогда не собирается в один
+    объект `bytes` без необходимости.
+    """
+
+    def __init__(self, filename: str, content_type: str, spool_threshold: int):
+        self.filename = filename
+        self.content_type = content_type
+        self.size = 0
+        self.spool_threshold = spool_threshold
+        self._digest = hashlib.sha256()
+        self._memory: Optional[io.BytesIO] = io.BytesIO()
+        self._disk: Optional[BinaryIO] = None
+
+    @property
+    def file_hash(self) -> str:
+        return self._digest.hexdigest()
+
+    @property
+    def spooled(self) -> bool:
+        """True, если содержимое лежит во временном файле на диске."""
+        return self._disk is not None
+
+    @property
+    def path(self) -> Optional[str]:
+        return self._disk.name if self._disk is not None else None
+
+    def write(self, chunk: bytes) -> None:
+        self.size += len(chunk)
+        self._digest.update(chunk)
+        if self._disk is None and self.size > self.spool_threshold:
+            self._disk = tempfile.NamedTemporaryFile(prefix="ingria-upload-", delete=False)
+            self._disk.write(self._memory.getbuffer())
+            self._memory = None
+        if self._disk is not None:
+            self._disk.write(chunk)
+        else:
+            self._memory.write(chunk)
+
+    def finish(self) -> None:
+        if self._disk is not None:
+            self._disk.flush()
+
+    def storage_payload(self) -> Union[bytes, BinaryIO]:
+        """
+        Содержимое для загрузки в Supabase Storage.
+
+        Для файла на диске возвращается отдельный файловый объект — httpx
+        отправит его по частям, не читая целиком в память.
+        """
+        if self._disk is None:
+            return self._memory.getvalue()
+        return open(self._disk.name, "rb")
+
+    def model_payload(self) -> bytes:
+        """
+        Содержимое для inline-передачи в Gemini.
+
+        protobuf принимает только bytes, поэтому для файла на диске это
+        единственная полная копия содержимого в памяти.
+        """
+        if self._disk is None:
+            return self._memory.getvalue()
+        with open(self._disk.name, "rb") as f:
+            return f.read()
+
+    def save_to(self, path: str) -> None:
+        """Сохраняет содержимое в файл `path`, например чтобы обработать его позже."""
+        if self._disk is None:
+            with open(path, "wb") as f:
+                f.write(self._memory.getbuffer())
+            return
+        self._disk.flush()
+        try:
+            # Жёсткая ссылка не копирует данные и переживает удаление временного файла
+            os.link(self._disk.name, path)
+        except OSError:
+            shutil.copyfile(self._disk.name, path)
+
+    def close(self) -> None:
+        if self._disk is not None:
+            self._disk.close()
+            try:
+                os.unlink(self._disk.name)
+            except FileNotFoundError:
+                pass
+        self._memory = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+async def ingest_upload(file: UploadFile, max_bytes: int, spool_threshold: int, chunk_size: int = CHUNK_SIZE) -> IngestedUpload:
+    """
+    Читает UploadFile частями, считая хэш и проверяя лимит размера по ходу чтения.
+
+    При превышении `max_bytes` чтение прекращается и выбрасывается UploadTooLargeError.
+    К этому моменту starlette уже принял всё тело multipart (большие файлы —
+    во временный файл), поэтому сетевой приём ограничивает не эта функция, а
+    UploadSizeLimitMiddleware; здесь проверяется размер отдельного файла.
+    """
+    upload = IngestedUpload(file.filename, file.content_type, spool_threshold)
+    try:
+        while True:
+            chunk = await file.read(chunk_size)
+            if not chunk:
+                break
+            if upload.size + len(chunk) > max_bytes:
+                raise UploadTooLargeError(max_bytes)
+            upload.write(chunk)
+        upload.finish()
+    except BaseException:
+        upload.close()
+        raise
+    finally:
+        # Исходный буфер starlette больше не нужен — освобождаем его сразу
+        await file.close()
+    return upload
+
+
+def ingest_path(path: str, filename: str, content_type: str, spool_threshold: int, chunk_size: int = CHUNK_SIZE) -> IngestedUpload:
+    """Читает ранее сохранённый файл в IngestedUpload, заново считая хэш и размер."""
+    upload = IngestedUpload(filename, content_type, spool_threshold)
+    try:
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                upload.write(chunk)
+        upload.finish()
+    except BaseException:
+        upload.close()
+        raise
+    return upload
+
+
+class UploadSizeLimitMiddleware:
+    """
+    ASGI-middleware: ограничивает размер тела POST-запросов загрузки.
+
+    `max_body_bytes(path)` возвращает лимит тела для пути или None, если
+    путь не ограничивается. Запрос с большим Content-Length отклоняется
+    сразу; тело без Content-Length (chunked) считается по мере приёма, и
+    при превышении лимита чтение прерывается ошибкой 413 до того, как
+    starlette сохранит остаток на диск.
+    """
+
+    def __init__(self, app, max_body_bytes: Callable[[str], Optional[int]]):
+        self.app = app
+        self.max_body_bytes = max_body_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST":
+            return await self.app(scope, receive, send)
+        limit = self.max_body_bytes(scope["path"])
+        if limit is None:
+            return await self.app(scope, receive, send)
+        detail = f"Размер запроса превышает {limit} байт"
+        content_length = dict(scope["headers"]).get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > limit:
+            response = JSONResponse(status_code=413, content={"detail": detail})
+            return await response(scope, receive, send)
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # FastAPI пробрасывает HTTPException из чтения тела как есть
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
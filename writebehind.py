@@ -0,0 +1,144 @@
+# Отложенная пакетная запись строк в базу данных (write-behind)
+
+import asyncio
+import logging
+import random
+from typing import Awaitable, Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class WriteBehindQueue:
+    """
+    Очередь отложенной записи.
+
+    Строки накапливаются в ограниченной очереди и записываются пакетами —
+    когда набралось `max_batch` строк или прошло `flush_interval` секунд
+    с первой строки пакета. Неудачная запись повторяется с экспоненциальной
+    задержкой. Если очередь заполнена или не запущена, `enqueue` возвращает
+    False, и вызывающий код должен записать строку сам через `write_now`.
+
+    `flush` получает список строк и возвращает записанные строки (с id);
+    слушатели из `add_listener` получают их после каждой успешной записи.
+    """
+
+    def __init__(
+        self,
+        flush: Callable[[List[dict]], Awaitable[List[dict]]],
+        max_batch: int = 50,
+        flush_interval: float = 0.5,
+        max_pending: int = 1000,
+        max_retries: int = 5,
+        backoff_base: float = 0.5,
+        backoff_max: float = 10.0,
+    ):
+        self._flush = flush
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._listeners: List[Callable[[List[dict]], None]] = []
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def add_listener(self, listener: Callable[[List[dict]], None]) -> None:
+        self._listeners.append(listener)
+
+    def enqueue(self, row: dict) -> bool:
+        """Ставит строку в очередь; False — очередь заполнена или не запущена."""
+        if not self.running:
+            return False
+        try:
+            self._queue.put_nowait(row)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def write_now(self, rows: List[dict]) -> List[dict]:
+        """Записывает строки сразу, минуя очередь, и уведомляет слушателей."""
+        written = await self._flush(rows)
+        self._notify(written)
+        return written
+
+    async def start(self) -> None:
+        if self.running:
+            return
+        # +1 место для маркера остановки
+        self._queue = asyncio.Queue(maxsize=self.max_pending + 1)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Дожидается записи всех накопленных строк (не дольше `timeout` секунд)."""
+        if not self.running:
+            return
+        await self._queue.put(_STOP)
+        try:
+            await asyncio.wait_for(asyncio.shield(self._task), timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"Отложенная запись не завершилась за {timeout} с, потеряно строк: {self.pending}")
+            self._task.cancel()
+
+    async def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            first = await self._queue.get()
+            if first is _STOP:
+                break
+            batch = [first]
+            deadline = asyncio.get_running_loop().time() + self.flush_interval
+            while len(batch) < self.max_batch:
+                timeout = deadline - asyncio.get_running_loop().time()
+                if timeout <= 0:
+                    break
+                try:
+                    row = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if row is _STOP:
+                    stopping = True
+                    break
+                batch.append(row)
+            await self._flush_with_retry(batch)
+
+        # Остановка: записываем всё, что осталось в очереди, без ожидания интервала
+        remaining = []
+        while not self._queue.empty():
+            row = self._queue.get_nowait()
+            if row is not _STOP:
+                remaining.append(row)
+        for start in range(0, len(remaining), self.max_batch):
+            await self._flush_with_retry(remaining[start:start + self.max_batch])
+
+    async def _flush_with_retry(self, batch: List[dict]) -> None:
+        for attempt in range(self.max_retries + 1):
+            try:
+                written = await self._flush(batch)
+            except Exception as e:
+                if attempt == self.max_retries:
+                    logger.error(f"Не удалось записать пакет из {len(batch)} строк после {attempt + 1} попыток: {e}")
+                    return
+                delay = min(self.backoff_max, self.backoff_base * 2 ** attempt) * random.uniform(0.5, 1.0)
+                logger.warning(f"Ошибка записи пакета из {len(batch)} строк, повтор через {delay:.2f} с: {e}")
+                await asyncio.sleep(delay)
+            else:
+                self._notify(written)
+                return
+
+    def _notify(self, written: List[dict]) -> None:
+        for listener in self._listeners:
+            try:
+                listener(written)
+            except Exception as e:
+                logger.error(f"Ошибка в обработчике записанных строк: {e}")